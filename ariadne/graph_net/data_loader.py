@@ -46,7 +46,8 @@ class GraphsDataLoaderNew(BaseDataLoader):
                  n_train: int,
                  n_valid: int,
                  drop_last: bool = True,
-                 with_random=True):
+                 with_random=True,
+                 sampler_cls: Callable = GraphBatchBucketSampler):
         super(GraphsDataLoaderNew, self).__init__(-1)
         self.dataset = dataset(n_samples=n_valid + n_train)
         if with_random:
@@ -57,8 +58,9 @@ class GraphsDataLoaderNew(BaseDataLoader):
             self.train_data = SubsetWithItemLen(self.train_data, range(0, n_train))
             self.val_data = SubsetWithItemLen(self.val_data, range(n_train, n_train + n_valid))
 
-        self.train_sampler = GraphBatchBucketSampler(self.train_data)
-        self.val_sampler = GraphBatchBucketSampler(self.val_data)
+        # GraphEdgeBudgetSampler for packed_graph_collate_fn
+        self.train_sampler = sampler_cls(self.train_data)
+        self.val_sampler = sampler_cls(self.val_data)
 
         self.collate_fn = collate_fn
         self.drop_last = drop_last
@@ -14,8 +14,10 @@ LOGGER = logging.getLogger('ariadne.graph.dataset')
 @gin.configurable
 class GraphDataset(Dataset):
 
-    def __init__(self, input_dir, n_samples=None):
+    def __init__(self, input_dir, n_samples=None, sparse=False):
         self.input_dir = os.path.expandvars(input_dir)
+        # load SparseGraph as stored, without the dense matrices (for sparse_graph_collate_fn)
+        self.sparse = sparse
         LOGGER.info(f"[GraphDataset] Building dataset for folder '{self.input_dir}'")
         scanner = os.scandir(self.input_dir)
         if n_samples is None:
@@ -44,7 +46,7 @@ class GraphDataset(Dataset):
     def __getitem__(self, index):
         # uncomment to find bad events in the dataset:
         # print(index, self.filenames[index])
-        return load_graph(self.filenames[index])
+        return load_graph(self.filenames[index], sparse=self.sparse)
 
     def __len__(self):
         return len(self.filenames)
@@ -65,8 +67,8 @@ class GraphDatasetFromMemory(Dataset):
 
 class MemoryDataset(GraphDataset):
 
-    def __init__(self, input_dir, n_samples):
-        super(MemoryDataset, self).__init__(input_dir=input_dir, n_samples=n_samples)
+    def __init__(self, input_dir, n_samples, sparse=False):
+        super(MemoryDataset, self).__init__(input_dir=input_dir, n_samples=n_samples, sparse=sparse)
 
     def load_data(self):
         raise NotImplementedError
@@ -79,12 +81,15 @@ class ItemLengthGetter(object):
     def get_item_length(self, item_index):
         raise NotImplementedError
 
+    def get_item_edges(self, item_index):
+        raise NotImplementedError
+
 
 @gin.configurable
 class GraphsDatasetMemory(MemoryDataset, ItemLengthGetter):
 
-    def __init__(self, input_dir, n_samples=None, pin_mem=False):
-        super().__init__(os.path.expandvars(input_dir), n_samples=n_samples)
+    def __init__(self, input_dir, n_samples=None, pin_mem=False, sparse=False):
+        super().__init__(os.path.expandvars(input_dir), n_samples=n_samples, sparse=sparse)
         self.pin_mem = pin_mem
         self.graphs = {}
 
@@ -94,11 +99,14 @@ class GraphsDatasetMemory(MemoryDataset, ItemLengthGetter):
             if item_index in self.graphs:
                 item = self.graphs[item_index]
             else:
-                item = self.graphs[item_index] = load_graph(self.filenames[item_index])
+                item = self.graphs[item_index] = load_graph(self.filenames[item_index], sparse=self.sparse)
         else:
-            item = load_graph(self.filenames[item_index])
+            item = load_graph(self.filenames[item_index], sparse=self.sparse)
         return len(item.y)
 
+    def get_item_edges(self, item_index):
+        return self.get_item_length(item_index)
+
     def __getitem__(self, index):
         # uncomment to find bad events in the dataset:
         # print(index, self.filenames[index])
@@ -106,9 +114,9 @@ class GraphsDatasetMemory(MemoryDataset, ItemLengthGetter):
             if index in self.graphs:
                 item = self.graphs[index]
             else:
-                item = self.graphs[index] = load_graph(self.filenames[index])
+                item = self.graphs[index] = load_graph(self.filenames[index], sparse=self.sparse)
             return item
-        return load_graph(self.filenames[index])
+        return load_graph(self.filenames[index], sparse=self.sparse)
 
     def __len__(self):
         return len(self.filenames)
@@ -120,6 +128,9 @@ class SubsetWithItemLen(Subset, ItemLengthGetter):
     def get_item_length(self, item_index):
         return len(self.dataset[self.indices[item_index]].y)
 
+    def get_item_edges(self, item_index):
+        return len(self.dataset[self.indices[item_index]].y)
+
 
 @gin.configurable(denylist=['data_source'])
 class GraphBatchBucketSampler(Sampler):
@@ -255,3 +266,105 @@ def collate_fn(graphs):
     batch_inputs = [torch.from_numpy(bm) for bm in [batch_X, batch_Ri, batch_Ro]]
     batch_target = torch.from_numpy(batch_y)
     return {'inputs': batch_inputs}, batch_target
+
+
+@gin.configurable('sparse_graph_collate_fn')
+def sparse_collate_fn(graphs):
+    """Batch of SparseGraph without the dense Ri and Ro. X and y are zero-padded as by collate_fn,
+    Ri and Ro are the positions of the incoming and of the outgoing hit of every edge, (batch, max_edges) long tensors.
+    Padding edges point to the hit `max_nodes` after the last one, which is taken as zero and dropped by the model."""
+    batch_size = len(graphs)
+    n_features = graphs[0].X.shape[1]
+    n_nodes = np.array([g.X.shape[0] for g in graphs])
+    n_edges = np.array([g.y.shape[0] for g in graphs])
+    max_nodes = n_nodes.max()
+    max_edges = n_edges.max()
+
+    batch_X = np.zeros((batch_size, max_nodes, n_features), dtype=np.float32)
+    batch_Ri = np.full((batch_size, max_edges), max_nodes, dtype=np.int64)
+    batch_Ro = np.full((batch_size, max_edges), max_nodes, dtype=np.int64)
+    batch_y = np.zeros((batch_size, max_edges), dtype=np.float32)
+
+    for i, g in enumerate(graphs):
+        batch_X[i, :n_nodes[i]] = g.X
+        # every edge has one incoming and one outgoing hit
+        batch_Ri[i, g.Ri_cols] = g.Ri_rows
+        batch_Ro[i, g.Ro_cols] = g.Ro_rows
+        batch_y[i, :n_edges[i]] = g.y
+
+    batch_inputs = [torch.from_numpy(bm) for bm in [batch_X, batch_Ri, batch_Ro]]
+    batch_target = torch.from_numpy(batch_y)
+    return {'inputs': batch_inputs}, batch_target
+
+
+@gin.configurable('packed_graph_collate_fn')
+def packed_collate_fn(graphs):
+    """Batch of SparseGraph packed into one disjoint-union graph without padding: X is (nodes, features)
+    of all the graphs one after another, Ri and Ro are the positions of the incoming and of the outgoing hit
+    of every edge in it, y is (edges,) and `batch` is the number of the graph of every hit."""
+    n_nodes = np.array([g.X.shape[0] for g in graphs])
+    n_edges = np.array([g.y.shape[0] for g in graphs])
+    node_offsets = np.cumsum(n_nodes) - n_nodes
+    edge_offsets = np.cumsum(n_edges) - n_edges
+
+    batch_Ri = np.empty(n_edges.sum(), dtype=np.int64)
+    batch_Ro = np.empty(n_edges.sum(), dtype=np.int64)
+    for i, g in enumerate(graphs):
+        # every edge has one incoming and one outgoing hit
+        batch_Ri[edge_offsets[i] + g.Ri_cols] = node_offsets[i] + g.Ri_rows
+        batch_Ro[edge_offsets[i] + g.Ro_cols] = node_offsets[i] + g.Ro_rows
+    batch_X = np.concatenate([g.X for g in graphs]).astype(np.float32, copy=False)
+    batch_y = np.concatenate([g.y for g in graphs]).astype(np.float32, copy=False)
+    batch = np.repeat(np.arange(len(graphs)), n_nodes)
+
+    batch_inputs = [torch.from_numpy(bm) for bm in [batch_X, batch_Ri, batch_Ro]]
+    batch_target = torch.from_numpy(batch_y)
+    return {'inputs': batch_inputs, 'batch': torch.from_numpy(batch)}, batch_target
+
+
+@gin.configurable(denylist=['data_source'])
+class GraphEdgeBudgetSampler(Sampler):
+    """Batches of the graphs with at most `max_edges` in total instead of the fixed number of the graphs,
+    for packed_graph_collate_fn. Larger graph makes the batch alone.
+    Without `shuffle` the graphs are packed once in the order of their edges (`get_item_edges` of the data source).
+    With `shuffle` they are packed again in the new random order after every epoch, so the batches are made
+    of the different graphs every epoch; `__len__` is the number of the batches of the packing of the current
+    epoch, it changes between the epochs by a few batches at most."""
+    def __init__(self, data_source: SubsetWithItemLen,
+                 max_edges,
+                 shuffle):
+        super(GraphEdgeBudgetSampler, self).__init__(data_source)
+        self.data_source = data_source
+        self.max_edges = max_edges
+        self.shuffle = shuffle
+
+        logging.info("_build edges:")
+        self.edges = np.array([self.data_source.get_item_edges(key)
+                               for key in tqdm(range(len(self.data_source)))])
+        self.indices = self._make_batches(self._order())
+
+    def _order(self):
+        if self.shuffle:
+            return torch.randperm(len(self.edges), generator=None).tolist()
+        return np.argsort(self.edges, kind='stable')
+
+    def _make_batches(self, order):
+        batches = [[]]
+        total = 0
+        for item in order:
+            if batches[-1] and total + self.edges[item] > self.max_edges:
+                batches.append([])
+                total = 0
+            batches[-1].append(int(item))
+            total += self.edges[item]
+        return [batch for batch in batches if batch]
+
+    def __iter__(self):
+        for batch in self.indices:
+            yield batch
+        if self.shuffle:
+            # the packing of the next epoch, made after this one so __len__ stays the same during the epoch
+            self.indices = self._make_batches(self._order())
+
+    def __len__(self):
+        return len(self.indices)
@@ -4,15 +4,21 @@ A Graph is a namedtuple of matrices X, Ri, Ro, y.
 """
 
 from collections import namedtuple
-from typing import List
+from typing import List, Union
 
 import numpy as np
 
 
 # A Graph is a namedtuple of matrices (X, Ri, Ro, y)
 Graph = namedtuple('Graph', ['X', 'Ri', 'Ro', 'y'])
+# A SparseGraph keeps the nonzero positions of Ri and Ro instead of the matrices, as they are stored on disk
+SparseGraph = namedtuple('SparseGraph', ['X', 'Ri_rows', 'Ri_cols', 'Ro_rows', 'Ro_cols', 'y'])
 
 def graph_to_sparse(graph):
+    if isinstance(graph, SparseGraph):
+        return dict(X=graph.X, y=graph.y,
+                    Ri_rows=graph.Ri_rows, Ri_cols=graph.Ri_cols,
+                    Ro_rows=graph.Ro_rows, Ro_cols=graph.Ro_cols)
     Ri_rows, Ri_cols = graph.Ri.nonzero()
     Ro_rows, Ro_cols = graph.Ro.nonzero()
     return dict(X=graph.X, y=graph.y,
@@ -43,12 +49,14 @@ def save_graphs_new(graphs):
     for graph_data_chunk in graphs:
         if graph_data_chunk.processed_object is None:
             continue
-        processed_graph: Graph = graph_data_chunk.processed_object
+        processed_graph: Union[Graph, SparseGraph] = graph_data_chunk.processed_object
         save_graph(processed_graph,
                    graph_data_chunk.output_name)
 
 
-def load_graph(filename):
-    """Reade a single graph NPZ"""
+def load_graph(filename, sparse=False):
+    """Reade a single graph NPZ, as the SparseGraph if `sparse`"""
     with np.load(filename) as f:
+        if sparse:
+            return SparseGraph(**dict(f.items()))
         return sparse_to_graph(**dict(f.items()))
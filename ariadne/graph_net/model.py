@@ -1,6 +1,7 @@
 import gin
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class EdgeNetwork(nn.Module):
     """
@@ -53,6 +54,55 @@ class NodeNetwork(nn.Module):
         return self.network(M)
 
 
+def gather_edges(X, index):
+    """Features of the hits (batch, nodes, features) at the positions (batch, edges).
+    Padding edges of sparse_graph_collate_fn point to the position `nodes` and get zeros.
+    Packed batch of packed_graph_collate_fn has no batch dimension and no padding."""
+    if X.dim() == 2:
+        return X.index_select(0, index)
+    X = F.pad(X, (0, 0, 0, 1))
+    return torch.gather(X, 1, index.unsqueeze(-1).expand(-1, -1, X.shape[-1]))
+
+
+def scatter_edges(values, index, n_nodes):
+    """Sums of the values of the edges (batch, edges, features) over the hits at the positions (batch, edges),
+    the padding edges are dropped. Packed batch has no batch dimension and no padding."""
+    if values.dim() == 2:
+        return values.new_zeros(n_nodes, values.shape[-1]).index_add_(0, index, values)
+    out = values.new_zeros(values.shape[0], n_nodes + 1, values.shape[-1])
+    out.scatter_add_(1, index.unsqueeze(-1).expand_as(values), values)
+    return out[:, :n_nodes]
+
+
+class SparseEdgeNetwork(EdgeNetwork):
+    """
+    EdgeNetwork with the positions of the incoming (Ri) and outgoing (Ro) hit
+    of every edge instead of the incidence matrices, the same parameters.
+    """
+    def forward(self, X, Ri, Ro):
+        # Select the features of the associated nodes
+        bo = gather_edges(X, Ro)
+        bi = gather_edges(X, Ri)
+        B = torch.cat([bo, bi], dim=-1)
+        # Apply the network to each edge
+        return self.network(B).squeeze(-1)
+
+
+class SparseNodeNetwork(NodeNetwork):
+    """
+    NodeNetwork with the positions of the incoming (Ri) and outgoing (Ro) hit
+    of every edge instead of the incidence matrices, the same parameters.
+    """
+    def forward(self, X, e, Ri, Ro):
+        bo = gather_edges(X, Ro)
+        bi = gather_edges(X, Ri)
+        # weighted features of the other end of the edges summed over the incoming and the outgoing edges
+        mi = scatter_edges(bo * e[..., None], Ri, X.shape[-2])
+        mo = scatter_edges(bi * e[..., None], Ro, X.shape[-2])
+        M = torch.cat([mi, mo, X], dim=-1)
+        return self.network(M)
+
+
 @gin.configurable
 class GraphNet_v1(nn.Module):
     """Builds TrackNETv2 model
@@ -61,6 +111,8 @@ class GraphNet_v1(nn.Module):
         input_features: number of input features (channels)
         rnn_type: type of the rnn unit, one of [`lstm`, `gru`]
     """
+    edge_network_cls = EdgeNetwork
+    node_network_cls = NodeNetwork
 
     def __init__(self,
                  input_dim,
@@ -74,11 +126,11 @@ class GraphNet_v1(nn.Module):
             nn.Linear(input_dim, hidden_dim),
             hidden_activation())
         # Setup the edge network
-        self.edge_network = EdgeNetwork(input_dim + hidden_dim, hidden_dim,
-                                        hidden_activation)
+        self.edge_network = self.edge_network_cls(input_dim + hidden_dim, hidden_dim,
+                                                  hidden_activation)
         # Setup the node layers
-        self.node_network = NodeNetwork(input_dim + hidden_dim, hidden_dim,
-                                        hidden_activation)
+        self.node_network = self.node_network_cls(input_dim + hidden_dim, hidden_dim,
+                                                  hidden_activation)
 
     def forward(self, inputs):
         """Apply forward pass of the model"""
@@ -97,3 +149,19 @@ class GraphNet_v1(nn.Module):
             H = torch.cat([H, X], dim=-1)
         # Apply final edge network
         return self.edge_network(H, Ri, Ro)
+
+
+@gin.configurable
+class SparseGraphNet_v1(GraphNet_v1):
+    """GraphNet_v1 on the batches of sparse_graph_collate_fn or packed_graph_collate_fn: the inputs are X
+    and the positions of the incoming and outgoing hit of every edge, the hits are gathered and summed per edge
+    instead of the products with the dense incidence matrices.
+    Parameters are the same, so the checkpoints of GraphNet_v1 are loaded as they are.
+    """
+    edge_network_cls = SparseEdgeNetwork
+    node_network_cls = SparseNodeNetwork
+
+    def forward(self, inputs, batch=None):
+        """Apply forward pass of the model, `batch` is the graph of every hit of the packed batch.
+        Edges do not cross the graphs, so it is not needed by the message passing."""
+        return super().forward(inputs)
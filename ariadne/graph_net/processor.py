@@ -1,6 +1,6 @@
 import logging
 import os
-from typing import List, Tuple, Optional, Iterable
+from typing import List, Tuple, Optional, Iterable, Union
 
 import gin
 import pandas as pd
@@ -13,7 +13,7 @@ from ariadne.preprocessing import (
     ProcessedDataChunk,
     ProcessedData
 )
-from ariadne.graph_net.graph_utils.graph import Graph, save_graphs_new
+from ariadne.graph_net.graph_utils.graph import Graph, SparseGraph, save_graphs_new
 from ariadne.graph_net.graph_utils.graph_prepare_utils import (
     to_pandas_graph_from_df,
     get_pd_line_graph,
@@ -33,7 +33,7 @@ class GraphDataChunk(DataChunk):
 
 class ReversedDiGraphDataChunk(ProcessedDataChunk):
     def __init__(self,
-                 processed_object: Optional[Graph],
+                 processed_object: Optional[Union[Graph, SparseGraph]],
                  output_name: str):
         super().__init__(processed_object)
         self.processed_object = processed_object
@@ -90,10 +90,14 @@ class GraphNet_Processor(DataProcessor):
             return ReversedDiGraphDataChunk(None, output_name)
 
         chunk_df = chunk_df[['event', 'r', 'phi', 'z', 'station', 'track']]
+        # only the segments which pass the restrictions of the nodes are made
         pd_graph_df = to_pandas_graph_from_df(
             single_event_df=chunk_df,
             suffixes=self._suffixes_df,
-            compute_is_true_track=True
+            compute_is_true_track=True,
+            restrictions_0=self.func_vals['get_pd_line_graph']['restrictions_0'],
+            restrictions_1=self.func_vals['get_pd_line_graph']['restrictions_1'],
+            axes=self.func_vals['get_supernodes_df']['axes']
         )
 
         nodes_t, edges_t = get_pd_line_graph(
@@ -116,6 +120,7 @@ class GraphNet_Processor(DataProcessor):
             edges=edges_filtered,
             feature_names=['y_p', 'y_c', 'z_p', 'z_c', 'z'],
             feature_scale=[1., 1., 1., 1., 1.],
+            sparse=True
         )
         return ReversedDiGraphDataChunk(out, output_name)
 
@@ -1,5 +1,46 @@
+from typing import Union, Iterable, Generator
+
+import numpy as np
 import pandas as pd
 
+
 def parse_df(file_path: str,
              **read_csv_kw_params) -> pd.DataFrame:
     return pd.read_csv(file_path, **read_csv_kw_params)
+
+
+def parse_df_chunks(file_path: str,
+                    chunk_rows: int,
+                    event_idxs: Union[Iterable[int], None] = None,
+                    **read_csv_kw_params) -> Generator[pd.DataFrame, None, None]:
+    """Reads the csv by chunks of about `chunk_rows` rows, chunks are cut only on the event boundaries.
+    Hits of each event are expected to be contiguous in the file. Row indices are the same as for the whole file.
+
+    # Args:
+        chunk_rows (int): number of rows read at once
+        event_idxs (iterable of ints, None by default): if set, only these events are kept and the reading
+                                                         stops as soon as all of them are read
+    """
+    remaining = None if event_idxs is None else set(int(event) for event in event_idxs)
+    tail = None
+    for chunk in pd.read_csv(file_path, chunksize=chunk_rows, **read_csv_kw_params):
+        if tail is not None:
+            chunk = pd.concat([tail, chunk])
+        # the last event may continue in the next chunk
+        events = chunk.event.values
+        other_events = np.flatnonzero(events != events[-1])
+        split = other_events[-1] + 1 if len(other_events) > 0 else 0
+        chunk, tail = chunk.iloc[:split], chunk.iloc[split:]
+
+        if remaining is not None:
+            chunk = chunk[chunk.event.isin(remaining)]
+            remaining.difference_update(chunk.event.unique())
+        if not chunk.empty:
+            yield chunk
+        if remaining is not None and not remaining:
+            return
+
+    if tail is not None and remaining is not None:
+        tail = tail[tail.event.isin(remaining)]
+    if tail is not None and not tail.empty:
+        yield tail
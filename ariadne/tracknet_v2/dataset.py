@@ -8,6 +8,7 @@ from copy import deepcopy
 import gin
 
 from ariadne.utils.data import load_data
+from ariadne_v2.hit_format import HitFile, is_hit_file
 
 # Ignore warnings
 import warnings
@@ -19,11 +20,11 @@ class PreprocessingBESDataset(Dataset):
     def __init__(self, csv_file, preprocessing=None, needed_columns=('r', 'phi', 'z'), use_next_z=False):
         """
         Args:
-            csv_file (string): Path to the csv file with data.
+            csv_file (string): Path to the csv file or to the hit file with data.
             preprocessing (callable, optional): Optional transform to be applied
                 on a dataframe.
         """
-        self.frame = pd.read_csv(csv_file)
+        self.frame = HitFile(csv_file).read() if is_hit_file(csv_file) else pd.read_csv(csv_file)
         if preprocessing:
             self.frame = preprocessing(self.frame)
         assert all([item in (list(self.frame.columns)) for item in needed_columns]), 'One or more columns are not in dataframe!'
@@ -156,16 +156,52 @@ class BaseFilter(BaseTransformer):
         tracks = data.groupby([self.event_column, self.track_column])
         if self.num_stations is None:
             self.num_stations = tracks.size().max()
-        good_tracks = tracks.filter(self.filter_rule)
-        broken = list(data.loc[~data.index.isin(good_tracks.index)].index)
+        good_hits = self.good_hits(data, tracks)
+        broken = ~good_hits
         self._broken_tracks = data.loc[broken, [self.event_column, self.track_column, self.station_column]]
         self._num_broken_tracks = len(self._broken_tracks[[self.event_column, self.track_column]].drop_duplicates())
         if self.keep_filtered:
-            data.loc[~data.index.isin(good_tracks.index), 'track'] = -1
+            data.loc[broken, 'track'] = -1
         else:
-            data = data.loc[data.index.isin(good_tracks.index), :]
+            data = data.loc[good_hits, :]
         return self.add_fakes(data, fakes)
 
+    def good_hits(self, data, tracks):
+        """Mask of the hits of the tracks passing the filter. `filter_rule` is called for every track here,
+        the filters with the known rules override it with the vectorized version (see `track_stats`).
+        """
+        return data.index.isin(tracks.filter(self.filter_rule).index)
+
+    def track_stats(self, data, tracks, with_stations=True):
+        """Per-track reductions without python calls per track, the hits are sorted by (track, station) keys.
+        # Returns:
+            codes (np.ndarray): number of the track of every hit, -1 for the hits out of the groups
+            sizes, stations_num, max_station (np.ndarray): number of hits, number of unique stations
+                                                          and max station of every track
+        """
+        codes = tracks.ngroup().values
+        in_groups = codes >= 0
+        sizes = np.bincount(codes[in_groups], minlength=tracks.ngroups)
+        if not with_stations:
+            return codes, sizes, None, None
+
+        station_codes, station_values = pd.factorize(data[self.station_column].values, sort=True)
+        stations_range = len(station_values) + 1
+        # unique (track, station) pairs, sorted by the track and then by the station
+        keys = np.unique(codes[in_groups].astype(np.int64) * stations_range + station_codes[in_groups] + 1)
+        key_tracks, key_stations = keys // stations_range, keys % stations_range - 1
+        stations_num = np.bincount(key_tracks, minlength=tracks.ngroups)
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = key_tracks[1:] != key_tracks[:-1]
+        max_station = np.zeros(tracks.ngroups, dtype=data[self.station_column].dtype)
+        max_station[key_tracks[last]] = station_values[key_stations[last]]
+        return codes, sizes, stations_num, max_station
+
+    @staticmethod
+    def hits_of(codes, good_tracks):
+        # the hits out of the groups (code -1) are never good, as with `filter`
+        return np.append(good_tracks, False)[codes]
+
     def get_broken(self):
         return self._broken_tracks
 
@@ -441,46 +477,60 @@ class ConstraintsNormalize(BaseTransformer):
              #           self.constraints.keys()]), "Some station keys in constraints are not presented in data. Keys: " \
             #                                       f"{data['station'].unique()}; data keys: {self.constraints.keys()}"
 
-            for station in list(data['station'].unique()):
-                #print(data['station'].unique())
-                group = data.loc[data['station'] == station,]
-                x_norm, y_norm, z_norm = self.normalize(group, self.constraints[station])
-                data.loc[data['station'] == station, :] = \
-                    self.transform_data_by_group(data['station'] == station, data,
-                                                 [x_norm, y_norm, z_norm])
+            data = self.normalize_by_stations(data)
         return data
 
-    def transform_data_by_group(self, grouping, data, normed):
-        for i in range(3):
-            assert self.drop_old, "Saving old data is not supported for now"
-            data.loc[grouping, self.columns[i]] = normed[i]
+    def normalize_by_stations(self, data):
+        """Scales all the rows at once with the (min, max) of their stations gathered from the lookup table."""
+        assert self.drop_old, "Saving old data is not supported for now"
+        stations = list(self.constraints.keys())
+        # bounds[station position, column] = (min, max)
+        bounds = np.array([[self.constraints[station][col] for col in self.columns] for station in stations],
+                          dtype=np.float64).reshape(-1, len(self.columns), 2)
+        positions = pd.Index(stations).get_indexer(data[self.station_column].values)
+        assert (positions >= 0).all(), \
+            f"No constraints for stations {data[self.station_column].values[positions < 0][:10]}"
+        mins, maxs = bounds[positions, :, 0], bounds[positions, :, 1]
+        values = data[list(self.columns)].values
+        in_range = (values >= mins) & (values <= maxs)
+        if not in_range.all():
+            row, col = np.argwhere(~in_range)[0]
+            station = stations[positions[row]]
+            raise AssertionError(f'Some values in column {self.columns[col]} are not in '
+                                 f'{self.constraints[station][self.columns[col]]}')
+        normed = 2 * (values - mins) / (maxs - mins) - 1
+        for i, col in enumerate(self.columns):
+            data[col] = normed[:, i]
         return data
 
     def get_stations_constraints(self, df):
-        groups = df['station'].unique()
-
+        # stations are in the order of appearance, as `unique` returns them
+        stations = df[self.station_column].unique()
+        # groupby skips NaN, while the constraints must bound every value
+        assert not df[list(self.columns)].isna().values.any(), \
+            f'NaN values in columns {list(self.columns)}, constraints can not be computed'
+        grouped = df.groupby(self.station_column, sort=False)[list(self.columns)]
+        mins, maxs = grouped.min().loc[stations], grouped.max().loc[stations]
+
+        # python floats, so the repr and the cache hashes don't depend on the numpy version
         station_constraints = {}
-        for station_num in groups:
-            group = df.loc[df['station'] == station_num,]
-            min_x, max_x = min(group[self.columns[0]]) - self.margin, max(group[self.columns[0]]) + self.margin
-            min_y, max_y = min(group[self.columns[1]]) - self.margin, max(group[self.columns[1]]) + self.margin
-            min_z, max_z = min(group[self.columns[2]]) - self.margin, max(group[self.columns[2]]) + self.margin
-            station_constraints[station_num] = {self.columns[0]: (min_x, max_x),
-                                                self.columns[1]: (min_y, max_y),
-                                                self.columns[2]: (min_z, max_z)}
+        for i, station_num in enumerate(stations):
+            station_constraints[station_num] = {col: (float(mins[col].values[i] - self.margin),
+                                                      float(maxs[col].values[i] + self.margin))
+                                                for col in self.columns}
         return station_constraints
 
     def normalize(self, df, constraints):
         x_min, x_max = constraints[self.columns[0]]
         y_min, y_max = constraints[self.columns[1]]
         z_min, z_max = constraints[self.columns[2]]
-        assert all(df[self.columns[0]].between(x_min, x_max)), \
+        assert df[self.columns[0]].between(x_min, x_max).all(), \
             f'Some values in column {self.columns[0]} are not in {constraints[self.columns[0]]}'
         x_norm = 2 * (df[self.columns[0]] - x_min) / (x_max - x_min) - 1
-        assert all(df[self.columns[1]].between(y_min, y_max)), \
+        assert df[self.columns[1]].between(y_min, y_max).all(), \
             f'Some values in column {self.columns[1]} are not in {constraints[self.columns[1]]}'
         y_norm = 2 * (df[self.columns[1]] - y_min) / (y_max - y_min) - 1
-        assert all(df[self.columns[2]].between(z_min, z_max)), \
+        assert df[self.columns[2]].between(z_min, z_max).all(), \
             f'Some values in column {self.columns[2]} are not in {constraints[self.columns[2]]}'
         z_norm = 2 * (df[self.columns[2]] - z_min) / (z_max - z_min) - 1
         return x_norm, y_norm, z_norm
@@ -513,6 +563,10 @@ class DropShort(BaseFilter):
         super().__init__(self.filter, num_stations=num_stations, station_col=station_col, track_col=track_col,
                          event_col=event_col, keep_filtered=keep_filtered)
 
+    def good_hits(self, data, tracks):
+        codes, sizes, _, _ = self.track_stats(data, tracks, with_stations=False)
+        return self.hits_of(codes, sizes >= self.num_stations)
+
 
     def __repr__(self):
         return(f'{"-" * 30}\n'
@@ -552,6 +606,10 @@ class DropSpinningTracks(BaseFilter):
         super().__init__(self.filter, station_col=station_col, track_col=track_col, event_col=event_col,
                          keep_filtered=keep_filtered)
 
+    def good_hits(self, data, tracks):
+        codes, sizes, stations_num, _ = self.track_stats(data, tracks)
+        return self.hits_of(codes, stations_num == sizes)
+
     def __repr__(self):
         return(f'{"-" * 30}\n'
                f'{self.__class__.__name__} with parameters:'
@@ -614,11 +672,20 @@ class DropTracksWithHoles(BaseFilter):
                  event_col='event',
                  min_station_num=0):
 
+        # stations are integers, so the range from the non-integer start has the stations from its floor;
+        # both the filter_rule and the vectorized good_hits use this integer start
+        self.min_station_num = int(np.floor(min_station_num))
         self.filter = lambda x: x[self.station_column].values.shape[0] == \
-                                len(np.arange(min_station_num, int(x[self.station_column].max())))+1
+                                len(np.arange(self.min_station_num, int(x[self.station_column].max())))+1
         super().__init__(self.filter, station_col=station_col, track_col=track_col, event_col=event_col,
                          keep_filtered=keep_filtered)
 
+    def good_hits(self, data, tracks):
+        codes, sizes, _, max_station = self.track_stats(data, tracks)
+        # number of the stations from min_station_num to the max one
+        expected = np.maximum(max_station.astype(np.int64) - self.min_station_num, 0) + 1
+        return self.hits_of(codes, sizes == expected)
+
     def __repr__(self):
         return(f'{"-" * 30}\n'
                f'{self.__class__.__name__} with parameters:'
@@ -7,6 +7,8 @@ import pandas as pd
 import os
 import numpy as np
 
+from ariadne_v2.hit_format import HitFile, is_hit_file
+
 
 @gin.configurable
 class ZLootDataSet(Dataset):
@@ -22,7 +24,12 @@ class ZLootDataSet(Dataset):
         self.y_res = y_res
         self.x_pixel_size = self.get_x_pixel_size()
         self.y_pixel_size = self.get_y_pixel_size()
-        self.data = [x for x in os.listdir(data_root) if x.endswith(".csv")]
+        # either a directory with one csv per event or a hit file with all the events
+        self.hits = HitFile(data_root) if is_hit_file(data_root) else None
+        if self.hits is not None:
+            self.data = self.hits.event_ids
+        else:
+            self.data = [x for x in os.listdir(data_root) if x.endswith(".csv")]
         self.names = [' ', 'event',	'z',	'station', 	'track', 	'px',	'py',	'pz',	'vz',	'y',	'x',	'vx',	'vy']
 
 
@@ -108,8 +115,11 @@ class ZLootDataSet(Dataset):
         return X
 
     def __getitem__(self, item):
-        event_path = self.root + '/' + self.data[item]
-        self.event = pd.read_csv(event_path, engine='python')   
+        if self.hits is not None:
+            self.event = self.hits.event(self.data[item])
+        else:
+            event_path = self.root + '/' + self.data[item]
+            self.event = pd.read_csv(event_path, engine='python')
         return {"inputs": self.event_img(self.event)},  self.get_vertex(self.event)
 
 
@@ -0,0 +1,151 @@
+import logging
+import os
+import sqlite3
+from typing import Callable, Dict, Union, List
+
+import pandas as pd
+
+LOGGER = logging.getLogger('ariadne.cache')
+
+
+class CacheCatalog:
+    """Index of the JIT cache entries: maps the args hash to the location of the cached data.
+
+    Backed by an SQLite database in WAL mode, so a lookup or an insert is a single indexed
+    statement and an interrupted write never leaves the catalog half-written.
+    The legacy tab-separated `cache_info.txt` catalog is imported on the first open.
+
+    Besides the location, every entry keeps its storage size in bytes, the time of the last
+    access and the number of hits; these are used for the eviction of the entries.
+    """
+    TABLE = 'entries'
+    TEXT_COLUMNS = ['hash', 'date', 'key', 'data_path', 'type', 'commit']
+    STATS_COLUMNS = {'size': 'INTEGER DEFAULT 0', 'last_access': 'REAL DEFAULT 0', 'hits': 'INTEGER DEFAULT 0'}
+    COLUMNS = TEXT_COLUMNS + list(STATS_COLUMNS.keys())
+
+    class EVICTION_POLICIES:
+        LRU = 'lru'
+        LFU = 'lfu'
+
+    # ORDER BY clause for each policy, first rows are evicted first
+    EVICTION_ORDER = {
+        EVICTION_POLICIES.LRU: 'last_access ASC, hits ASC',
+        EVICTION_POLICIES.LFU: 'hits ASC, last_access ASC',
+    }
+
+    def __init__(self, catalog_path: str):
+        self.catalog_path = catalog_path
+        self._conn: Union[sqlite3.Connection, None] = None
+        self._pid = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # unix fork issue: never reuse a connection opened by the parent process
+        if self._conn is None or self._pid != os.getpid():
+            self.open()
+        return self._conn
+
+    def open(self):
+        self._conn = sqlite3.connect(self.catalog_path, timeout=60)
+        self._pid = os.getpid()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} ('
+                           f'hash TEXT PRIMARY KEY, '
+                           f'date TEXT, '
+                           f'key TEXT, '
+                           f'data_path TEXT, '
+                           f'type TEXT, '
+                           f'"commit" TEXT)')
+        # stats columns are added separately, so the catalogs created before them are upgraded in place
+        existing = {row[1] for row in self._conn.execute(f'PRAGMA table_info({self.TABLE})')}
+        for col, col_type in self.STATS_COLUMNS.items():
+            if col not in existing:
+                self._conn.execute(f'ALTER TABLE {self.TABLE} ADD COLUMN {col} {col_type}')
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {self.TABLE}_date ON {self.TABLE} (date)')
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+
+    def get(self, hash: str) -> Union[Dict, None]:
+        row = self.conn.execute(f'SELECT {self._columns_sql()} FROM {self.TABLE} WHERE hash = ?',
+                                (hash,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.COLUMNS, row))
+
+    def put(self, entry: Dict):
+        assert 'hash' in entry
+        with self.conn:
+            self.conn.execute(f'INSERT OR REPLACE INTO {self.TABLE} ({self._columns_sql()}) '
+                              f'VALUES ({", ".join("?" * len(self.COLUMNS))})',
+                              tuple(self._to_sql(col, entry.get(col)) for col in self.COLUMNS))
+
+    def touch(self, hash: str, access_time: float):
+        with self.conn:
+            self.conn.execute(f'UPDATE {self.TABLE} SET last_access = ?, hits = hits + 1 WHERE hash = ?',
+                              (access_time, hash))
+
+    def remove(self, hashes: List[str]):
+        with self.conn:
+            self.conn.executemany(f'DELETE FROM {self.TABLE} WHERE hash = ?', [(h,) for h in hashes])
+
+    def __contains__(self, hash: str):
+        return self.conn.execute(f'SELECT 1 FROM {self.TABLE} WHERE hash = ?', (hash,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {self.TABLE}').fetchone()[0]
+
+    def total_size(self, data_path: str) -> int:
+        return self.conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.TABLE} WHERE data_path = ?',
+                                 (data_path,)).fetchone()[0]
+
+    def eviction_candidates(self, data_path: str, policy: str) -> List[Dict]:
+        """Entries stored in the `data_path` database, in the order they should be evicted by the `policy`."""
+        assert policy in self.EVICTION_ORDER, f"unknown eviction policy '{policy}', " \
+                                              f"expected one of {list(self.EVICTION_ORDER.keys())}"
+        rows = self.conn.execute(f'SELECT {self._columns_sql()} FROM {self.TABLE} WHERE data_path = ? '
+                                 f'ORDER BY {self.EVICTION_ORDER[policy]}', (data_path,)).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def as_df(self) -> pd.DataFrame:
+        rows = self.conn.execute(f'SELECT {self._columns_sql()} FROM {self.TABLE} ORDER BY date').fetchall()
+        return pd.DataFrame(rows, columns=self.COLUMNS)
+
+    def migrate_tsv(self, tsv_path: str, storage_sizes: Union[Callable[[str, List[str]], List[int]], None] = None):
+        """Imports entries of the legacy `cache_info.txt` and renames it, so it is imported only once.
+
+        # Args:
+            tsv_path (str): path of the legacy catalog
+            storage_sizes (callable, None by default): gets the `data_path` and the keys of its entries,
+                        returns their storage sizes in bytes. If None, the sizes of the legacy entries are left 0
+        """
+        if not os.path.exists(tsv_path):
+            return
+        old_cache = pd.read_csv(tsv_path, names=self.TEXT_COLUMNS, sep='\t', encoding='utf-8', dtype=str)
+        # the legacy file is sorted by date, the last entry for the hash wins
+        old_cache = old_cache.drop_duplicates(subset='hash', keep='last').fillna('')
+        # the legacy catalog has no sizes, so they are backfilled from the databases for the eviction budget
+        old_cache['size'] = 0
+        if storage_sizes is not None:
+            for data_path, entries in old_cache.groupby('data_path'):
+                old_cache.loc[entries.index, 'size'] = storage_sizes(data_path, entries.key.tolist())
+        columns = self.TEXT_COLUMNS + ['size']
+        with self.conn:
+            self.conn.executemany(f'INSERT OR IGNORE INTO {self.TABLE} ({self._columns_sql(columns)}) '
+                                  f'VALUES ({", ".join("?" * len(columns))})',
+                                  (row[:-1] + (int(row[-1]),)
+                                   for row in old_cache[columns].itertuples(index=False, name=None)))
+        os.replace(tsv_path, tsv_path + '.migrated')
+        LOGGER.info(f"Migrated {len(old_cache)} cache entries from '{tsv_path}' to '{self.catalog_path}'")
+
+    def _to_sql(self, col, value):
+        if col in self.STATS_COLUMNS:
+            return 0 if value is None else value
+        return '' if value is None else str(value)
+
+    def _columns_sql(self, columns=None):
+        return ', '.join(f'"{col}"' for col in (columns if columns is not None else self.COLUMNS))
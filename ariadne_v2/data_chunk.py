@@ -1,11 +1,14 @@
 import multiprocessing
 from abc import abstractmethod, ABCMeta
 from contextlib import contextmanager
+from multiprocessing import shared_memory
 from typing import List, Union, Callable, Any, Dict
 
 import numpy as np
 import pandas as pd
 
+from ariadne_v2.storage_codec import StorageCodec, read_dataset
+
 class HDF5Serializable:
     @abstractmethod
     def to_hdf5(self, db, hash, path):
@@ -17,8 +20,7 @@ class HDF5Serializable:
 
 
 class DataChunk(HDF5Serializable):
-    def __init__(self, np_ndarr: np.ndarray, source=None):
-        self.np_arr = np_ndarr
+    def __init__(self, source=None):
         self.__source = source
 
     def jit_hash(self):
@@ -30,48 +32,168 @@ class DataChunk(HDF5Serializable):
 
 
 class DFDataChunk(DataChunk):
+    """Columnar form of the DataFrame: one contiguous numpy array per column in its native dtype.
+    Conversions from and to the DataFrame do not copy the columns when pandas allows it,
+    so the chunk and the frame may share memory.
+    """
+    # h5py has no native type for the python objects, such columns are stored as utf-8 bytes
+    OBJECT_DTYPE = '|O'
+
     def __init__(self,
                  np_index: np.ndarray,
-                 np_chunk_data: np.ndarray,
-                 columns: List[str],
-                 dtypes: List,
+                 np_columns: Dict[str, np.ndarray],
                  source=None):
-        super(DFDataChunk, self).__init__(np_ndarr=np_chunk_data,
-                                          source=source)
+        super(DFDataChunk, self).__init__(source=source)
         self.index = np_index
-        self.columns = columns
-        self.dtypes = dtypes
+        self.np_columns = np_columns
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.np_columns.keys())
+
+    @property
+    def dtypes(self) -> List[str]:
+        return [arr.dtype.str for arr in self.np_columns.values()]
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.np_columns.values()) + self.index.nbytes
+
+    def __len__(self):
+        return len(self.index)
+
+    def copy(self):
+        return DFDataChunk(self.index.copy(),
+                           {col: arr.copy() for col, arr in self.np_columns.items()},
+                           source=self.jit_hash() if self.cachable() else None)
 
     @staticmethod
     def from_df(df: pd.DataFrame, hash_source=None):
-        return DFDataChunk(np_chunk_data=df.values, np_index=df.index.values, columns=list(df.columns),
-                           dtypes=[dt.str for dt in df.dtypes], source=hash_source)
+        return DFDataChunk(np_index=df.index.values,
+                           np_columns={col: np.ascontiguousarray(df[col].to_numpy()) for col in df.columns},
+                           source=hash_source)
 
     def as_df(self):
-        return pd.DataFrame({
-            column: self.np_arr[:, idx].astype(self.dtypes[idx] if self.dtypes[idx] != '|O' else 'str')
-            for idx, column in enumerate(self.columns)},
-            index=self.index)
+        return pd.DataFrame(self.np_columns, index=self.index, copy=False)
 
-    def to_hdf5(self, db, hash, path):
-        columns = list(self.columns)
-        ndarr = self.np_arr
-        idx = self.index
+    def to_hdf5(self, db, hash, path, codec: StorageCodec = None):
+        codec = codec if codec is not None else StorageCodec()
         if f"{path}" in db:
-            del db[f"{path}"]
+            StorageCodec.release(db, f"{path}")
 
-        db.create_dataset(f"{path}/idx", data=idx, compression='gzip')
-        db[f"{path}"].attrs["col"] = columns
+        codec.create_dataset(db, f"{path}/idx", self.index)
+        db[f"{path}"].attrs["col"] = self.columns
         db[f"{path}"].attrs["dtype"] = self.dtypes
-        for idx, col in enumerate(columns):
-            tgt = ndarr[:, idx].astype(self.dtypes[idx])
-            db.create_dataset(f"{path}/objs/{idx}/{columns[idx]}", data=tgt, shape=tgt.shape, compression="gzip")
-
+        db[f"{path}"].attrs[StorageCodec.CODEC_ATTR] = repr(codec)
+        for idx, (col, arr) in enumerate(self.np_columns.items()):
+            if arr.dtype.str == self.OBJECT_DTYPE:
+                arr = np.char.encode(arr.astype(str), 'utf-8')
+            codec.create_dataset(db, f"{path}/objs/{idx}/{col}", arr)
 
     @staticmethod
     def from_hdf5(db, hash, path):
-        index = db[f"{path}/idx"][()]
-        vals = {}
-        for idx, col in enumerate(db[path].attrs['col']):
-            vals[col] = db[f"{path}/objs/{idx}/{col}"][()]
-        return DFDataChunk(index, pd.DataFrame.from_dict(vals).values, db[path].attrs['col'], db[path].attrs['dtype'], source=hash)
+        index = read_dataset(db[f"{path}/idx"])
+        np_columns = {}
+        for idx, (col, dtype) in enumerate(zip(db[path].attrs['col'], db[path].attrs['dtype'])):
+            dataset = db[f"{path}/objs/{idx}/{col}"]
+            if dtype == DFDataChunk.OBJECT_DTYPE:
+                np_columns[col] = np.char.decode(dataset[()], 'utf-8').astype(object)
+            elif dataset.compression is None and dataset.chunks is None:
+                np_columns[col] = read_dataset(dataset)
+            else:
+                np_columns[col] = np.empty(dataset.shape, dtype=dataset.dtype)
+                if dataset.size > 0:
+                    dataset.read_direct(np_columns[col])
+        return DFDataChunk(index, np_columns, source=hash)
+
+
+class SharedDFDataChunk:
+    """DFDataChunk published once in the shared memory, so that other processes take zero-copy views
+    of the rows of their events instead of loading the whole frame.
+
+    Rows are sorted by the event (stable, so the order inside of the event is kept);
+    rows of the event `event_ids[i]` are `event_offsets[i]:event_offsets[i + 1]`.
+    Object columns can't be placed in the shared memory and are passed to the forked processes as is.
+    Views are shared by all the processes and must not be modified.
+    """
+    INDEX_KEY = '__index__'
+    ALIGNMENT = 64
+
+    def __init__(self,
+                 shm_name: str,
+                 columns: List[str],
+                 layout: Dict[str, tuple],
+                 object_arrays: Dict[str, np.ndarray],
+                 event_ids: np.ndarray,
+                 event_offsets: np.ndarray):
+        self.shm_name = shm_name
+        self.columns = columns
+        self.layout = layout
+        self.object_arrays = object_arrays
+        self.event_ids = event_ids
+        self.event_offsets = event_offsets
+        self._shm: Union[shared_memory.SharedMemory, None] = None
+
+    @staticmethod
+    def publish(dc: DFDataChunk, event_col='event') -> 'SharedDFDataChunk':
+        order = np.argsort(dc.np_columns[event_col], kind='stable')
+        arrays = [(SharedDFDataChunk.INDEX_KEY, dc.index)] + list(dc.np_columns.items())
+
+        layout = {}
+        object_arrays = {}
+        size = 0
+        for name, arr in arrays:
+            if arr.dtype.str == DFDataChunk.OBJECT_DTYPE:
+                object_arrays[name] = arr[order]
+                continue
+            layout[name] = (arr.dtype.str, size)
+            size += -(-arr.nbytes // SharedDFDataChunk.ALIGNMENT) * SharedDFDataChunk.ALIGNMENT
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        sorted_events = dc.np_columns[event_col][order]
+        event_ids, event_offsets = np.unique(sorted_events, return_index=True)
+        shared = SharedDFDataChunk(shm.name, dc.columns, layout, object_arrays,
+                                   event_ids, np.append(event_offsets, len(order)))
+        shared._shm = shm
+        for name, arr in arrays:
+            if name in layout:
+                np.take(arr, order, out=shared._view(name))
+        return shared
+
+    def _view(self, name) -> np.ndarray:
+        dtype, offset = self.layout[name]
+        return np.ndarray(shape=(self.event_offsets[-1],), dtype=dtype, buffer=self._shm.buf, offset=offset)
+
+    def attach(self, first_event=None, last_event=None) -> DFDataChunk:
+        """Zero-copy chunk with the events in [first_event, last_event)."""
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.shm_name)
+        start = 0 if first_event is None else np.searchsorted(self.event_ids, first_event, side='left')
+        end = len(self.event_ids) if last_event is None else np.searchsorted(self.event_ids, last_event, side='left')
+        rows = slice(self.event_offsets[start], self.event_offsets[end])
+
+        arrays = {name: (self.object_arrays[name] if name in self.object_arrays else self._view(name))[rows]
+                  for name in [self.INDEX_KEY] + self.columns}
+        index = arrays.pop(self.INDEX_KEY)
+        return DFDataChunk(index, arrays)
+
+    def close(self):
+        if self._shm is None:
+            return
+        try:
+            self._shm.close()
+        except BufferError:
+            # views are still alive, the mapping is released on the process exit
+            return
+        self._shm = None
+
+    def unlink(self):
+        """Releases the shared memory, call it from the publishing process when all the readers are done."""
+        shm = self._shm if self._shm is not None else shared_memory.SharedMemory(name=self.shm_name)
+        self.close()
+        shm.unlink()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shm'] = None
+        return state
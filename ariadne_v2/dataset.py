@@ -9,6 +9,7 @@ import pandas as pd
 
 from ariadne_v2 import jit_cacher
 from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.storage_codec import StorageCodec
 
 
 class AriadneDataset(object):
@@ -31,7 +32,7 @@ class AriadneDataset(object):
         def update_df(self, df_name, df_update: Callable[[Any, Cacher], pd.DataFrame]):
             db = self.ds.dataset_name
             hash = Cacher.build_hash(name=df_name, db=db)
-            with jit_cacher.instance(self.ds.cacher) as cacher:
+            with jit_cacher.instance(self.ds.cacher) as cacher, cacher.locked(db):
                 df = cacher.read_df(hash, db=db)
                 df = df_update(df, cacher)
                 cacher.store_df(hash, df, db)
@@ -171,7 +172,8 @@ class AriadneDataset(object):
 
     def add(self, key, values: Dict):
         for k, v in values.items():
-            self.db_conn.create_dataset(name=f'data/{key}/{k}', data=v, shape=v.shape, compression="gzip")
+            self.cacher.storage_codec.create_dataset(self.db_conn, f'data/{key}/{k}', v)
+        self.db_conn[f'data/{key}'].attrs[StorageCodec.CODEC_ATTR] = repr(self.cacher.storage_codec)
         self.db_conn.attrs[self.LEN_KEY] = self.db_conn.attrs["len"] + 1
 
     def add_dataset_reference(self, other_ds_path):
@@ -195,6 +197,9 @@ class AriadneDataset(object):
         self._submit_local_data()
 
     def global_submit(self, datasets: List[str]):
+        # parts merged by the run which was stopped before recording it are not merged twice
+        refs = self.db_conn.attrs[self.REFS_KEY]
+        datasets = [ds_name for ds_name in datasets if ds_name not in refs]
         self._gather_local_data(datasets)
         self.db_conn.attrs[self.LEN_KEY] = self.db_conn.attrs[self.LEN_KEY] + \
                                            sum([self.db_conn[self.REFS_KEY][ds_name].attrs['len']
@@ -0,0 +1,82 @@
+import operator
+from typing import Callable, List, Tuple, Union
+
+import gin
+import numpy as np
+import pandas as pd
+
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'in': lambda values, allowed: np.isin(values, allowed),
+    'not in': lambda values, excluded: ~np.isin(values, excluded),
+}
+
+
+@gin.configurable
+class EventFilter:
+    """Declarative filter of the hits, which is pushed down into the readers (see `parse`),
+    so the rows it drops are never materialized. All the conditions must hold.
+
+    Unlike `filter_func` it is hashable: its repr is canonical, so filtered parses are cached too.
+
+    # Args:
+        events (list of [first, last], None by default): inclusive ranges of the kept event ids
+        stations (list of ints, None by default): kept stations
+        predicates (list of (column, op, value), None by default): conditions on the columns,
+                                                                   op is one of `OPERATORS`
+    """
+    def __init__(self,
+                 events: Union[List[List[int]], None] = None,
+                 stations: Union[List[int], None] = None,
+                 predicates: Union[List[Tuple[str, str, object]], None] = None):
+        self.events = None
+        if events is not None:
+            ranges = sorted([int(first), int(last)] for first, last in events)
+            self.events = []
+            for first, last in ranges:
+                if self.events and first <= self.events[-1][1] + 1:
+                    self.events[-1][1] = max(self.events[-1][1], last)
+                else:
+                    self.events.append([first, last])
+        self.stations = None if stations is None else sorted(set(int(station) for station in stations))
+        self.predicates = []
+        for column, op, value in (predicates or []):
+            assert op in OPERATORS, f"unknown operator '{op}', expected one of {list(OPERATORS)}"
+            if op in ['in', 'not in']:
+                value = sorted(set(value))
+            self.predicates.append((column, op, value))
+        self.predicates = sorted(self.predicates, key=repr)
+
+    def __repr__(self):
+        return f'EventFilter(events={self.events}, stations={self.stations}, predicates={self.predicates})'
+
+    @property
+    def row_columns(self) -> List[str]:
+        """Columns needed for `row_mask`."""
+        columns = ['station'] if self.stations is not None else []
+        return columns + sorted(set(column for column, _, _ in self.predicates) - set(columns))
+
+    def event_mask(self, event_ids: np.ndarray) -> np.ndarray:
+        if self.events is None:
+            return np.ones(len(event_ids), dtype=bool)
+        ranges = np.array(self.events, dtype=np.int64).reshape(-1, 2)
+        pos = np.searchsorted(ranges[:, 0], event_ids, side='right') - 1
+        return (pos >= 0) & (event_ids <= ranges[np.maximum(pos, 0), 1])
+
+    def row_mask(self, column: Callable[[str], np.ndarray], rows: int) -> np.ndarray:
+        """Mask of the rows satisfying the stations and the predicates, `column(name)` returns the values."""
+        mask = np.ones(rows, dtype=bool)
+        if self.stations is not None:
+            mask &= np.isin(column('station'), self.stations)
+        for name, op, value in self.predicates:
+            mask &= OPERATORS[op](column(name), value)
+        return mask
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        mask = self.event_mask(df.event.values) & self.row_mask(lambda name: df[name].values, len(df))
+        return df if mask.all() else df[mask]
@@ -0,0 +1,70 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+# posix only. Without it the callers fall back to the global multiprocessing lock
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SUPPORTED = fcntl is not None
+
+
+class FileLocks:
+    """Shared (read) and exclusive (write) advisory locks of the db files across the processes.
+
+    Each db file is guarded by the `%db_path%.lock` file, so readers of one db run in parallel,
+    while a writer waits only for the readers and writers of the same db.
+    Locks are reentrant within a thread: a thread holding the exclusive lock may take it again or
+    take the shared one, but a shared lock can't be upgraded.
+    """
+    LOCK_SUFFIX = '.lock'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _held(self) -> Dict[str, List]:
+        # unix fork issue: locks of the parent process belong to the parent
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.held = {}
+        return self._local.held
+
+    def acquire(self, db_path: str, exclusive: bool):
+        if not SUPPORTED:
+            return
+        held = self._held()
+        if db_path in held:
+            assert held[db_path][1] or not exclusive, f"can't upgrade the shared lock of '{db_path}' to exclusive"
+            held[db_path][2] += 1
+            return
+
+        fd = os.open(db_path + self.LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        except BaseException:
+            os.close(fd)
+            raise
+        # [fd, exclusive, reentrancy count]
+        held[db_path] = [fd, exclusive, 1]
+
+    def release(self, db_path: str):
+        if not SUPPORTED:
+            return
+        held = self._held()
+        assert db_path in held, f"lock of '{db_path}' is not held"
+        held[db_path][2] -= 1
+        if held[db_path][2] == 0:
+            fd = held.pop(db_path)[0]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    @contextmanager
+    def lock(self, db_path: str, exclusive: bool):
+        self.acquire(db_path, exclusive)
+        try:
+            yield
+        finally:
+            self.release(db_path)
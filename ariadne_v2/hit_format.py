@@ -0,0 +1,225 @@
+import json
+import os
+from abc import ABCMeta, abstractmethod
+from typing import List, Union, Iterable
+
+import numpy as np
+import pandas as pd
+
+
+class EventIndexedHits(metaclass=ABCMeta):
+    """Hits stored by the events: event `event_ids[i]` is stored in the rows
+    `event_offsets[i]:event_offsets[i] + event_sizes[i]`, event ids are sorted.
+    Subclasses provide the memory-mapped columns, reading of an event touches only its rows.
+    """
+    def __init__(self, path: str, columns: List[str], rows: int,
+                 event_ids: np.ndarray, event_offsets: np.ndarray, event_sizes: np.ndarray):
+        self.path = path
+        self.columns = columns
+        self.rows = rows
+        self.event_ids = event_ids
+        self.event_offsets = event_offsets
+        self.event_sizes = event_sizes
+
+    @abstractmethod
+    def _column(self, name: str) -> np.ndarray:
+        pass
+
+    def _index(self, rows: Union[slice, np.ndarray]) -> np.ndarray:
+        return np.arange(self.rows)[rows]
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    def _frame(self, rows: Union[slice, np.ndarray]) -> pd.DataFrame:
+        # copies only the selected rows out of the mapped columns
+        index = self._index(rows)
+        return pd.DataFrame({col: np.asarray(self._column(col)[rows]) for col in self.columns},
+                            index=index)
+
+    def event(self, event_id: int) -> pd.DataFrame:
+        pos = np.searchsorted(self.event_ids, event_id)
+        assert pos < len(self.event_ids) and self.event_ids[pos] == event_id, \
+            f"no event {event_id} in '{self.path}'"
+        start = self.event_offsets[pos]
+        return self._frame(slice(start, start + self.event_sizes[pos]))
+
+    def read(self, event_idxs: Union[Iterable[int], None] = None, row_filter=None) -> pd.DataFrame:
+        """Reads all the hits in the order of writing or the hits of the selected events only.
+        `row_filter` (see `EventFilter`) is applied before the rows are copied out of the mapped columns.
+        """
+        if event_idxs is None and row_filter is None:
+            return self._frame(slice(0, self.rows))
+        positions = self._selected_positions(event_idxs, row_filter)
+        return self._frame(self._filtered_rows(self._event_rows(positions), row_filter))
+
+    def read_chunks(self, chunk_rows: int, event_idxs: Union[Iterable[int], None] = None, row_filter=None):
+        """Yields frames of whole events with about `chunk_rows` rows each, in the order of writing."""
+        positions = self._selected_positions(event_idxs, row_filter)
+        positions = positions[np.argsort(self.event_offsets[positions], kind='stable')]
+        chunk_ids = np.cumsum(self.event_sizes[positions]) // max(1, chunk_rows)
+        for chunk_positions in np.split(positions, np.flatnonzero(np.diff(chunk_ids)) + 1):
+            if len(chunk_positions) > 0:
+                rows = self._filtered_rows(self._event_rows(chunk_positions), row_filter)
+                if len(rows) > 0:
+                    yield self._frame(rows)
+
+    def _selected_positions(self, event_idxs: Union[Iterable[int], None], row_filter) -> np.ndarray:
+        present = np.ones(len(self.event_ids), dtype=bool)
+        if event_idxs is not None:
+            present &= np.isin(self.event_ids, np.asarray(list(event_idxs)))
+        if row_filter is not None:
+            present &= row_filter.event_mask(self.event_ids)
+        return np.flatnonzero(present)
+
+    def _filtered_rows(self, rows: np.ndarray, row_filter) -> np.ndarray:
+        if row_filter is None or not row_filter.row_columns:
+            return rows
+        # only the filtered columns are read for all the rows
+        return rows[row_filter.row_mask(lambda name: np.asarray(self._column(name)[rows]), len(rows))]
+
+    def _event_rows(self, positions: np.ndarray) -> np.ndarray:
+        positions = positions[np.argsort(self.event_offsets[positions], kind='stable')]
+        starts, sizes = self.event_offsets[positions], self.event_sizes[positions]
+        if len(starts) == 0:
+            return np.empty(0, dtype=np.int64)
+        # concatenated ranges [start, start + size) of all the events
+        rows = np.ones(sizes.sum(), dtype=np.int64)
+        rows[0] = starts[0]
+        bounds = np.cumsum(sizes)[:-1]
+        rows[bounds] = starts[1:] - (starts[:-1] + sizes[:-1] - 1)
+        return np.cumsum(rows)
+
+
+def build_event_index(events: np.ndarray):
+    """Event ids, offsets and sizes of the events which hits are contiguous in `events`."""
+    if len(events) == 0:
+        return np.empty(0, dtype=events.dtype), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.concatenate([[0], np.flatnonzero(events[1:] != events[:-1]) + 1])
+    sizes = np.diff(np.append(starts, len(events)))
+    event_ids = events[starts]
+    order = np.argsort(event_ids, kind='stable')
+    event_ids, starts, sizes = event_ids[order], starts[order], sizes[order]
+    assert np.all(event_ids[1:] != event_ids[:-1]), "hits of some events are not contiguous"
+    return event_ids, starts.astype(np.int64), sizes.astype(np.int64)
+
+
+class HitFile(EventIndexedHits):
+    """Binary columnar hit file: the directory `*.hits` with one raw array per column and the event index.
+
+    Hits of every event are contiguous (see `EventIndexedHits`), rows are in the order of writing.
+    `__index__` keeps the row numbers of the source file, so the read frames are the same as parsed from it.
+    Columns are memory-mapped read-only, reading of an event touches only its rows.
+
+    Files are written with `HitFile.write` or converted from the csv files with `convert_csv`.
+    """
+    SUFFIX = '.hits'
+    META_FILE = 'meta.json'
+    INDEX_COLUMN = '__index__'
+    EVENT_INDEX = ['event_ids', 'event_offsets', 'event_sizes']
+    VERSION = 1
+
+    def __init__(self, path: str):
+        assert is_hit_file(path), f"'{path}' is not a hit file"
+        self.path = path
+        with open(os.path.join(path, self.META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        assert self.meta['version'] == self.VERSION, f"unsupported version of the hit file '{path}'"
+        event_index = np.load(os.path.join(path, 'event_index.npz'))
+        super(HitFile, self).__init__(path, self.meta['columns'], self.meta['rows'],
+                                      *[event_index[key] for key in self.EVENT_INDEX])
+        self.event_col: str = self.meta['event_col']
+        self._mapped = {}
+
+    def _column(self, name: str) -> np.ndarray:
+        if name not in self._mapped:
+            dtype = np.dtype(self.meta['dtypes'][name])
+            self._mapped[name] = np.empty(0, dtype=dtype) if self.rows == 0 else \
+                np.memmap(os.path.join(self.path, name + '.bin'), mode='r', dtype=dtype, shape=(self.rows,))
+        return self._mapped[name]
+
+    def _index(self, rows: Union[slice, np.ndarray]) -> np.ndarray:
+        return np.asarray(self._column(self.INDEX_COLUMN)[rows])
+
+    @staticmethod
+    def write(path: str, chunks: Iterable[pd.DataFrame], event_col: str = 'event'):
+        """Writes the frames to the hit file, hits of every event must be in one frame.
+        Hits are grouped by the event inside of the frame, the order of the hits of the event is kept.
+        """
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, HitFile.META_FILE)):
+            os.remove(os.path.join(path, HitFile.META_FILE))
+        meta = {'version': HitFile.VERSION, 'event_col': event_col, 'columns': None, 'dtypes': {}, 'rows': 0}
+        files = {}
+        event_ids, event_offsets, event_sizes = [], [], []
+        try:
+            for chunk in chunks:
+                if meta['columns'] is None:
+                    meta['columns'] = list(chunk.columns)
+                    meta['dtypes'] = {col: chunk[col].dtype.str for col in chunk.columns}
+                    for col, dtype in meta['dtypes'].items():
+                        assert np.dtype(dtype).kind in 'biufc', \
+                            f"column '{col}' of type {dtype} can't be stored in the hit file"
+                    meta['dtypes'][HitFile.INDEX_COLUMN] = np.dtype(np.int64).str
+                    files = {col: open(os.path.join(path, col + '.bin'), 'wb')
+                             for col in meta['columns'] + [HitFile.INDEX_COLUMN]}
+                assert list(chunk.columns) == meta['columns'], "all the frames must have the same columns"
+
+                order = np.argsort(chunk[event_col].values, kind='stable')
+                events = chunk[event_col].values[order]
+                chunk_ids, starts, sizes = np.unique(events, return_index=True, return_counts=True)
+                event_ids.append(chunk_ids)
+                event_offsets.append(starts + meta['rows'])
+                event_sizes.append(sizes)
+
+                for col in meta['columns']:
+                    np.ascontiguousarray(chunk[col].values[order], dtype=meta['dtypes'][col]).tofile(files[col])
+                np.ascontiguousarray(chunk.index.values[order], dtype=np.int64).tofile(files[HitFile.INDEX_COLUMN])
+                meta['rows'] += len(chunk)
+        finally:
+            for f in files.values():
+                f.close()
+
+        event_ids = np.concatenate(event_ids) if event_ids else np.empty(0, dtype=np.int64)
+        event_offsets = np.concatenate(event_offsets) if event_offsets else np.empty(0, dtype=np.int64)
+        event_sizes = np.concatenate(event_sizes) if event_sizes else np.empty(0, dtype=np.int64)
+        order = np.argsort(event_ids, kind='stable')
+        event_ids, event_offsets, event_sizes = event_ids[order], event_offsets[order], event_sizes[order]
+        assert np.all(event_ids[1:] != event_ids[:-1]), \
+            "hits of some events are split between the frames, sort the source by the event"
+        np.savez(os.path.join(path, 'event_index.npz'),
+                 event_ids=event_ids, event_offsets=event_offsets.astype(np.int64),
+                 event_sizes=event_sizes.astype(np.int64))
+
+        meta['columns'] = meta['columns'] or []
+        # meta is written last, the file is valid only if the meta exists
+        with open(os.path.join(path, HitFile.META_FILE), 'w') as f:
+            json.dump(meta, f, indent=1)
+        return HitFile(path)
+
+
+def is_hit_file(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, HitFile.META_FILE))
+
+
+def hit_file_path(source_path: str) -> str:
+    return os.path.splitext(source_path)[0] + HitFile.SUFFIX
+
+
+def convert_csv(csv_path: str,
+                hits_path: str = None,
+                chunk_rows: int = 1000000,
+                **read_csv_kw_params) -> HitFile:
+    """Converts the csv file to the hit file, by default it is placed next to the csv.
+    The csv is read by chunks (see `parse_df_chunks`), so the hits of each event must be contiguous.
+    """
+    # parsing reads the hit files, so it is imported here
+    from ariadne_v2.parsing import parse_df_chunks
+
+    hits_path = hits_path if hits_path is not None else hit_file_path(csv_path)
+    return HitFile.write(hits_path, parse_df_chunks(csv_path, chunk_rows, **read_csv_kw_params))
+
+
+def convert_root_tsv(tsv_path: str, hits_path: str = None, chunk_rows: int = 1000000) -> HitFile:
+    """Converts the tsv written by `root_utils.main.root2tsv` to the hit file."""
+    return convert_csv(tsv_path, hits_path, chunk_rows, sep='\t', encoding='utf-8', index_col=0)
@@ -9,7 +9,7 @@ import datetime
 import time
 from contextlib import contextmanager
 
-from typing import Dict, Callable, Any, Union, List
+from typing import Dict, Callable, Any, Union, List, Tuple
 
 import subprocess
 
@@ -17,9 +17,14 @@ import pandas as pd
 import collections
 import multiprocessing
 
+import gin
 import h5py
 
+from ariadne_v2.cache_catalog import CacheCatalog
+from ariadne_v2 import file_lock
 from ariadne_v2.data_chunk import DFDataChunk
+from ariadne_v2.file_lock import FileLocks
+from ariadne_v2.storage_codec import StorageCodec, STORAGE_CODECS
 
 LOGGER = logging.getLogger('ariadne.cache')
 
@@ -30,6 +35,45 @@ class CACHE_DATA_TYPES:
     Numpy = 'Numpy'
 
 
+class MemoryTier:
+    """Per-process LRU of the datachunks read from the cache db, bounded by `max_size` bytes.
+    Chunks share memory with the frames built from them, so the callers get copies of the stored chunks.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.chunks: 'collections.OrderedDict[str, DFDataChunk]' = collections.OrderedDict()
+
+    def get(self, key: str) -> Union[DFDataChunk, None]:
+        dc = self.chunks.get(key, None)
+        if dc is not None:
+            self.chunks.move_to_end(key)
+        return dc
+
+    def put(self, key: str, dc: DFDataChunk):
+        self.remove(key)
+        if dc.nbytes > self.max_size:
+            return
+        self.chunks[key] = dc
+        self.size += dc.nbytes
+        while self.size > self.max_size:
+            _, old_dc = self.chunks.popitem(last=False)
+            self.size -= old_dc.nbytes
+
+    def remove(self, key: str):
+        dc = self.chunks.pop(key, None)
+        if dc is not None:
+            self.size -= dc.nbytes
+
+    def __len__(self):
+        return len(self.chunks)
+
+
+# default of the `Cacher.configure` arguments, which keeps the current setting
+_KEEP = object()
+
+
 # God bless python..
 def is_hashable(obj):
     return isinstance(obj, collections.Hashable)
@@ -38,10 +82,14 @@ def is_hashable(obj):
 class Cacher():
     # bump this version if you change the code, otherwise cache might be wrong
     VERSION = 1
+    # legacy tsv catalog, migrated to the CACHE_CATALOG_FILE on init
     CACHE_INFO_FILE = 'cache_info.txt'
+    CACHE_CATALOG_FILE = 'cache_catalog.sqlite'
     CACHE_DB_FILE = 'ariadne_cache_db.h5'
 
-    COLUMNS = ['hash', 'date', 'key', 'data_path', 'type', 'commit']
+    COLUMNS = CacheCatalog.COLUMNS
+    # the db is compacted once the released entries take this fraction of its file
+    RELEASED_FRACTION = 0.5
 
     DF_KEY = staticmethod(lambda key: f"df/{key}")
     DC_KEY = staticmethod(lambda key: f"dc/{key}")
@@ -51,16 +99,30 @@ class Cacher():
     def __init__(self,
                  cache_path=os.path.join(ROOT_PATH, '_jit'),
                  df_compression_level=5,
-                 with_stats=True):
+                 with_stats=True,
+                 max_cache_size=None,
+                 eviction_policy=CacheCatalog.EVICTION_POLICIES.LRU,
+                 eviction_watermark=0.8,
+                 memory_cache_size=None,
+                 codec=STORAGE_CODECS.Gzip):
         self.cache_path_dir = cache_path
 
         self.cache_info_path = os.path.join(self.cache_path_dir, self.CACHE_INFO_FILE)
+        self.cache_catalog_path = os.path.join(self.cache_path_dir, self.CACHE_CATALOG_FILE)
         os.makedirs(self.cache_path_dir, exist_ok=True)
         self.df_compression_level = df_compression_level
         self.cache_db_path = os.path.join(self.cache_path_dir, self.CACHE_DB_FILE)
         self.with_stats = with_stats
-        self.cache = None
+        self.catalog = CacheCatalog(self.cache_catalog_path)
         self.opened_handles = {}
+        self.locks = FileLocks()
+        self.memory_tier: Union[MemoryTier, None] = None
+        self.stats = collections.Counter()
+        self.configure(max_cache_size=max_cache_size,
+                       eviction_policy=eviction_policy,
+                       eviction_watermark=eviction_watermark,
+                       memory_cache_size=memory_cache_size,
+                       codec=codec)
         try:
             self.rev = self.get_git_revision_hash()
         except Exception as ex:
@@ -70,6 +132,46 @@ class Cacher():
     def init(self):
         self._build_cache()
 
+    def configure(self,
+                  max_cache_size: Union[int, None] = _KEEP,
+                  eviction_policy: str = _KEEP,
+                  eviction_watermark: float = _KEEP,
+                  memory_cache_size: Union[int, None] = _KEEP,
+                  codec: str = _KEEP):
+        """Changes only the passed settings, the other ones keep their current values.
+        The defaults below are the ones of a new cacher.
+
+        # Args:
+            max_cache_size (int, None by default): size budget of the cache database in bytes.
+                        If None, the cache grows without limit
+            eviction_policy (str, 'lru' by default): which entries are evicted first, 'lru' or 'lfu'
+            eviction_watermark (float, 0.8 by default): once the budget is exceeded,
+                        entries are evicted until they take less than this fraction of the budget
+            memory_cache_size (int, None by default): size in bytes of the in-process memory tier
+                        in front of the cache database. If None, every read goes to the disk
+            codec (str, 'gzip' by default): compression of the stored entries, one of STORAGE_CODECS.
+                        'gzip' and 'blosc' use `df_compression_level`. 'none' entries are memory-mapped on read
+        """
+        if max_cache_size is not _KEEP:
+            self.max_cache_size = max_cache_size
+        if eviction_policy is not _KEEP:
+            assert eviction_policy in CacheCatalog.EVICTION_ORDER, f"unknown eviction policy '{eviction_policy}'"
+            self.eviction_policy = eviction_policy
+        if eviction_watermark is not _KEEP:
+            assert 0 < eviction_watermark <= 1, "eviction_watermark should be in (0, 1]"
+            self.eviction_watermark = eviction_watermark
+        if codec is not _KEEP:
+            self.storage_codec = StorageCodec(codec, level=self.df_compression_level)
+        if memory_cache_size is not _KEEP:
+            if not memory_cache_size:
+                self.memory_tier = None
+            elif self.memory_tier is None or self.memory_tier.max_size != memory_cache_size:
+                self.memory_tier = MemoryTier(memory_cache_size)
+
+    def log_stats(self):
+        LOGGER.info(f"cache stats: memory tier hits={self.stats['memory_hit']} misses={self.stats['memory_miss']}, "
+                    f"disk hits={self.stats['disk_hit']} misses={self.stats['disk_miss']}")
+
     def __del__(self):
         if len(self.opened_handles) > 0:
             for db, handle in self.opened_handles:
@@ -88,51 +190,45 @@ class Cacher():
         hashed_kwargs = [('%r%r' % ((key, value))) for (key, value) in kwargs.items()]
         return hashlib.md5(':'.join(hashed_args + hashed_kwargs).encode('utf-8')).hexdigest()
 
-    def _save(self):
-        self.cache.to_csv(self.cache_info_path, sep='\t', encoding='utf-8', mode='w', header=False)
+    @property
+    def cache(self) -> pd.DataFrame:
+        """Snapshot of the whole catalog sorted by date. Loads all entries, use for tooling only."""
+        return self.catalog.as_df()
 
     def _build_cache(self):
-        if os.path.exists(self.cache_info_path):
-            self.cache = pd.read_csv(self.cache_info_path, names=self.COLUMNS, sep='\t', encoding='utf-8')
-        else:
-            self.cache = pd.DataFrame(columns=self.COLUMNS)
-        self._save()
-        h = h5py.File(self.cache_db_path, mode='a', libver='latest')
-        h.close()
-
+        self.catalog.open()
+        self.catalog.migrate_tsv(self.cache_info_path, storage_sizes=self._legacy_storage_sizes)
+        if not os.path.exists(self.cache_db_path):
+            with self.locks.lock(self.cache_db_path, exclusive=True):
+                h = h5py.File(self.cache_db_path, mode='a', libver='latest')
+                h.close()
+
+    def _legacy_storage_sizes(self, data_path: str, keys: List[str]) -> List[int]:
+        db_path = data_path if os.path.isabs(data_path) else os.path.join(self.cache_path_dir, data_path)
+        if not os.path.exists(db_path):
+            return [0] * len(keys)
+        with self.__open_db(db_path, 'r') as db:
+            return [self._storage_size(db, key) if key in db else 0 for key in keys]
 
     def _append_cache(self, dict_to_append: Dict):
-        assert 'hash' in dict_to_append
-        if not self.cache[self.cache.hash == dict_to_append['hash']].empty:
-            # delete old entry
-            self.cache = self.cache[self.cache.hash != dict_to_append['hash']]
-
-        self.cache = self.cache.append(dict_to_append, ignore_index=True)
-        self.cache = self.cache.sort_values(by=['date'])
-        self._save()
+        # replaces the old entry with the same hash if any
+        self.catalog.put(dict_to_append)
 
     @staticmethod
     def __save_as_datachunk(self, dc: DFDataChunk, db_path: str, hash):
         with self.__open_db(db_path, 'a') as db:
             path = self.DC_KEY(hash)
-            dc.to_hdf5(db, hash, path)
+            dc.to_hdf5(db, hash, path, codec=self.storage_codec)
             db.flush()
-            return path
+            return path, self._storage_size(db, path), StorageCodec.released_size(db)
 
     @staticmethod
     def __save_as_np_arr(self, df: pd.DataFrame, db_path: str, hash):
         with self.__open_db(db_path, 'a') as db:
             path = self.DF_KEY(hash)
-            DFDataChunk.from_df(df).to_hdf5(db, hash, path)
+            DFDataChunk.from_df(df).to_hdf5(db, hash, path, codec=self.storage_codec)
             db.flush()
-            return path
-
-    @staticmethod
-    def __load_as_np_arr(self, db_path: str, key) -> pd.DataFrame:
-        with self.__open_db(db_path, 'r') as db:
-            if key in db:
-                return DFDataChunk.from_hdf5(db, hash, key).as_df()
-            return pd.DataFrame()
+            return path, self._storage_size(db, path), StorageCodec.released_size(db)
 
     @staticmethod
     def __load_as_datachunk(self, db_path: str, key) -> Union[DFDataChunk, None]:
@@ -141,25 +237,130 @@ class Cacher():
                 return DFDataChunk.from_hdf5(db, hash, key)
             return None
 
+    @staticmethod
+    def _storage_size(db: h5py.File, path: str) -> int:
+        sizes = []
+        db[path].visititems(lambda name, obj: sizes.append(obj.id.get_storage_size())
+                            if isinstance(obj, h5py.Dataset) else None)
+        return sum(sizes)
+
     def _store_entry(self, args_hash: str, save_func: Callable, data: Any, db: Union[str, None]):
         db_path = self.cache_db_path if db is None else self.to_db_path(db)
-        key = save_func(self, data, db_path, args_hash)
+        key, size, released = save_func(self, data, db_path, args_hash)
+        if self.memory_tier is not None:
+            self.memory_tier.remove(args_hash)
         self._append_cache({'hash': args_hash,
                             'date': str(datetime.datetime.now()),
                             'key': key,
                             'data_path': db_path,
                             'type': CACHE_DATA_TYPES.Dataframe,
-                            'commit': self.rev})
+                            'commit': self.rev,
+                            'size': size,
+                            'last_access': time.time(),
+                            'hits': 0})
+        # only the jit cache is evicted, custom dbs hold the datasets
+        if db_path == self.cache_db_path and self._evict_if_needed(released):
+            return
+        self._compact_if_needed(db_path, released)
+
+    def _evict_if_needed(self, released: int) -> bool:
+        """Evicts the entries if the cache exceeds the budget, returns True if the db was compacted."""
+        # the budget is checked against the catalog sizes, the same ones that are freed by the eviction,
+        # and the released entries, which are freed by any compaction
+        if self.max_cache_size is None:
+            return False
+        total_size = self.catalog.total_size(self.cache_db_path)
+        if total_size + released <= self.max_cache_size:
+            return False
+
+        target_size = int(self.max_cache_size * self.eviction_watermark)
+        to_evict = []
+        for entry in self.catalog.eviction_candidates(self.cache_db_path, self.eviction_policy):
+            if total_size <= target_size:
+                break
+            to_evict.append(entry['hash'])
+            total_size -= entry['size']
+
+        LOGGER.info(f"Cache size exceeds {self.max_cache_size} bytes, "
+                    f"evicting {len(to_evict)} entries with the '{self.eviction_policy}' policy")
+        if to_evict:
+            self.evict(to_evict)
+        else:
+            with self.locks.lock(self.cache_db_path, exclusive=True):
+                self._compact_db(self.cache_db_path)
+        return True
+
+    def _compact_if_needed(self, db_path: str, released: int):
+        # the released entries take the space until the compaction, so it runs once they take a large part
+        # of the file; the cost of the copy is then paid by the released bytes, with or without the budget
+        if released <= os.path.getsize(db_path) * self.RELEASED_FRACTION or db_path in self.opened_handles:
+            return
+        LOGGER.info(f"Released entries take {released} bytes of '{db_path}', compacting it")
+        with self.locks.lock(db_path, exclusive=True):
+            self._compact_db(db_path)
+
+    def evict(self, hashes: List[str]):
+        """Removes the entries from the cache database and compacts the database file."""
+        with self.locks.lock(self.cache_db_path, exclusive=True):
+            # the entries are dropped from the compacted copy, the old file is never written to,
+            # since the memory maps of its entries may still be read
+            entries = [self.catalog.get(args_hash) for args_hash in hashes]
+            self.catalog.remove(hashes)
+            if self.memory_tier is not None:
+                for args_hash in hashes:
+                    self.memory_tier.remove(args_hash)
+            self._compact_db(self.cache_db_path, drop=[entry['key'] for entry in entries if entry is not None])
+
+    def _compact_db(self, db_path: str, drop: List[str] = ()):
+        # hdf5 never gives the space of the deleted objects back to the os,
+        # so the live objects are copied to the new file, which replaces the old one.
+        # The memory maps of the old file keep its inode, so they stay valid
+        assert db_path not in self.opened_handles, f"can't compact db '{db_path}' with an opened handle"
+        compact_path = db_path + '.compact'
+        drop = {key.strip('/') for key in drop} | {StorageCodec.RELEASED_GROUP}
+
+        def copy_group(src: h5py.Group, dst: h5py.Group):
+            for attr_name, attr_value in src.attrs.items():
+                dst.attrs[attr_name] = attr_value
+            for name, obj in src.items():
+                path = obj.name.strip('/')
+                if path in drop:
+                    continue
+                if isinstance(obj, h5py.Group) and any(key.startswith(path + '/') for key in drop):
+                    copy_group(obj, dst.create_group(name))
+                else:
+                    src.copy(obj, dst, name=name)
+
+        with h5py.File(db_path, mode='r') as src, h5py.File(compact_path, mode='w', libver='latest') as dst:
+            copy_group(src, dst)
+        os.replace(compact_path, db_path)
 
     def to_db_path(self, db: str):
         new_path = os.path.join(self.cache_path_dir, db)
         return new_path + "/db.h5" if os.path.isdir(new_path) else db
 
     def _read_entry(self, args_hash, load_func: Callable, db: Union[str, None], key_func):
+        # the memory tier is only in front of the jit cache, custom dbs are modified by other processes
+        with_memory = self.memory_tier is not None and db is None
+        if with_memory:
+            result = self.memory_tier.get(args_hash)
+            if result is not None:
+                self.stats['memory_hit'] += 1
+                return result.copy()
+            self.stats['memory_miss'] += 1
+
+        result = self._read_disk_entry(args_hash, load_func, db, key_func)
+        self.stats['disk_hit' if result is not None else 'disk_miss'] += 1
+        if with_memory and result is not None:
+            self.memory_tier.put(args_hash, result)
+            return result.copy()
+        return result
 
-        if not self.cache[self.cache.hash == args_hash].empty:
-            path = self.cache[self.cache.hash == args_hash].data_path.values[0]
-            key = self.cache[self.cache.hash == args_hash].key.values[0]
+    def _read_disk_entry(self, args_hash, load_func: Callable, db: Union[str, None], key_func):
+        entry = self.catalog.get(args_hash)
+        if entry is not None:
+            path = entry['data_path']
+            key = entry['key']
             try:
                 db_path = self.cache_db_path if db is None else self.to_db_path(db)
                 result = load_func(self, db_path, key)
@@ -167,6 +368,7 @@ class Cacher():
                 LOGGER.exception(f'Exception when trying to read cache with path {path}!:\n {ex}')
                 print(f"read entry {args_hash} miss")
                 return None
+            self.catalog.touch(args_hash, time.time())
             print(f"read entry {args_hash} hit")
             return result
         else:
@@ -181,11 +383,11 @@ class Cacher():
         print(f"read entry {args_hash} hit")
         return result
 
-    def read_df(self, args_hash, db=None):
-        df = self._read_entry(args_hash, self.__load_as_np_arr, db=db, key_func=self.DF_KEY)
-        if isinstance(df, DFDataChunk):
-            return df.as_df()
-        return df
+    def read_df(self, args_hash, db=None) -> pd.DataFrame:
+        dc = self._read_entry(args_hash, self.__load_as_datachunk, db=db, key_func=self.DF_KEY)
+        if dc is None:
+            return pd.DataFrame()
+        return dc.as_df()
 
     def store_df(self, args_hash, df: pd.DataFrame, db=None):
         if df.empty:
@@ -214,15 +416,24 @@ class Cacher():
 
     @contextmanager
     def __open_db(self, db_path, mode):
+        # raw handles hold the lock of the db while opened
         if db_path in self.opened_handles:
             yield self.opened_handles[db_path]
             return
 
-        h = h5py.File(db_path, mode=mode, libver='latest')
-        try:
-            yield h
-        finally:
-            h.close()
+        with self.locks.lock(db_path, exclusive=mode != 'r'):
+            h = h5py.File(db_path, mode=mode, libver='latest')
+            try:
+                yield h
+            finally:
+                h.close()
+
+    @contextmanager
+    def locked(self, db: Union[str, None] = None):
+        """Exclusive lock of the db, use it to make read-modify-write sequences atomic across the processes."""
+        db_path = self.cache_db_path if db is None else self.to_db_path(db)
+        with self.locks.lock(db_path, exclusive=True):
+            yield self
 
     def read_custom(self, db: str, key,
                     load_method: Union[Callable[[h5py.File, str], Any], None]) -> Union[None, Any]:
@@ -257,16 +468,22 @@ class Cacher():
     @contextmanager
     def handle(self, db_path: str, mode: str = 'a') -> h5py.File:
         db_path = self.to_db_path(db_path)
-        db = h5py.File(db_path, mode=mode, libver='latest')
-        try:
-            yield db
-        finally:
-            db.close()
+        with self.locks.lock(db_path, exclusive=mode != 'r'):
+            db = h5py.File(db_path, mode=mode, libver='latest')
+            try:
+                yield db
+            finally:
+                db.close()
 
     def open_raw_handle(self, db_path: str, mode: str = 'a') -> h5py.File:
         db_path = self.to_db_path(db_path)
         if db_path not in self.opened_handles:
-            self.opened_handles[db_path] = h5py.File(db_path, mode=mode, libver='latest')
+            self.locks.acquire(db_path, exclusive=mode != 'r')
+            try:
+                self.opened_handles[db_path] = h5py.File(db_path, mode=mode, libver='latest')
+            except BaseException:
+                self.locks.release(db_path)
+                raise
 
         return self.opened_handles[db_path]
 
@@ -277,6 +494,7 @@ class Cacher():
         self.opened_handles[db_path].flush()
         self.opened_handles[db_path].close()
         del self.opened_handles[db_path]
+        self.locks.release(db_path)
 
     @staticmethod
     def build_hash(*args, **kwargs) -> str:
@@ -293,11 +511,28 @@ class Cacher():
 __cacher = Cacher()
 
 
+@gin.configurable
+def cacher_config(max_cache_size: Union[int, None] = None,
+                  eviction_policy: str = CacheCatalog.EVICTION_POLICIES.LRU,
+                  eviction_watermark: float = 0.8,
+                  memory_cache_size: Union[int, None] = None,
+                  codec: str = STORAGE_CODECS.Gzip) -> Dict:
+    """Settings of the process-wide cacher, see `Cacher.configure`. Bind them in the gin config, e.g.
+        cacher_config.max_cache_size = 50000000000
+    """
+    return dict(max_cache_size=max_cache_size,
+                eviction_policy=eviction_policy,
+                eviction_watermark=eviction_watermark,
+                memory_cache_size=memory_cache_size,
+                codec=codec)
+
+
 def init_locks(new_lock):
     global __g_cacher_lock
     __g_cacher_lock = new_lock
 
     with __g_cacher_lock:
+        __cacher.configure(**cacher_config())
         __cacher.init()
 
 
@@ -307,11 +542,18 @@ def fini_locks():
 
 
 # csv_path_key can be used to store the path to file
-def cache_result_df():
+def cache_result_df(unhashed_kwargs: Tuple[str, ...] = ()):
+    """
+    # Args:
+        unhashed_kwargs (tuple of str, empty by default): keyword arguments which don't change the result
+                        (e.g. the size of the read chunks), they are left out of the hash
+    """
     def decorator(func=None):
         @functools.wraps(func)
         def inner(*args, **kwargs):
-            args_hash = Cacher.build_hash(*args, func_cache=hashlib.md5(func.__code__.co_code).hexdigest(), **kwargs)
+            hashed_kwargs = {key: value for key, value in kwargs.items() if key not in unhashed_kwargs}
+            args_hash = Cacher.build_hash(*args, func_cache=hashlib.md5(func.__code__.co_code).hexdigest(),
+                                          **hashed_kwargs)
 
             with instance() as cacher:
                 result = cacher.read_df(args_hash)
@@ -343,6 +585,9 @@ def instance(existing=None) -> Cacher:
             yield existing
         finally:
             pass
+    elif file_lock.SUPPORTED:
+        # the cacher locks each db file by itself: reads run in parallel, writes wait only for the same db
+        yield __cacher
     else:
         __g_cacher_lock.acquire()
         try:
@@ -0,0 +1,88 @@
+import logging
+import os
+
+import numpy as np
+
+from ariadne_v2.hit_format import EventIndexedHits, build_event_index
+
+LOGGER = logging.getLogger('ariadne.parsing')
+
+# record of the hit in the binary files exported from mpdroot
+DTYPE = np.dtype([
+    ('event', np.uint32),
+    ('wtf', np.uint32),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('z', np.float64),
+    ('station', np.uint32),
+    ('track', np.uint32),
+    ('px', np.float64),
+    ('py', np.float64),
+    ('pz', np.float64),
+    ('vx', np.float64),
+    ('vy', np.float64),
+    ('vz', np.float64)
+])
+
+
+class MPDHitFile(EventIndexedHits):
+    """Memory-mapped MPD `*.dat` file: the flat array of `DTYPE` records, hits of every event are contiguous.
+
+    The event index is built by one scan of the event column on the first open and is kept next to the file
+    (`%path%.evidx.npz`), it is rebuilt if the file has changed since.
+    Frames have the columns of `DTYPE` and the record numbers as the index.
+    """
+    SUFFIX = '.dat'
+    INDEX_SUFFIX = '.evidx.npz'
+    EVENT_INDEX = ['event_ids', 'event_offsets', 'event_sizes']
+
+    def __init__(self, path: str):
+        assert is_mpd_file(path), f"'{path}' is not an mpd file"
+        self.path = path
+        size = os.path.getsize(path)
+        assert size % DTYPE.itemsize == 0, f"size of '{path}' is not a multiple of the record size"
+        rows = size // DTYPE.itemsize
+        self._data = np.memmap(path, dtype=DTYPE, mode='r') if rows > 0 else np.empty(0, dtype=DTYPE)
+        super(MPDHitFile, self).__init__(path, list(DTYPE.names), rows, *self._load_index())
+
+    def _column(self, name: str) -> np.ndarray:
+        return self._data[name]
+
+    def stamp(self):
+        stat = os.stat(self.path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _load_index(self):
+        index_path = self.path + self.INDEX_SUFFIX
+        stamp = self.stamp()
+        if os.path.exists(index_path):
+            with np.load(index_path) as event_index:
+                if np.array_equal(event_index['stamp'], stamp):
+                    return [event_index[key] for key in self.EVENT_INDEX]
+            LOGGER.info(f"[MPD]: '{self.path}' has changed, rebuilding the event index")
+
+        event_index = build_event_index(np.asarray(self._data['event']))
+        tmp_path = index_path + '.tmp.npz'
+        try:
+            np.savez(tmp_path, stamp=stamp, **dict(zip(self.EVENT_INDEX, event_index)))
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            LOGGER.warning(f"[MPD]: can't save the event index of '{self.path}' ({e}), it is kept in memory")
+        return event_index
+
+
+# bytes of the text hit tables, the binary records always have some others (e.g. zero bytes of the event id)
+TEXT_BYTES = bytes(range(0x20, 0x7f)) + b'\t\n\r\x0b\x0c'
+
+
+def is_mpd_file(path: str) -> bool:
+    """`*.dat` is also the extension of the text hit tables, so the file has no magic to check:
+    it is taken as the mpd one if its size is a multiple of the record size and its first record is not text."""
+    if not os.path.isfile(path) or not path.endswith(MPDHitFile.SUFFIX):
+        return False
+    size = os.path.getsize(path)
+    if size % DTYPE.itemsize != 0:
+        return False
+    with open(path, 'rb') as f:
+        first_record = f.read(DTYPE.itemsize)
+    return size == 0 or len(first_record.translate(None, TEXT_BYTES)) > 0
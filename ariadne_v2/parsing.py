@@ -1,14 +1,17 @@
 import glob
 import logging
 import os
-from typing import Dict, Tuple, Union
+from typing import Dict, Tuple, Union, Iterable, Generator
 
 import gin
 import numpy as np
 import pandas as pd
 
 import ariadne_v2.jit_cacher
+from ariadne_v2.event_filter import EventFilter
+from ariadne_v2.hit_format import HitFile, is_hit_file
 from ariadne_v2.jit_cacher import cache_result_df
+from ariadne_v2.mpd_format import MPDHitFile, is_mpd_file
 
 LOGGER = logging.getLogger('ariadne.parsing')
 
@@ -19,6 +22,60 @@ def parse_df(file_path: str,
     return pd.read_csv(file_path, **read_csv_kw_params)
 
 
+def parse_df_chunks(file_path: str,
+                    chunk_rows: int,
+                    event_idxs: Union[Iterable[int], None] = None,
+                    row_filter: Union[EventFilter, None] = None,
+                    **read_csv_kw_params) -> Generator[pd.DataFrame, None, None]:
+    """Reads the csv by chunks of about `chunk_rows` rows, chunks are cut only on the event boundaries.
+    Hits of each event are expected to be contiguous in the file. Row indices are the same as for the whole file.
+
+    # Args:
+        chunk_rows (int): number of rows read at once
+        event_idxs (iterable of ints, None by default): if set, only these events are kept and the reading
+                                                         stops as soon as all of them are read
+        row_filter (EventFilter, None by default): if set, is applied to every chunk
+    """
+    remaining = None if event_idxs is None else set(int(event) for event in event_idxs)
+    tail = None
+    for chunk in pd.read_csv(file_path, chunksize=chunk_rows, **read_csv_kw_params):
+        if tail is not None:
+            chunk = pd.concat([tail, chunk])
+        # the last event may continue in the next chunk
+        events = chunk.event.values
+        other_events = np.flatnonzero(events != events[-1])
+        split = other_events[-1] + 1 if len(other_events) > 0 else 0
+        chunk, tail = chunk.iloc[:split], chunk.iloc[split:]
+
+        if remaining is not None:
+            chunk = chunk[chunk.event.isin(remaining)]
+            remaining.difference_update(chunk.event.unique())
+        if row_filter is not None:
+            chunk = row_filter.apply(chunk)
+        if not chunk.empty:
+            yield chunk
+        if remaining is not None and not remaining:
+            return
+
+    if tail is not None and remaining is not None:
+        tail = tail[tail.event.isin(remaining)]
+    if tail is not None and row_filter is not None:
+        tail = row_filter.apply(tail)
+    if tail is not None and not tail.empty:
+        yield tail
+
+
+@cache_result_df(unhashed_kwargs=('chunk_rows',))
+def parse_df_filtered(file_path: str,
+                      row_filter: EventFilter,
+                      chunk_rows: int,
+                      **read_csv_kw_params) -> Tuple[pd.DataFrame, Union[None, str]]:
+    """Parses the whole csv keeping only the rows passing the filter, they are dropped chunk by chunk.
+    The chunks are concatenated, so `chunk_rows` (pass it by keyword) is not a part of the cache key."""
+    chunks = list(parse_df_chunks(file_path, chunk_rows, row_filter=row_filter, **read_csv_kw_params))
+    return pd.concat(chunks) if chunks else pd.DataFrame(columns=read_csv_kw_params.get('names'))
+
+
 def parse_single_arr_arg(arr_arg):
     if '..' in arr_arg:
         args = arr_arg.split('..')
@@ -29,11 +86,65 @@ def parse_single_arr_arg(arr_arg):
     return [int(arr_arg)], False
 
 
+def parse_chunks(file_path: str,
+                 file_idx: int,
+                 events_quantity: str,
+                 csv_params: Dict[str, object],
+                 stream: bool,
+                 chunk_rows: int,
+                 event_filter: Union[EventFilter, None] = None):
+    """Yields the frames of the hit file (or mpd file) or the streamed frames of the csv
+    with their basenames and hashes."""
+    event_idxs, parse_all = parse_single_arr_arg(events_quantity)
+    selected = None if parse_all else event_idxs
+    # hashes of the unfiltered parses stay the same
+    filter_kw = {} if event_filter is None else {'event_filter': event_filter}
+    if is_hit_file(file_path) or is_mpd_file(file_path):
+        LOGGER.info("[Parse]: started reading hit file #%d (%s):" % (file_idx, file_path))
+        if is_hit_file(file_path):
+            hits = HitFile(file_path)
+            # the hit file is identified by its path and the time it was written
+            file_hash = ariadne_v2.jit_cacher.Cacher.build_hash(
+                file_path, os.path.getmtime(os.path.join(file_path, HitFile.META_FILE)))
+        else:
+            hits = MPDHitFile(file_path)
+            file_hash = ariadne_v2.jit_cacher.Cacher.build_hash(file_path, hits.stamp().tolist())
+        if not stream:
+            yield hits.read(selected, event_filter), os.path.basename(file_path), \
+                  ariadne_v2.jit_cacher.Cacher.build_hash(events_quantity, file_hash, **filter_kw)
+            return
+        chunks = hits.read_chunks(chunk_rows, selected, event_filter)
+    else:
+        LOGGER.info("[Parse]: started streaming CSV #%d (%s):" % (file_idx, file_path))
+        file_hash = ariadne_v2.jit_cacher.Cacher.build_hash(file_path, **csv_params)
+        chunks = parse_df_chunks(file_path, chunk_rows, selected, event_filter, **csv_params)
+
+    for chunk_idx, parsed_df in enumerate(chunks):
+        hash = ariadne_v2.jit_cacher.Cacher.build_hash(events_quantity, file_hash,
+                                                       chunk_rows=chunk_rows, chunk=chunk_idx, **filter_kw)
+        yield parsed_df, f"{os.path.basename(file_path)}_{chunk_idx}", hash
+
+
 @gin.configurable
 def parse(input_file_mask,
           csv_params: Dict[str, object],
           events_quantity,
-          filter_func=None):
+          filter_func=None,
+          event_filter: Union[EventFilter, None] = None,
+          stream=False,
+          chunk_rows=1000000):
+    """Yields the parsed dataframes with the basenames of the files and the hashes of the dataframes.
+
+    If `stream` is set, every file is read by chunks of about `chunk_rows` rows cut on the event boundaries
+    (see `parse_df_chunks`), the chunk number is appended to the basename.
+    Note that the transforms are applied to every chunk separately then.
+    Hit files (see `HitFile`) and mpd `*.dat` files (see `MPDHitFile`) matched by the mask are read directly,
+    `csv_params` are not used for them.
+
+    `event_filter` (see `EventFilter`) is applied by the readers while the files are read and is a part of
+    the hashes, so the filtered frames are cached as usual. `filter_func` is applied to the parsed frames
+    and disables the caching, use it only for the conditions `EventFilter` can't express.
+    """
     files_list = glob.glob(input_file_mask)
     assert len(files_list) > 0, f"no files found matching mask {input_file_mask}"
     assert isinstance(events_quantity, str), 'events_quantity should be a str. see comments in config to set it ' \
@@ -43,8 +154,21 @@ def parse(input_file_mask,
     list = '\n'.join(files_list)
     LOGGER.info(f"[Parse]: matched {len(files_list)} files: {list}\n")
     for idx, elem in enumerate(files_list):
+        if stream or is_hit_file(elem) or is_mpd_file(elem):
+            for parsed_df, basename, hash in parse_chunks(elem, idx, events_quantity, csv_params, stream, chunk_rows,
+                                                          event_filter):
+                if filter_func:
+                    parsed_df = filter_func(parsed_df)
+                    hash = None
+                yield parsed_df, basename, hash
+            if not parse_all:
+                return
+            continue
         LOGGER.info("[Parse]: started parsing CSV #%d (%s):" % (idx, elem))
-        parsed_df, hash = parse_df(elem, **csv_params)
+        if event_filter is not None:
+            parsed_df, hash = parse_df_filtered(elem, event_filter, chunk_rows=chunk_rows, **csv_params)
+        else:
+            parsed_df, hash = parse_df(elem, **csv_params)
         hash = ariadne_v2.jit_cacher.Cacher.build_hash(events_quantity, hash)
         if filter_func:
             parsed_df = filter_func(parsed_df)
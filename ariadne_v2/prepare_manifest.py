@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+from typing import Dict, List, Iterable
+
+import numpy as np
+
+LOGGER = logging.getLogger('ariadne.prepare')
+
+
+class PrepareManifest:
+    """Progress of the preprocessing runs, so an interrupted run can be resumed.
+
+    For every input file it keeps the key of the run (hash of the input data and of the gin config),
+    the ranges of the completed events and the datasets (parts) these events were written to.
+    A part is recorded only after it has been submitted, so everything in the manifest is on the disk.
+    The manifest is rewritten atomically after each update.
+
+    Entry of the input file:
+        key (str): run key, the entry is started over when it changes
+        config (str): key of the gin config of the run, the manifest is cleared when it changes
+        attempt (int): number of the runs that worked on the file
+        events (list of [first, last]): inclusive ranges of the completed event ids
+        parts (list of {'path': str, 'merged': bool}): datasets with the completed events
+        complete (bool): all the events are completed and all the parts are merged
+    """
+    MANIFEST_FILE = 'prepare_manifest.json'
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                self.entries = json.load(f)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries = {}
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def matches_config(self, config_key: str) -> bool:
+        """All the entries were processed with the config, so the dataset can be resumed."""
+        return all(entry.get('config') == config_key for entry in self.entries.values())
+
+    def start(self, basename: str, key: str, config_key: str = None) -> Dict:
+        """Returns the entry of the input file, a new one if the file was processed with another key.
+        The file with the other key which parts are already merged to the dataset is not resumed."""
+        entry = self.entries.get(basename)
+        if entry is not None and entry['key'] != key:
+            if any(part['merged'] for part in entry['parts']):
+                raise RuntimeError(f"'{basename}' has changed since its events were merged to the dataset, "
+                                   f"run with resume=False to drop them")
+            LOGGER.warning(f"'{basename}' has changed since the previous run, starting it over")
+        if entry is None or entry['key'] != key:
+            attempt = entry['attempt'] + 1 if entry is not None else 0
+            entry = {'key': key, 'config': config_key, 'attempt': attempt, 'events': [], 'parts': [],
+                     'complete': False}
+        elif not entry['complete']:
+            entry['attempt'] += 1
+        self.entries[basename] = entry
+        self.save()
+        return entry
+
+    def is_complete(self, basename: str) -> bool:
+        return basename in self.entries and self.entries[basename]['complete']
+
+    def mark_complete(self, basename: str):
+        self.entries[basename]['complete'] = True
+        self.save()
+
+    def completed_mask(self, basename: str, event_ids: np.ndarray) -> np.ndarray:
+        """Mask of the `event_ids` which are already completed."""
+        ranges = np.array(self.entries[basename]['events'], dtype=np.int64).reshape(-1, 2)
+        if len(ranges) == 0:
+            return np.zeros(len(event_ids), dtype=bool)
+        pos = np.searchsorted(ranges[:, 0], event_ids, side='right') - 1
+        return (pos >= 0) & (event_ids <= ranges[np.maximum(pos, 0), 1])
+
+    def add_part(self, basename: str, path: str, event_ranges: List[List[int]]):
+        entry = self.entries[basename]
+        entry['parts'].append({'path': path, 'merged': False})
+        entry['events'] = self.merge_ranges(entry['events'], event_ranges)
+        self.save()
+
+    def unmerged_parts(self, basename: str) -> List[str]:
+        return [part['path'] for part in self.entries[basename]['parts'] if not part['merged']]
+
+    def mark_merged(self, basename: str, paths: List[str]):
+        for part in self.entries[basename]['parts']:
+            if part['path'] in paths:
+                part['merged'] = True
+        self.save()
+
+    @staticmethod
+    def to_ranges(event_ids: Iterable[int]) -> List[List[int]]:
+        """Inclusive ranges of the consecutive event ids."""
+        ids = np.unique(np.fromiter(event_ids, dtype=np.int64))
+        if len(ids) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        firsts = ids[np.concatenate([[0], breaks])]
+        lasts = ids[np.concatenate([breaks - 1, [len(ids) - 1]])]
+        return np.stack([firsts, lasts], axis=1).tolist()
+
+    @staticmethod
+    def merge_ranges(ranges: List[List[int]], other: List[List[int]]) -> List[List[int]]:
+        merged = []
+        for first, last in sorted(ranges + other):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        return merged
@@ -0,0 +1,113 @@
+import logging
+from typing import Dict, Union
+
+import h5py
+import numpy as np
+
+# optional: registers the lz4 and blosc filters in hdf5, these codecs fall back to gzip without it
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+LOGGER = logging.getLogger('ariadne.cache')
+
+
+class STORAGE_CODECS:
+    NoCompression = 'none'
+    Gzip = 'gzip'
+    LZ4 = 'lz4'
+    Blosc = 'blosc'
+
+
+class StorageCodec:
+    """Compression of the datasets written to the cache and to the ariadne datasets.
+    The codec name is stored in the `CODEC_ATTR` attribute of every written entry, while hdf5 itself
+    records the filters of each dataset, so entries written with different codecs can be mixed in one db.
+
+    Uncompressed datasets are stored contiguously and are memory-mapped on read, see `read_dataset`.
+    The maps outlive the lock of the db, so such datasets are never deleted in place, see `release`.
+
+    # Args:
+        name (str, 'gzip' by default): one of STORAGE_CODECS
+        level (int, None by default): compression level for the gzip and blosc codecs
+    """
+    CODEC_ATTR = 'codec'
+    # the replaced mappable entries are moved here, the space is given back only by the compaction of the db
+    RELEASED_GROUP = '__released__'
+    RELEASED_SIZE_ATTR = 'size'
+    RELEASED_COUNT_ATTR = 'count'
+
+    def __init__(self, name: str = STORAGE_CODECS.Gzip, level: Union[int, None] = None):
+        assert name in [STORAGE_CODECS.NoCompression, STORAGE_CODECS.Gzip,
+                        STORAGE_CODECS.LZ4, STORAGE_CODECS.Blosc], f"unknown storage codec '{name}'"
+        if name in [STORAGE_CODECS.LZ4, STORAGE_CODECS.Blosc] and hdf5plugin is None:
+            LOGGER.warning(f"hdf5plugin is not installed, falling back from '{name}' to the gzip codec")
+            name = STORAGE_CODECS.Gzip
+        self.name = name
+        self.level = level
+
+    def dataset_options(self) -> Dict:
+        if self.name == STORAGE_CODECS.NoCompression:
+            return {}
+        if self.name == STORAGE_CODECS.LZ4:
+            return dict(hdf5plugin.LZ4())
+        if self.name == STORAGE_CODECS.Blosc:
+            return dict(hdf5plugin.Blosc(cname='lz4',
+                                         clevel=self.level if self.level is not None else 5,
+                                         shuffle=hdf5plugin.Blosc.SHUFFLE))
+        return dict(compression='gzip', compression_opts=self.level)
+
+    def create_dataset(self, db: Union[h5py.File, h5py.Group], name: str, data: np.ndarray) -> h5py.Dataset:
+        # hdf5 filters can't be applied to the empty datasets
+        options = self.dataset_options() if data.size > 0 else {}
+        return db.create_dataset(name, data=data, shape=data.shape, **options)
+
+    @staticmethod
+    def release(db: h5py.File, path: str):
+        """Removes the entry before it is overwritten. hdf5 reuses the freed space for the next writes,
+        which would change the data under the memory maps of the readers, so the mappable entries
+        are only moved to the `RELEASED_GROUP`. Their bytes are summed in its `RELEASED_SIZE_ATTR`,
+        so the cacher knows when the db is worth compacting (see `Cacher._compact_if_needed`).
+        """
+        mappable, sizes = [], []
+
+        def visit(name, obj):
+            if isinstance(obj, h5py.Dataset):
+                mappable.append(is_mappable(obj))
+                sizes.append(obj.id.get_storage_size())
+
+        db[path].visititems(visit)
+        if not any(mappable):
+            del db[path]
+            return
+        released = db.require_group(StorageCodec.RELEASED_GROUP)
+        count = int(released.attrs.get(StorageCodec.RELEASED_COUNT_ATTR, 0))
+        db.move(path, f"{StorageCodec.RELEASED_GROUP}/{count}")
+        released.attrs[StorageCodec.RELEASED_COUNT_ATTR] = count + 1
+        released.attrs[StorageCodec.RELEASED_SIZE_ATTR] = StorageCodec.released_size(db) + sum(sizes)
+
+    @staticmethod
+    def released_size(db: h5py.File) -> int:
+        """Bytes of the released entries, they are given back by the compaction of the db only."""
+        if StorageCodec.RELEASED_GROUP not in db:
+            return 0
+        return int(db[StorageCodec.RELEASED_GROUP].attrs.get(StorageCodec.RELEASED_SIZE_ATTR, 0))
+
+    def __repr__(self):
+        return f'{self.name}' if self.level is None else f'{self.name}:{self.level}'
+
+
+def is_mappable(dataset: h5py.Dataset) -> bool:
+    return dataset.chunks is None and dataset.id.get_offset() is not None and dataset.size > 0 \
+        and dataset.dtype.kind in 'biufc' and dataset.file.driver == 'sec2'
+
+
+def read_dataset(dataset: h5py.Dataset) -> np.ndarray:
+    """Memory-maps uncompressed contiguous datasets of the plain files and reads all the other ones.
+    Mapped pages are copy-on-write, so the result can be modified without touching the file.
+    """
+    if is_mappable(dataset):
+        return np.memmap(dataset.file.filename, mode='c', dtype=dataset.dtype, shape=dataset.shape,
+                         offset=dataset.id.get_offset())
+    return dataset[()]
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Union
+
+LOGGER = logging.getLogger('ariadne.prepare')
+
+
+class Measurement:
+    """Record of one call, the caller sets `rows_out` and `cache` ('hit' or 'miss') inside of `measure`."""
+
+    def __init__(self, rows_in: Union[int, None]):
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.cache = None
+        self.start_memory = 0
+        self.peak_memory = 0
+
+
+class TransformProfiler:
+    """Opt-in statistics of the transforms and of the processors: wall time, rows in and out,
+    peak memory delta (traced by `tracemalloc`) and the cache hits and misses of every call.
+
+    Stats are plain dicts keyed by the label, so those of the worker processes are sent to the main one
+    and summed up by `merge`. Disabled profiler records nothing and costs only the `with` statement.
+
+    Stats of the label:
+        calls (int): number of the calls
+        time (float): total wall time of the calls in seconds
+        max_time (float): the longest call
+        rows_in, rows_out (int): total rows of the inputs and of the outputs
+        max_memory (int): the largest peak of the allocated memory during the call over the memory before it, bytes
+        cache_hits, cache_misses (int): calls skipped because the output was cached and calls which output was not
+    """
+    SUMS = ['calls', 'time', 'rows_in', 'rows_out', 'cache_hits', 'cache_misses']
+    MAXES = ['max_time', 'max_memory']
+
+    def __init__(self):
+        self.enabled = False
+        self.stats: Dict[str, Dict] = {}
+        self._stack: List[Measurement] = []
+
+    def enable(self):
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.stats = {}
+        self._stack = []
+
+    def _entry(self, label: str) -> Dict:
+        if label not in self.stats:
+            self.stats[label] = {key: 0 for key in self.SUMS + self.MAXES}
+        return self.stats[label]
+
+    @contextmanager
+    def measure(self, label: str, rows_in: Union[int, None] = None):
+        record = Measurement(rows_in)
+        if not self.enabled:
+            yield record
+            return
+
+        self._start_memory(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stop_memory(record)
+            entry = self._entry(label)
+            entry['calls'] += 1
+            entry['time'] += elapsed
+            entry['max_time'] = max(entry['max_time'], elapsed)
+            entry['rows_in'] += record.rows_in or 0
+            entry['rows_out'] += record.rows_out or 0
+            entry['max_memory'] = max(entry['max_memory'], record.peak_memory - record.start_memory)
+            if record.cache is not None:
+                entry['cache_hits' if record.cache == 'hit' else 'cache_misses'] += 1
+
+    def _start_memory(self, record: Measurement):
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            # the peak is reset for the nested call, so the outer one keeps what it has seen so far
+            self._stack[-1].peak_memory = max(self._stack[-1].peak_memory, peak)
+        record.start_memory = record.peak_memory = current
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self._stack.append(record)
+
+    def _stop_memory(self, record: Measurement):
+        if not self._stack or self._stack[-1] is not record:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        # without reset_peak (python < 3.9) only the growth of the memory is known
+        record.peak_memory = max(record.peak_memory, peak if hasattr(tracemalloc, 'reset_peak') else current)
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1].peak_memory = max(self._stack[-1].peak_memory, record.peak_memory)
+
+    def count_cache_hit(self, label: str):
+        """The call was skipped, its output was read from the cache."""
+        if self.enabled:
+            self._entry(label)['cache_hits'] += 1
+
+    def merge(self, stats: Dict[str, Dict]):
+        for label, other in stats.items():
+            entry = self._entry(label)
+            for key in self.SUMS:
+                entry[key] += other[key]
+            for key in self.MAXES:
+                entry[key] = max(entry[key], other[key])
+
+    def summary(self) -> str:
+        """Table of the stats, the most expensive labels first."""
+        total_time = sum(entry['time'] for entry in self.stats.values())
+        header = f"{'label':<40} {'calls':>8} {'time, s':>10} {'share':>7} {'max, ms':>9} " \
+                 f"{'rows in':>11} {'rows out':>11} {'max mem, MB':>12} {'hits':>6} {'misses':>7}"
+        lines = [header, '-' * len(header)]
+        for label, entry in sorted(self.stats.items(), key=lambda item: -item[1]['time']):
+            share = entry['time'] / total_time if total_time > 0 else 0.
+            lines.append(f"{label:<40} {entry['calls']:>8} {entry['time']:>10.3f} {share:>7.1%} "
+                         f"{entry['max_time'] * 1e3:>9.1f} {entry['rows_in']:>11} {entry['rows_out']:>11} "
+                         f"{entry['max_memory'] / 2 ** 20:>12.1f} {entry['cache_hits']:>6} "
+                         f"{entry['cache_misses']:>7}")
+        return '\n'.join(lines)
+
+    def dump(self, directory: str, name: str):
+        """Writes the summary table to `%name%.txt` and the stats to `%name%.json` in the directory."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name + '.txt'), 'w') as f:
+            f.write(self.summary() + '\n')
+        with open(os.path.join(directory, name + '.json'), 'w') as f:
+            json.dump(self.stats, f, indent=1)
+        LOGGER.info(f"Transform profile, written to {os.path.join(directory, name)}.[txt|json]:\n{self.summary()}")
+
+
+PROFILER = TransformProfiler()
@@ -14,16 +14,93 @@ from sklearn.preprocessing import (
 from ariadne_v2 import jit_cacher
 from ariadne_v2.data_chunk import DFDataChunk
 from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.transform_profiler import PROFILER
 
 LOGGER = logging.getLogger('ariadne.transforms')
 
 
+class ColumnFrame:
+    """Columns of the frame as numpy arrays for the transforms run by `Compose` (see `transform_columns`).
+
+    The rows are selected and reordered by their positions in the arrays, so the filters don't copy the columns.
+    The arrays are never modified in place, `set` replaces the whole column. `to_df` materializes the frame.
+    Supports `name in frame` and `frame[name]` (values of the column), so simple conversions accept it as a frame.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.names = list(data.columns)
+        self.arrays = {name: data[name].values for name in self.names}
+        self.size = len(data)
+        self.rows = None
+        self.index = data.index
+
+    @staticmethod
+    def supports(data: pd.DataFrame) -> bool:
+        return data.columns.is_unique and all(isinstance(data[name].values, np.ndarray) for name in data.columns)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.arrays[name] if self.rows is None else self.arrays[name][self.rows]
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0 or len(self.names) == 0
+
+    def set(self, name, values: np.ndarray):
+        values = np.asarray(values)
+        if self.rows is not None:
+            # positions out of the selected rows are never read
+            array = np.empty(self.size, dtype=values.dtype)
+            array[self.rows] = values
+            values = array
+        if name not in self.arrays:
+            self.names.append(name)
+        self.arrays[name] = values
+
+    def delete(self, name):
+        del self.arrays[name]
+        self.names.remove(name)
+
+    def take(self, positions: np.ndarray):
+        """Keeps only the rows at `positions` in this order, like `data.iloc[positions]`."""
+        self.rows = positions if self.rows is None else self.rows[positions]
+        self.index = self.index[positions]
+
+    def reset_index(self):
+        self.index = pd.RangeIndex(len(self.index))
+
+    def to_df(self, columns=None, positions: Optional[np.ndarray] = None) -> pd.DataFrame:
+        columns = self.names if columns is None else list(columns)
+        if positions is None:
+            return pd.DataFrame({name: self[name] for name in columns}, index=self.index, columns=columns)
+        rows = positions if self.rows is None else self.rows[positions]
+        return pd.DataFrame({name: self.arrays[name][rows] for name in columns},
+                            index=self.index[positions], columns=columns)
+
+
 class Compose:
     """Composes several transforms together. Mostly copied from torchvision.
     Args:
         transforms (list of ``Transform`` objects): list of
             transforms to compose.
 
+        cache_stages (boolean, True by default): If True, outputs of the intermediate transforms are cached too.
+
+    Consecutive transforms with `transform_columns` (scalers, coordinate converters, filters) are fused:
+    they run on one `ColumnFrame` and the frame is materialized once after them (see `plan`).
+    The result is the same as of calling the transforms one by one.
+
+    Output of the first k transforms is cached under the hash of their reprs and the source (see `prefix_hash`),
+    so the chain with the modified tail resumes from the longest cached prefix.
+    Transforms with `cache_output = False` (cheap element-wise ones) are never the end of a cached prefix.
+
+    Every transform call is measured by the enabled `PROFILER` under the label `label(idx, t)`.
+
     Example:
         >>> Compose([
         >>>     transforms.StandardScale(),
@@ -31,45 +108,124 @@ class Compose:
         >>> ])
     """
 
-    def __init__(self, transforms):
+    def __init__(self, transforms, cache_stages=True):
         self.transforms = transforms
+        self.cache_stages = cache_stages
 
     def __call__(self, data: DFDataChunk, preserve_index=True, return_hash=False):
-        hash = None
+        hashes = None
+        start = 0
+        cached = None
         if data.cachable():
-            rep = {f'tr_{idx}': ("%r" % t) for idx, t in enumerate(self.transforms)}
-            hash = Cacher.build_hash(preserve_index, **rep, SRC=data.jit_hash())
-            with jit_cacher.instance() as cacher:
-                dc = cacher.read_datachunk(hash)
-                if dc:
-                    if not return_hash:
-                        return dc.as_df()
-                    else:
-                        return dc.as_df(), hash
-
-        data = data.as_df()
-        if preserve_index:
-            data['index'] = data.index
-        for t in self.transforms:
-            data = t(data)
-            if data.empty:
-                LOGGER.warning(f'{t.__class__.__name__} returned empty data. '
+            # reprs may change while transforming, so all the hashes are built beforehand
+            hashes = {k: self.prefix_hash(k, preserve_index, data.jit_hash()) for k in self.cache_points()}
+            with jit_cacher.instance() as cacher, PROFILER.measure('Compose: cache read') as record:
+                for k in reversed(self.cache_points()):
+                    cached = cacher.read_datachunk(hashes[k])
+                    if cached:
+                        start = k
+                        record.rows_out = len(cached)
+                        break
+            for idx, t in enumerate(self.transforms[:start]):
+                PROFILER.count_cache_hit(self.label(idx, t))
+            if cached and start == len(self.transforms):
+                if not return_hash:
+                    return cached.as_df()
+                else:
+                    return cached.as_df(), hashes[start]
+
+        if cached:
+            LOGGER.info(f'Resuming from the cached output of the first {start} transforms')
+            data = cached.as_df()
+        else:
+            # the frame shares memory with the chunk, transforms are allowed to modify it in place
+            data = data.as_df()
+            if preserve_index:
+                data['index'] = data.index
+        for end in [k for k in self.cache_points() if k > start]:
+            data, last = self.apply(data, self.transforms[start:end], cachable=hashes is not None, start=start)
+            if last is not None and data.empty:
+                LOGGER.warning(f'{last.__class__.__name__} returned empty data. '
                                'Skipping all further transforms')
                 if not return_hash:
                     return data
                 else:
                     return data, None
 
-        if hash is not None:
-            dc = DFDataChunk.from_df(data, hash)
-            with jit_cacher.instance() as cacher:
-                cacher.store_datachunk(hash, dc)
+            if hashes is not None:
+                dc = DFDataChunk.from_df(data, hashes[end])
+                with jit_cacher.instance() as cacher, PROFILER.measure('Compose: cache write', len(data)):
+                    cacher.store_datachunk(hashes[end], dc)
+            start = end
 
+        hash = hashes[len(self.transforms)] if hashes is not None else None
         if not return_hash:
             return data
         else:
             return data, hash
 
+    @staticmethod
+    def label(idx, t):
+        return f'Compose[{idx}]: {t.__class__.__name__}'
+
+    def prefix_hash(self, k, preserve_index, source):
+        """Hash of the output of the first k transforms, for k = len(transforms) it is the hash of the output."""
+        rep = {f'tr_{idx}': ("%r" % t) for idx, t in enumerate(self.transforms[:k])}
+        return Cacher.build_hash(preserve_index, **rep, SRC=source)
+
+    def cache_points(self):
+        """Sorted numbers of the first transforms which output is cached, the whole chain is always cached."""
+        points = [k + 1 for k, t in enumerate(self.transforms[:-1])
+                  if self.cache_stages and getattr(t, 'cache_output', True)]
+        return points + [len(self.transforms)]
+
+    def plan(self, transforms=None):
+        """Splits the transforms into the stages: (True, runs of the transforms with `transform_columns`)
+        and (False, [single transform working on the frame])."""
+        stages = []
+        for t in (self.transforms if transforms is None else transforms):
+            columnar = hasattr(t, 'transform_columns')
+            if columnar and stages and stages[-1][0]:
+                stages[-1][1].append(t)
+            else:
+                stages.append((columnar, [t]))
+        return stages
+
+    def apply(self, data: pd.DataFrame, transforms=None, cachable=False, start=0):
+        """Runs the plan of all or the given transforms. Returns the transformed frame and the last transform run,
+        the transforms after the one that returned empty data are skipped.
+        `start` is the position of the first given transform in the chain, it is used for the profiler labels."""
+        t = None
+        idx = start
+        for columnar, transforms in self.plan(transforms):
+            frame = ColumnFrame(data) if columnar and ColumnFrame.supports(data) else None
+            for t in transforms:
+                with PROFILER.measure(self.label(idx, t), len(data) if frame is None else len(frame)) as record:
+                    data, frame = self._run(t, data, frame, columnar)
+                    record.rows_out = len(data) if frame is None else len(frame)
+                    record.cache = 'miss' if cachable else None
+                idx += 1
+                if frame is None and data.empty:
+                    return data, t
+                if frame is not None and frame.empty:
+                    return frame.to_df(), t
+            if frame is not None:
+                data = frame.to_df()
+        return data, t
+
+    @staticmethod
+    def _run(t, data: pd.DataFrame, frame: Optional[ColumnFrame], columnar: bool):
+        """Runs the transform on the frame or on the data, returns them, `data` is outdated if there is a frame."""
+        # transform_columns returns False if it can't reproduce the transform on this frame
+        if frame is not None and t.transform_columns(frame):
+            return data, frame
+        if frame is not None:
+            data = frame.to_df()
+        data = t(data)
+        if columnar and not data.empty and ColumnFrame.supports(data):
+            return data, ColumnFrame(data)
+        return data, None
+
     def __repr__(self):
         """
         Returns:
@@ -91,6 +247,9 @@ class BaseTransformer(object):
          keep_fakes (boolean, True by default): If True, hits with no track are preserved
     """
 
+    # False for the cheap transforms, then `Compose` doesn't cache their output separately
+    cache_output = True
+
     def __init__(self, drop_old=False, columns=('x', 'y', 'z'), track_col='track', event_col='event',
                  station_col='station'):
         self.drop_old = drop_old
@@ -110,6 +269,13 @@ class BaseTransformer(object):
             data.loc[:, self.columns[i]] = normed[i]
         return data
 
+    def transform_frame_columns(self, frame: ColumnFrame, normed):
+        """`transform_data` on the columns of `frame`, `normed` must be in the order of the rows."""
+        for i in range(3):
+            if not self.drop_old:
+                frame.set(self.columns[i] + '_old', frame[self.columns[i]])
+            frame.set(self.columns[i], normed[i])
+
     def drop_fakes(self, data):
         return data[data[self.track_column] != -1]
 
@@ -131,6 +297,8 @@ class BaseScaler(BaseTransformer):
                                             else preserved in columns with suffix '_old'
     """
 
+    cache_output = False
+
     def __init__(self, scaler, drop_old=True, columns=('x', 'y', 'z')):
         super().__init__(drop_old=drop_old, columns=columns)
         self.scaler = scaler
@@ -146,6 +314,14 @@ class BaseScaler(BaseTransformer):
         data = self.transform_data(data=data, normed=norms)
         return data
 
+    def transform_columns(self, frame: ColumnFrame):
+        # the scaled columns are aligned with the data by the index, it is the order of the rows only for a range
+        if not frame.index.equals(pd.RangeIndex(len(frame))):
+            return False
+        norms = self.scaler.fit_transform(frame.to_df(self.columns))
+        self.transform_frame_columns(frame, norms.T)
+        return True
+
     def __repr__(self):
         return (f'{"-" * 30}\n'
                 f'{self.__class__.__name__} with scaler: {self.scaler}'
@@ -185,16 +361,77 @@ class BaseFilter(BaseTransformer):
         tracks = data.groupby([self.event_column, self.track_column])
         if self.num_stations is None:
             self.num_stations = tracks.size().max()
-        good_tracks = tracks.filter(self.filter_rule)
-        broken = list(data.loc[~data.index.isin(good_tracks.index)].index)
+        good_hits = self.good_hits(data, tracks)
+        broken = ~good_hits
         self._broken_tracks = data.loc[broken, [self.event_column, self.track_column, self.station_column]]
         self._num_broken_tracks = len(self._broken_tracks[[self.event_column, self.track_column]].drop_duplicates())
-        if self.keep_filtered and len(broken) > 0:
-            data.loc[~data.index.isin(good_tracks.index), 'track'] = -1
+        if self.keep_filtered and broken.any():
+            data.loc[broken, 'track'] = -1
         else:
-            data = data.loc[data.index.isin(good_tracks.index), :]
+            data = data.loc[good_hits, :]
         return self.add_fakes(data, fakes)
 
+    def transform_columns(self, frame: ColumnFrame):
+        # the custom rules need the whole frame of every track
+        if type(self).good_hits is BaseFilter.good_hits or self.track_column != 'track':
+            return False
+        is_fake = frame[self.track_column] == -1
+        hits, fakes = np.flatnonzero(~is_fake), np.flatnonzero(is_fake)
+        data = frame.to_df([self.event_column, self.track_column, self.station_column], hits)
+        tracks = data.groupby([self.event_column, self.track_column])
+        if self.num_stations is None:
+            self.num_stations = tracks.size().max()
+        good_hits = self.good_hits(data, tracks)
+        broken = ~good_hits
+        self._broken_tracks = data.loc[broken, [self.event_column, self.track_column, self.station_column]]
+        self._num_broken_tracks = len(self._broken_tracks[[self.event_column, self.track_column]].drop_duplicates())
+        if self.keep_filtered and broken.any():
+            track = frame['track'].copy()
+            track[hits[broken]] = -1
+            frame.set('track', track)
+        else:
+            hits = hits[good_hits]
+        # fakes are moved to the end, as `add_fakes` does
+        frame.take(np.concatenate([hits, fakes]))
+        frame.reset_index()
+        return True
+
+    def good_hits(self, data, tracks):
+        """Mask of the hits of the tracks passing the filter. `filter_rule` is called for every track here,
+        the filters with the known rules override it with the vectorized version (see `track_stats`).
+        """
+        return data.index.isin(tracks.filter(self.filter_rule).index)
+
+    def track_stats(self, data, tracks, with_stations=True):
+        """Per-track reductions without python calls per track, the hits are sorted by (track, station) keys.
+        # Returns:
+            codes (np.ndarray): number of the track of every hit, -1 for the hits out of the groups
+            sizes, stations_num, max_station (np.ndarray): number of hits, number of unique stations
+                                                          and max station of every track
+        """
+        codes = tracks.ngroup().values
+        in_groups = codes >= 0
+        sizes = np.bincount(codes[in_groups], minlength=tracks.ngroups)
+        if not with_stations:
+            return codes, sizes, None, None
+
+        station_codes, station_values = pd.factorize(data[self.station_column].values, sort=True)
+        stations_range = len(station_values) + 1
+        # unique (track, station) pairs, sorted by the track and then by the station
+        keys = np.unique(codes[in_groups].astype(np.int64) * stations_range + station_codes[in_groups] + 1)
+        key_tracks, key_stations = keys // stations_range, keys % stations_range - 1
+        stations_num = np.bincount(key_tracks, minlength=tracks.ngroups)
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = key_tracks[1:] != key_tracks[:-1]
+        max_station = np.zeros(tracks.ngroups, dtype=data[self.station_column].dtype)
+        max_station[key_tracks[last]] = station_values[key_stations[last]]
+        return codes, sizes, stations_num, max_station
+
+    @staticmethod
+    def hits_of(codes, good_tracks):
+        # the hits out of the groups (code -1) are never good, as with `filter`
+        return np.append(good_tracks, False)[codes]
+
     def get_broken(self):
         return self._broken_tracks
 
@@ -218,6 +455,11 @@ class BaseCoordConverter(BaseTransformer):
          to_columns (list or tuple of length 3, ['r', 'phi', 'z'] by default): list of features to convert to
     """
 
+    cache_output = False
+
+    # convert_function reads only `from_columns` by `data[col]`, so it accepts `ColumnFrame`
+    columnar_convert = False
+
     def __init__(self, convert_function, drop_old=False, from_columns=('x', 'y', 'z'),
                  to_columns=('r', 'phi', 'z'), postfix='general_convert'):
         assert len(from_columns) == 3, 'To convert coordinates, you need 3 old columns'
@@ -250,12 +492,35 @@ class BaseCoordConverter(BaseTransformer):
         self.get_ranges(data, self.to_columns)
         return data
 
+    def transform_columns(self, frame: ColumnFrame):
+        if not self.columnar_convert:
+            return False
+        self.get_ranges(frame, self.from_columns)
+        converted = self.convert_function(frame)
+        if not self.drop_old:
+            for col in self.from_columns:
+                frame.set(col + '_' + self.postfix, frame[col])
+        if self.drop_old:
+            for col in self.from_columns:
+                frame.delete(col)
+        for i in range(len(self.to_columns)):
+            frame.set(self.to_columns[i], converted[i])
+        self.get_ranges(frame, self.to_columns)
+        return True
+
     def get_ranges(self, data, columns):
         for col in columns:
-            try:
-                self.range_[col] = (min(data[col]), max(data[col]))
-            except:
-                'This column is not used'
+            if col not in data or len(data[col]) == 0:
+                # this column is not used
+                continue
+            values = np.asarray(data[col])
+            if values.dtype.kind not in 'iuf':
+                self.range_[col] = (min(values), max(values))
+            elif values.dtype.kind == 'f' and np.isnan(values[0]):
+                # same as the builtin min and max: nan is skipped unless it is the first value
+                self.range_[col] = (values[0].item(), values[0].item())
+            else:
+                self.range_[col] = (np.nanmin(values).item(), np.nanmax(values).item())
 
     def get_ranges_str(self):
         return '\n'.join([f'{i}: from {j[0]} to {j[1]}' for i, j in self.range_.items()])
@@ -277,6 +542,8 @@ class PreserveOriginal:
          columns (list or tuple, None by default): Columns to keep state of.
     """
 
+    cache_output = False
+
     def __init__(self, columns=None):
         self.columns = columns
 
@@ -310,6 +577,8 @@ class BakeStationValues:
                                             else preserved in columns with suffix '_old'
     """
 
+    cache_output = False
+
     def __init__(self, values, col='z', station_col='station'):
         self.station_values = values
         self.station_column = station_col
@@ -422,6 +691,8 @@ class ConstraintsNormalize(BaseTransformer):
     Number of constraints must be the same as number of columns
     """
 
+    cache_output = False
+
     def __init__(self, drop_old=True, columns=('x', 'y', 'z'), margin=1e-3, use_global_constraints=True,
                  constraints=None):
         super().__init__(drop_old=drop_old, columns=columns)
@@ -468,46 +739,79 @@ class ConstraintsNormalize(BaseTransformer):
             #           self.constraints.keys()]), "Some station keys in constraints are not presented in data. Keys: " \
             #                                       f"{data['station'].unique()}; data keys: {self.constraints.keys()}"
 
-            for station in list(data['station'].unique()):
-                # print(data['station'].unique())
-                group = data.loc[data['station'] == station,]
-                x_norm, y_norm, z_norm = self.normalize(group, self.constraints[station])
-                data.loc[data['station'] == station, :] = \
-                    self.transform_data_by_group(data['station'] == station, data,
-                                                 [x_norm, y_norm, z_norm])
+            data = self.normalize_by_stations(data)
         return data
 
-    def transform_data_by_group(self, grouping, data, normed):
-        for i in range(3):
-            assert self.drop_old, "Saving old data is not supported for now"
-            data.loc[grouping, self.columns[i]] = normed[i]
+    def transform_columns(self, frame: ColumnFrame):
+        if self.use_global_constraints:
+            if self.constraints is None:
+                return False
+            data = frame.to_df(self.columns)
+            global_constrains = {col: tuple(self.constraints[col]) for col in self.columns}
+            for col, (global_min, global_max) in global_constrains.items():
+                assert global_min < global_max, f"global_min should be < global_max {global_min} < {global_max}"
+            self.transform_frame_columns(frame, [norm.values for norm in self.normalize(data, global_constrains)])
+            return True
+
+        data = frame.to_df([self.station_column] + list(self.columns))
+        if self.constraints is None:
+            self.constraints = self.get_stations_constraints(data)
+        data = self.normalize_by_stations(data)
+        for col in self.columns:
+            frame.set(col, data[col].values)
+        return True
+
+    def normalize_by_stations(self, data):
+        """Scales all the rows at once with the (min, max) of their stations gathered from the lookup table."""
+        assert self.drop_old, "Saving old data is not supported for now"
+        stations = list(self.constraints.keys())
+        # bounds[station position, column] = (min, max)
+        bounds = np.array([[self.constraints[station][col] for col in self.columns] for station in stations],
+                          dtype=np.float64).reshape(-1, len(self.columns), 2)
+        positions = pd.Index(stations).get_indexer(data[self.station_column].values)
+        assert (positions >= 0).all(), \
+            f"No constraints for stations {data[self.station_column].values[positions < 0][:10]}"
+        mins, maxs = bounds[positions, :, 0], bounds[positions, :, 1]
+        values = data[list(self.columns)].values
+        in_range = (values >= mins) & (values <= maxs)
+        if not in_range.all():
+            row, col = np.argwhere(~in_range)[0]
+            station = stations[positions[row]]
+            raise AssertionError(f'Some values in column {self.columns[col]} are not in '
+                                 f'{self.constraints[station][self.columns[col]]}')
+        normed = 2 * (values - mins) / (maxs - mins) - 1
+        for i, col in enumerate(self.columns):
+            data[col] = normed[:, i]
         return data
 
     def get_stations_constraints(self, df):
-        groups = df['station'].unique()
-
+        # stations are in the order of appearance, as `unique` returns them
+        stations = df[self.station_column].unique()
+        # groupby skips NaN, while the constraints must bound every value
+        assert not df[list(self.columns)].isna().values.any(), \
+            f'NaN values in columns {list(self.columns)}, constraints can not be computed'
+        grouped = df.groupby(self.station_column, sort=False)[list(self.columns)]
+        mins, maxs = grouped.min().loc[stations], grouped.max().loc[stations]
+
+        # python floats, so the repr and the cache hashes don't depend on the numpy version
         station_constraints = {}
-        for station_num in groups:
-            group = df.loc[df['station'] == station_num,]
-            min_x, max_x = min(group[self.columns[0]]) - self.margin, max(group[self.columns[0]]) + self.margin
-            min_y, max_y = min(group[self.columns[1]]) - self.margin, max(group[self.columns[1]]) + self.margin
-            min_z, max_z = min(group[self.columns[2]]) - self.margin, max(group[self.columns[2]]) + self.margin
-            station_constraints[station_num] = {self.columns[0]: (min_x, max_x),
-                                                self.columns[1]: (min_y, max_y),
-                                                self.columns[2]: (min_z, max_z)}
+        for i, station_num in enumerate(stations):
+            station_constraints[station_num] = {col: (float(mins[col].values[i] - self.margin),
+                                                      float(maxs[col].values[i] + self.margin))
+                                                for col in self.columns}
         return station_constraints
 
     def normalize(self, df, constraints):
         x_min, x_max = constraints[self.columns[0]]
         y_min, y_max = constraints[self.columns[1]]
         z_min, z_max = constraints[self.columns[2]]
-        assert all(df[self.columns[0]].between(x_min, x_max)), \
+        assert df[self.columns[0]].between(x_min, x_max).all(), \
             f'Some values in column {self.columns[0]} are not in {constraints[self.columns[0]]}'
         x_norm = 2 * (df[self.columns[0]] - x_min) / (x_max - x_min) - 1
-        assert all(df[self.columns[1]].between(y_min, y_max)), \
+        assert df[self.columns[1]].between(y_min, y_max).all(), \
             f'Some values in column {self.columns[1]} are not in {constraints[self.columns[1]]}'
         y_norm = 2 * (df[self.columns[1]] - y_min) / (y_max - y_min) - 1
-        assert all(df[self.columns[2]].between(z_min, z_max)), \
+        assert df[self.columns[2]].between(z_min, z_max).all(), \
             f'Some values in column {self.columns[2]} are not in {constraints[self.columns[2]]}'
         z_norm = 2 * (df[self.columns[2]] - z_min) / (z_max - z_min) - 1
         return x_norm, y_norm, z_norm
@@ -541,6 +845,10 @@ class DropShort(BaseFilter):
         super().__init__(self.filter, num_stations=num_stations, station_col=station_col, track_col=track_col,
                          event_col=event_col, keep_filtered=keep_filtered)
 
+    def good_hits(self, data, tracks):
+        codes, sizes, _, _ = self.track_stats(data, tracks, with_stations=False)
+        return self.hits_of(codes, sizes >= self.num_stations)
+
     def __repr__(self):
         return (f'{"-" * 30}\n'
                 f'{self.__class__.__name__} with parameters: num_stations={self.num_stations}, '
@@ -564,6 +872,13 @@ class DropEmpty(object):
         result = group.filter(lambda e: not e[e[self.track_column] != -1].empty)
         return result
 
+    def transform_columns(self, frame: ColumnFrame):
+        events = frame[self.event_column]
+        with_tracks = np.unique(events[frame[self.track_column] != -1])
+        # hits without the event (nan) are out of the groups
+        frame.take(np.flatnonzero(np.isin(events, with_tracks) & ~pd.isna(events)))
+        return True
+
     def __repr__(self):
         return self.__class__.__name__
 
@@ -582,6 +897,10 @@ class DropSpinningTracks(BaseFilter):
         super().__init__(self.filter, station_col=station_col, track_col=track_col, event_col=event_col,
                          keep_filtered=keep_filtered)
 
+    def good_hits(self, data, tracks):
+        codes, sizes, stations_num, _ = self.track_stats(data, tracks)
+        return self.hits_of(codes, stations_num == sizes)
+
     def __repr__(self):
         return (f'{"-" * 30}\n'
                 f'{self.__class__.__name__} with parameters:'
@@ -648,11 +967,20 @@ class DropTracksWithHoles(BaseFilter):
                  track_col='track',
                  event_col='event',
                  min_station_num=0):
+        # stations are integers, so the range from the non-integer start has the stations from its floor;
+        # both the filter_rule and the vectorized good_hits use this integer start
+        self.min_station_num = int(np.floor(min_station_num))
         self.filter = lambda x: x[self.station_column].values.shape[0] == \
-                                len(np.arange(min_station_num, int(x[self.station_column].max()))) + 1
+                                len(np.arange(self.min_station_num, int(x[self.station_column].max()))) + 1
         super().__init__(self.filter, station_col=station_col, track_col=track_col, event_col=event_col,
                          keep_filtered=keep_filtered)
 
+    def good_hits(self, data, tracks):
+        codes, sizes, _, max_station = self.track_stats(data, tracks)
+        # number of the stations from min_station_num to the max one
+        expected = np.maximum(max_station.astype(np.int64) - self.min_station_num, 0) + 1
+        return self.hits_of(codes, sizes == expected)
+
     def __repr__(self):
         return (f'{"-" * 30}\n'
                 f'{self.__class__.__name__} with parameters:'
@@ -683,6 +1011,10 @@ class DropFakes(BaseTransformer):
         data = self.drop_fakes(data)
         return data
 
+    def transform_columns(self, frame: ColumnFrame):
+        frame.take(np.flatnonzero(frame[self.track_column] != -1))
+        return True
+
     def __repr__(self):
         return (f'{"-" * 30}\n'
                 f'{self.__class__.__name__} with parameters: track_col={self.track_col}'
@@ -702,6 +1034,8 @@ class ToCylindrical(BaseCoordConverter):
        New "z" column (same value for each station) will be r for cylindrical chamber.
     """
 
+    columnar_convert = True
+
     def __init__(self, drop_old=False, cart_columns=('x', 'y', 'z'), polar_columns=('r', 'phi', 'z'),
                  postfix='before_cyl'):
         super().__init__(self.convert, drop_old=drop_old, from_columns=cart_columns, to_columns=polar_columns,
@@ -732,6 +1066,8 @@ class ToCartesian(BaseCoordConverter):
 
     """
 
+    columnar_convert = True
+
     def __init__(self, drop_old=True, cart_columns=('x', 'y', 'z'), polar_columns=('r', 'phi', 'z')):
         self.from_columns = polar_columns
         self.to_columns = cart_columns
@@ -791,84 +1127,78 @@ class ToBuckets(BaseTransformer):
             if flat is True, returns dataframe with specific column, else dict with bucket dataframes
         """
         # assert type(data) == pd.core.frame.DataFrame, "unsupported data format"
+        fakes = None
+        if self.keep_fakes:
+            fakes = df.loc[df[self.track_column] == -1, :].copy()
+            df = self.drop_fakes(df).copy()
         df['index'] = df.index
         rs = np.random.RandomState(self.random_state)
         groupby = df.groupby([self.event_column, self.track_column])
-        maxlen = groupby.size().max()
+        # track number of every hit, tracks are in the order of the (event, track) keys
+        codes = groupby.ngroup().values
+        sizes = np.bincount(codes[codes >= 0], minlength=groupby.ngroups)
+        # hits of every track are contiguous in `hits`, in the order of the data
+        hits = np.argsort(np.where(codes >= 0, codes, groupby.ngroups), kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+        maxlen = sizes.max()
         if self.max_num_stations is None:
             self.max_num_stations = maxlen
-        minlen = max(groupby.size().min(), 3)
-        subbuckets = {}
-        res = {}
-        val_cnt = groupby.size().unique()  # get all unique track lens (in BES3 all are 3)
-        val_cnt = range(minlen, max(maxlen + 1, val_cnt.max()))
-        print(val_cnt)
-        for length in val_cnt:
-            this_len = groupby.filter(lambda x: x.shape[0] == length)
-            if len(this_len) > 0:
-                this_len_groups = this_len.groupby([self.event_column, self.track_column])
-                bucket_index = np.stack(list(this_len_groups['index'].agg(lambda x: list(x.values))), axis=0)
-            else:
-                bucket_index = []
-            subbuckets[length] = bucket_index
-        print(subbuckets)
+        minlen = max(sizes.min(), 3)
+        # subbuckets[length] are the tracks of this length, which are not in the buckets yet
+        subbuckets = {length: np.flatnonzero(sizes == length) for length in range(minlen, maxlen + 1)}
+        remaining = np.zeros(maxlen + 2, dtype=np.int64)
+        for length, tracks in subbuckets.items():
+            remaining[length] = len(tracks)
         # approximate size of the each bucket
         bsize = len(df) // (self.max_num_stations - 2)
-        print(bsize)
         if self.max_bucket_size is not None:
             bsize = min(bsize, self.max_bucket_size)
+        # buckets[n_points] are the blocks of the tracks, only their first n_points hits are taken
         buckets = {i: [] for i in range(3, self.max_num_stations + 1)}
-        print(buckets)
+        filled = {i: 0 for i in buckets.keys()}
         # reverse loop until two points
         for n_points in range(self.max_num_stations, minlen - 1, -1):
-            print(n_points, maxlen)
-            # while bucket is not full
-            k = n_points
             if n_points not in buckets.keys():
                 continue
-            while len(buckets[n_points]) < bsize:
-                if k < n_points or k > maxlen:
+            k = n_points
+            # while bucket is not full
+            while filled[n_points] < bsize and n_points <= k <= maxlen:
+                # the empty subbuckets are skipped, shuffling them does not change the random state
+                nonempty = np.flatnonzero(remaining[k:maxlen + 1])
+                if len(nonempty) == 0:
                     break
+                k += nonempty[0]
                 if self.shuffle:
                     rs.shuffle(subbuckets[k])
-                # if we can't extract all data from subbucket
-                # without bsize overflow
-                if len(buckets[n_points]) + len(subbuckets[k]) > bsize:
-                    n_extract = bsize - len(buckets[n_points])
-                    # extract n_extract samples
-                    buckets[n_points].extend(subbuckets[k][:n_extract, :n_points])
-                    print(buckets[n_points])
-                    # remove them from original subbucket
-                    subbuckets[k] = subbuckets[k][n_extract:]
-                    print(subbuckets)
-                else:
-                    if len(subbuckets[k]) == 0:
-                        k += 1
-                        continue
-                    buckets[n_points].extend(subbuckets[k][:, :n_points])
-                    # remove all data from the original list
-                    subbuckets[k] = []
-                    # increment index
+                # extract as many tracks as the bucket can take
+                n_extract = min(bsize - filled[n_points], len(subbuckets[k]))
+                buckets[n_points].append(subbuckets[k][:n_extract])
+                filled[n_points] += n_extract
+                subbuckets[k] = subbuckets[k][n_extract:]
+                remaining[k] = len(subbuckets[k])
                 k += 1
-                print(buckets)
-                if all([len(subbuckets[i]) == 0 for i in range(n_points, maxlen + 1) if i in subbuckets.keys()]):
+                if not remaining[n_points:].any():
                     break
 
-            if all([len(subbuckets[i]) == 0 for i in subbuckets.keys()]):
+            if not remaining.any():
                 break
-        # append unappended items
-        for i, k in subbuckets.items():
-            if len(k) > 0:
-                try:
-                    append_len = int(len(k) / (i - 2))
-                    begin = 0
-                    for j in range(i - 1, min(list(buckets.keys())) - 1, -1):
-                        print(k[begin:begin + append_len])
-                        buckets[j].extend(k[begin:begin + append_len, :j])
-                        begin = begin + append_len
-                except:
-                    print('alert!')
-        buckets = {k: np.concatenate(i) for k, i in buckets.items() if len(i) > 0}
+        # append unappended items, the tracks of length i are split evenly between the buckets i-1 .. 3
+        for i, tracks in subbuckets.items():
+            if len(tracks) > 0 and i - 1 <= self.max_num_stations:
+                append_len = int(len(tracks) / (i - 2))
+                for begin, j in enumerate(range(i - 1, min(list(buckets.keys())) - 1, -1)):
+                    buckets[j].append(tracks[begin * append_len:(begin + 1) * append_len])
+
+        index = df['index'].values
+        bucket_index = {}
+        for n_points, blocks in buckets.items():
+            tracks = np.concatenate(blocks) if blocks else np.empty(0, dtype=np.int64)
+            if len(tracks) > 0:
+                # first n_points hits of every track, track after track
+                rows = (offsets[tracks][:, None] + np.arange(n_points)).ravel()
+                bucket_index[n_points] = index[hits[rows]]
+        buckets = bucket_index
         self.buckets_ = buckets
         if self.flat is True:
             res = df.copy()
@@ -876,12 +1206,13 @@ class ToBuckets(BaseTransformer):
             for i, bucket in buckets.items():
                 res.loc[bucket, 'bucket'] = i
             if self.keep_fakes:
-                self.fakes.loc[:, 'bucket'] = -1
-                res = super().add_fakes(data)
+                fakes['index'] = fakes.index
+                fakes['bucket'] = -1
+                res = self.add_fakes(res, fakes)
         else:
             res = {i: df.loc[bucket] for i, bucket in buckets.items()}
             if self.keep_fakes:
-                res[-1] = self.fakes
+                res[-1] = fakes
         return res
 
     def get_bucket_index(self):
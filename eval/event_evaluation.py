@@ -72,6 +72,8 @@ class EventEvaluator:
             self.data_df_transformed.append(data_df)
             self.data_df_hashes.append(hash)
         print("[prepare] finished")
+        with jit_cacher.instance() as cacher:
+            cacher.log_stats()
         print("[prepare] loading your model(s)...")
         self.model_loader = model_loader
         self.loaded_model_state = self.model_loader()
@@ -76,15 +76,17 @@ class GraphsDataLoader_Sampler_New(GraphDataLoader_NEW):
                  dataset_cls: TorchGraphDataset.__class__,
                  collate_fn: Callable,
                  subset_cls: Subset.__class__ = Subset,
-                 with_random=True):
+                 with_random=True,
+                 sampler_cls: Callable = GraphBatchBucketSampler):
         super(GraphsDataLoader_Sampler_New, self).__init__(batch_size=1,
                                                            dataset_cls=dataset_cls,
                                                            collate_fn=collate_fn,
                                                            with_random=with_random,
                                                            subset_cls=subset_cls)
 
-        self.train_sampler = GraphBatchBucketSampler(self.train_data)
-        self.val_sampler = GraphBatchBucketSampler(self.val_data)
+        # GraphEdgeBudgetSampler for packed_graph_collate_fn
+        self.train_sampler = sampler_cls(self.train_data)
+        self.val_sampler = sampler_cls(self.val_data)
 
     def get_val_dataloader(self) -> DataLoader:
         return DataLoader(
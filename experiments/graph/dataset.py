@@ -1,20 +1,24 @@
 import gin
+import numpy as np
 import pandas as pd
 
 from torch.utils.data import Dataset
 
 from ariadne.graph_net.dataset import SubsetWithItemLen
 from ariadne_v2.jit_cacher import Cacher
-from experiments.graph.graph_utils.graph import sparse_to_graph
+from ariadne_v2.storage_codec import read_dataset
+from experiments.graph.graph_utils.graph import sparse_to_graph, SparseGraph
 from experiments.graph.inferrer import GraphDataset
 
 
 @gin.configurable
 class TorchGraphDataset(GraphDataset, Dataset):
 
-    def __init__(self, dataset_name, cache_graphs=False, override_len=None):
+    def __init__(self, dataset_name, cache_graphs=False, override_len=None, sparse=False):
         super(TorchGraphDataset, self).__init__(dataset_name)
         self.cache_graphs = cache_graphs
+        # return SparseGraph as stored, without the dense matrices (for sparse_graph_collate_fn)
+        self.sparse = sparse
         self.graphs = {}
         self.len_override = override_len
 
@@ -23,7 +27,11 @@ class TorchGraphDataset(GraphDataset, Dataset):
         if graph is None:
             dataset_path = self.events_db_df.iloc[index]['name']
             graph_dict_hdf5 = self.get(dataset_path)
-            graph = sparse_to_graph(**{col: val[()] for col, val in graph_dict_hdf5.items()})
+            graph_dict = {col: read_dataset(val) for col, val in graph_dict_hdf5.items()}
+            if self.cache_graphs:
+                # every memory map takes an entry of vm.max_map_count, the cached graphs would exhaust them
+                graph_dict = {col: np.array(val) for col, val in graph_dict.items()}
+            graph = SparseGraph(**graph_dict) if self.sparse else sparse_to_graph(**graph_dict)
             if self.cache_graphs:
                 self.graphs[index] = graph
         return graph
@@ -45,6 +53,10 @@ class TorchGraphDataset(GraphDataset, Dataset):
         assert self.connected
         return self.events_db_df.iloc[item_index]['X']
 
+    def get_item_edges(self, item_index):
+        assert self.connected
+        return self.events_db_df.iloc[item_index]['y']
+
 
 @gin.configurable(allowlist=[])
 class SubsetTorchGraphDataset(SubsetWithItemLen):
@@ -53,3 +65,6 @@ class SubsetTorchGraphDataset(SubsetWithItemLen):
 
     def get_item_length(self, item_index):
         return self.dataset.get_item_length(self.indices[item_index])
+
+    def get_item_edges(self, item_index):
+        return self.dataset.get_item_edges(self.indices[item_index])
@@ -4,7 +4,7 @@ A Graph is a namedtuple of matrices X, Ri, Ro, y.
 """
 
 from collections import namedtuple
-from typing import List
+from typing import List, Union
 
 import h5py
 import numpy as np
@@ -13,9 +13,15 @@ import numpy as np
 from ariadne_v2 import jit_cacher
 
 Graph = namedtuple('Graph', ['X', 'Ri', 'Ro', 'y'])
+# A SparseGraph keeps the nonzero positions of Ri and Ro instead of the matrices, as they are stored on disk
+SparseGraph = namedtuple('SparseGraph', ['X', 'Ri_rows', 'Ri_cols', 'Ro_rows', 'Ro_cols', 'y'])
 
 
 def graph_to_sparse(graph):
+    if isinstance(graph, SparseGraph):
+        return dict(X=graph.X, y=graph.y,
+                    Ri_rows=graph.Ri_rows, Ri_cols=graph.Ri_cols,
+                    Ro_rows=graph.Ro_rows, Ro_cols=graph.Ro_cols)
     Ri_rows, Ri_cols = graph.Ri.nonzero()
     Ro_rows, Ro_cols = graph.Ro.nonzero()
     return dict(X=graph.X, y=graph.y,
@@ -37,15 +43,23 @@ def save_graph(graph, filename):
     np.savez(filename, **graph_to_sparse(graph))
 
 
-def save_graph_hdf5_custom(db: h5py.File, path, graph: Graph):
+def save_graph_hdf5_custom(db: h5py.File, path, graph: Union[Graph, SparseGraph]):
     if f"{path}" in db:
         del db[f"{path}"]
+    if isinstance(graph, SparseGraph):
+        for name, data in graph_to_sparse(graph).items():
+            db.create_dataset(f"{path}/{name}", data=data, shape=data.shape, compression="gzip")
+        return
     db.create_dataset(f"{path}/X", data=graph.X, shape=graph.X.shape, compression="gzip")
     db.create_dataset(f"{path}/y", data=graph.y, shape=graph.y.shape, compression="gzip")
     db.create_dataset(f"{path}/Ri", data=graph.Ri, shape=graph.Ri.shape, compression="gzip")
     db.create_dataset(f"{path}/Ro", data=graph.Ro, shape=graph.Ro.shape, compression="gzip")
 
-def read_graph_hdf5_custom(db: h5py.File, path, graph: Graph):
+def read_graph_hdf5_custom(db: h5py.File, path, graph: Graph, sparse=False):
+    """Reads the graph in either layout, the sparse one is densified to the Graph unless `sparse`"""
+    if f"{path}/Ri_rows" in db:
+        graph = SparseGraph(**{name: db[f"{path}/{name}"][()] for name in SparseGraph._fields})
+        return graph if sparse else sparse_to_graph(**graph._asdict())
     return Graph(X=db[f"{path}/X"][()],
                  y=db[f"{path}/y"][()],
                  Ri=db[f"{path}/Ri"][()],
@@ -68,12 +82,14 @@ def save_graphs_new(graphs):
     for graph_data_chunk in graphs:
         if graph_data_chunk.processed_object is None:
             continue
-        processed_graph: Graph = graph_data_chunk.processed_object
+        processed_graph: Union[Graph, SparseGraph] = graph_data_chunk.processed_object
         save_graph(processed_graph,
                    graph_data_chunk.output_name)
 
 
-def load_graph(filename):
-    """Reade a single graph NPZ"""
+def load_graph(filename, sparse=False):
+    """Reade a single graph NPZ, as the SparseGraph if `sparse`"""
     with np.load(filename) as f:
+        if sparse:
+            return SparseGraph(**dict(f.items()))
         return sparse_to_graph(**dict(f.items()))
@@ -4,7 +4,11 @@ import gin
 import pandas as pd
 import numpy as np
 
-from .graph import Graph
+from .graph import Graph, SparseGraph
+
+
+# widening of the windows of get_window_candidates, covers the rounding of the shifted bounds
+WINDOW_MARGIN = 1e-6
 
 
 def calc_dphi(phi1, phi2):
@@ -14,33 +18,113 @@ def calc_dphi(phi1, phi2):
     return dphi
 
 
-def get_edges_from_supernodes(sn_from, sn_to):
-    prev_edges = sn_from.rename(columns={'to_ind': 'cur_ind'})
-    next_edges = sn_to.rename(columns={'from_ind': 'cur_ind'})
-    prev_edges['edge_index'] = prev_edges.index
-    next_edges['edge_index'] = next_edges.index
+def concat_ranges(starts, counts):
+    """Concatenated ranges [start, start + count), the CSR rows of the given offsets and lengths."""
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(total) - offsets + np.repeat(starts, counts)
+
+
+def csr_join(left, right):
+    """Inner join of the positions of the equal values, ordered by the first appearance of the value in left,
+    then by the left and by the right position (the order of `pd.merge` before pandas 2.2, later ones differ).
+    Right values are sorted once and every left value takes a CSR row of them.
+
+    Returns the left positions in the join order, the numbers of their pairs and the right positions of all the pairs,
+    so the left side of the pairs is `np.repeat(left_rows, counts)`.
+    """
+    order = np.argsort(right, kind='stable')
+    sorted_right = right[order]
+    left_rows = np.argsort(pd.factorize(left)[0], kind='stable')
+    starts = np.searchsorted(sorted_right, left[left_rows], side='left')
+    counts = np.searchsorted(sorted_right, left[left_rows], side='right') - starts
+    return left_rows, counts, order[concat_ranges(starts, counts)]
+
+
+def get_window_candidates(values_p, values_c, window, period=None):
+    """Pairs (i, j) with `window[0] < values_c[j] - values_p[i] < window[1]` and maybe a bit more,
+    found by the binary search in the sorted `values_c`. With `period` the difference is also taken
+    shifted by one period both ways, as `calc_dphi` wraps it. Window is widened by a small margin,
+    the exact condition is left to the caller.
+
+    Returns the pairs, or None if every pair is a candidate.
+    """
+    lo, hi = window[0] - WINDOW_MARGIN, window[1] + WINDOW_MARGIN
+    shifts = [0.]
+    if period is not None:
+        if not hi - lo < period:
+            return None
+        # the shifted windows do not overlap, so the pairs are not repeated
+        shifts = [-period, 0., period]
+    order = np.argsort(values_c, kind='stable')
+    sorted_c = values_c[order]
+    first, second = [], []
+    for shift in shifts:
+        starts = np.searchsorted(sorted_c, values_p + (lo + shift), side='left')
+        counts = np.searchsorted(sorted_c, values_p + (hi + shift), side='right') - starts
+        first.append(np.repeat(np.arange(len(values_p)), counts))
+        second.append(order[concat_ranges(starts, counts)])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def get_window_pairs(phi_p, z_p, phi_c, z_c, restrictions_0, restrictions_1):
+    """Pairs (i, j) of the hits of the consecutive stations which segments pass `apply_nodes_restrictions`:
+    `restrictions_0[0] < calc_dphi(phi_p[i], phi_c[j]) < restrictions_0[1]` and
+    `restrictions_1[0] < z_c[j] - z_p[i] < restrictions_1[1]`, ordered by i and then by j.
+    Candidates are searched by the narrower of the two windows, so the cost follows the accepted pairs
+    rather than the size of the product.
+    """
+    candidates = [get_window_candidates(phi_p, phi_c, restrictions_0, period=2 * np.pi),
+                  get_window_candidates(z_p, z_c, restrictions_1)]
+    candidates = [pairs for pairs in candidates if pairs is not None]
+    if candidates:
+        first, second = min(candidates, key=lambda pairs: len(pairs[0]))
+    else:
+        first = np.repeat(np.arange(len(phi_p)), len(phi_c))
+        second = np.tile(np.arange(len(phi_c)), len(phi_p))
 
-    # merge segments by their common hit in the middle
-    line_graph_edges = pd.merge(prev_edges, next_edges, on='cur_ind', suffixes=('_p', '_c'))
+    # the same expressions as of get_supernodes_df and apply_nodes_restrictions
+    dy = calc_dphi(phi_p[first], phi_c[second])
+    dz = z_c[second] - z_p[first]
+    keep = (dy > restrictions_0[0]) & (dy < restrictions_0[1]) & (dz > restrictions_1[0]) & (dz < restrictions_1[1])
+    first, second = first[keep], second[keep]
+    order = np.argsort(first * len(phi_c) + second, kind='stable')
+    return first[order], second[order]
+
+
+def get_edges_from_supernodes(sn_from, sn_to):
+    # join segments by their common hit in the middle
+    prev_rows, counts, cur = csr_join(sn_from['to_ind'].values, sn_to['from_ind'].values)
 
-    line_graph_edges = line_graph_edges.assign(true_superedge=-1)
+    def prev_values(values):
+        return np.repeat(values.take(prev_rows), counts)
 
     # track the 'true' superedge. true_superedge is a combination of 2 consecutive true edges of 1 track
-    index_true_superedge = line_graph_edges[(line_graph_edges.track_p == line_graph_edges.track_c) &
-                                            (line_graph_edges.track_p != -1)]
-    line_graph_edges.loc[index_true_superedge.index, 'true_superedge'] = index_true_superedge.track_p.values
+    track_p = prev_values(sn_from['track'].values)
+    track_c = sn_to['track'].values.take(cur)
+    true_superedge = np.where((track_p == track_c) & (track_p != -1), track_p, -1)
 
-    ba = line_graph_edges[['dx_p', 'dy_p', 'dz_p']].values
-    cb = line_graph_edges[['dx_c', 'dy_c', 'dz_c']].values
     # this was an old weight function:
     # norm_ba = np.linalg.norm(ba, axis=1)
     # norm_cb = np.linalg.norm(cb, axis=1)
     # dot = np.einsum('ij,ij->i', ba, cb)
-    # ^may be useful later but now weight function is just a norm:
-    w = np.linalg.norm(ba - cb, axis=1)
-    line_graph_edges['weight'] = w
-    indexation = ['weight', 'true_superedge', 'edge_index_p', 'edge_index_c', 'from_ind', 'cur_ind', 'to_ind']
-    return line_graph_edges[indexation]
+    # ^may be useful later but now weight function is just a norm of ba - cb,
+    # summed in the same order as np.linalg.norm(ba - cb, axis=1)
+    w = np.zeros(len(cur))
+    for col in ['dx', 'dy', 'dz']:
+        diff = prev_values(sn_from[col].values) - sn_to[col].values.take(cur)
+        w += diff * diff
+    w = np.sqrt(w)
+    return pd.DataFrame({'weight': w,
+                         'true_superedge': true_superedge.astype(np.int64, copy=False),
+                         'edge_index_p': prev_values(sn_from.index.values).astype(np.int64, copy=False),
+                         'edge_index_c': sn_to.index.values.take(cur).astype(np.int64, copy=False),
+                         'from_ind': prev_values(sn_from['from_ind'].values),
+                         'cur_ind': prev_values(sn_from['to_ind'].values),
+                         'to_ind': sn_to['to_ind'].values.take(cur)})
+
 
 def get_supernodes_df(one_station_segments,
                       axes,
@@ -48,11 +132,10 @@ def get_supernodes_df(one_station_segments,
                       station=-1,
                       STATION_COUNT=0,
                       pi_fix=False, ):
-    ret = pd.DataFrame()
-
     # a bit of overgeneralization, all values are from yaml config
     # usually suffixes are "_p" and "_c" (word "_previousЭ and "_current" shorten)
     # axes are the r, phi and z if there were transformation to the cylindrical coordinates
+    # station is the number of the station of the segments or the array of the numbers of every segment
     ax_0_p = axes[0] + suffix_p
     ax_0_c = axes[0] + suffix_c
     ax_1_p = axes[1] + suffix_p
@@ -67,39 +150,26 @@ def get_supernodes_df(one_station_segments,
 
     # if we are in the cylindrical coordinates, we need to fix the radian angle values overflows
     if pi_fix:
-        dy_fixed = calc_dphi(one_station_segments[ax_1_p].values,
-                             one_station_segments[ax_1_c].values)
-        ret = ret.assign(dx=dx_dy_dz[:, 0], dy=dy_fixed,
-
-                         z_p=one_station_segments[ax_2_p].values,
-                         z_c=one_station_segments[ax_2_c].values,
-                         y_p=one_station_segments[ax_1_p].values,
-                         y_c=one_station_segments[ax_1_c].values,
-
-                         dz=dx_dy_dz[:, 2], z=(station + 1) / STATION_COUNT)
+        dy = calc_dphi(one_station_segments[ax_1_p].values,
+                       one_station_segments[ax_1_c].values)
     else:
-        ret = ret.assign(dx=dx_dy_dz[:, 0], dy=dx_dy_dz[:, 1],
-
-                         z_p=one_station_segments[ax_2_p].values,
-                         z_c=one_station_segments[ax_2_c].values,
-                         y_p=one_station_segments[ax_1_p].values,
-                         y_c=one_station_segments[ax_1_c].values,
-
-                         dz=dx_dy_dz[:, 2], z=(station + 1) / STATION_COUNT)
+        dy = dx_dy_dz[:, 1]
 
     # saving this information in the dataframe for later use and for visualization and evalutation purposes
-    ret = ret.assign(from_ind=one_station_segments[['index_old' + suffix_p]].values.astype(np.uint32))
-    ret = ret.assign(to_ind=one_station_segments[['index_old' + suffix_c]].values.astype(np.uint32))
-    ret = ret.assign(track=-1)
-    ret = ret.set_index(one_station_segments.index)
-
-    # saving this information in the dataframe for later use
-    index_true_superedge = one_station_segments[
-        (one_station_segments['track' + suffix_p] == one_station_segments['track' + suffix_c]) & \
-        (one_station_segments['track' + suffix_p] != -1)]
-    ret.loc[index_true_superedge.index, 'track'] = index_true_superedge['track' + suffix_p].values
-    ret = ret.assign(station=station)
-    return ret
+    track_p = one_station_segments['track' + suffix_p].values
+    track_c = one_station_segments['track' + suffix_c].values
+    return pd.DataFrame({'dx': dx_dy_dz[:, 0], 'dy': dy,
+                         'z_p': one_station_segments[ax_2_p].values,
+                         'z_c': one_station_segments[ax_2_c].values,
+                         'y_p': one_station_segments[ax_1_p].values,
+                         'y_c': one_station_segments[ax_1_c].values,
+                         'dz': dx_dy_dz[:, 2], 'z': (station + 1) / STATION_COUNT,
+                         'from_ind': one_station_segments['index_old' + suffix_p].values.astype(np.uint32),
+                         'to_ind': one_station_segments['index_old' + suffix_c].values.astype(np.uint32),
+                         # true segments keep the track
+                         'track': np.where((track_p == track_c) & (track_p != -1), track_p, -1),
+                         'station': station},
+                        index=one_station_segments.index)
 
 
 def apply_nodes_restrictions(nodes,
@@ -115,34 +185,33 @@ def get_pd_line_graph(segments,
                       restrictions_func,
                       restrictions_0, restrictions_1,
                       suffix_p, suffix_c, spec_kwargs):
-    nodes = pd.DataFrame()
-    edges = pd.DataFrame()
-
-    by_stations = [df for (ind, df) in segments.groupby('station' + suffix_p)]
-    # iterate each pair of stations
-    # for each 'i' we will have a 2 dataframes of segments which go
-    # from i-1'th to i'th stations and from i'th to i+1'th stations
-    for i in range(1, len(by_stations)):
-        # take segments (which will be nodes as a result) which go
-        # from station i-1 to i AND from i to i+1
-        supernodes_from = get_supernodes_df(by_stations[i - 1], **spec_kwargs, station=i - 1, STATION_COUNT=3, pi_fix=True)
-        supernodes_to = get_supernodes_df(by_stations[i], **spec_kwargs, station=i, STATION_COUNT=3, pi_fix=True)
-
-        if restrictions_func:
-            # if restriction function is defined, apply it to edges (supernodes)
-            supernodes_from = restrictions_func(supernodes_from, restrictions_0, restrictions_1)
-            supernodes_to = restrictions_func(supernodes_to, restrictions_0, restrictions_1)
-
-        nodes = nodes.append(supernodes_from, sort=False)
-        nodes = nodes.append(supernodes_to, sort=False)
-
-        # construct superedges (superedge is an edge which in fact
-        # represents 2 consecutive edges (and these edges have the one common hit being the ending of the 1-st edge and
-        # the beginning of the 2-nd edge), so it also captures information of the 3 consecutive hits)
-        superedges = get_edges_from_supernodes(supernodes_from, supernodes_to)
-        edges = edges.append(superedges, ignore_index=True, sort=False)
-
-    nodes = nodes.loc[~nodes.index.duplicated(keep='first')]
+    """Nodes (segments) of the line graph ordered by the station and the superedges between them.
+    Segments of all the stations are handled at once, so `restrictions_func` must filter the rows only."""
+    stations = segments['station' + suffix_p].values
+    present = ~pd.isna(stations)
+    # rows of the stations in their order, the order of the segments of each station is kept
+    rows = np.flatnonzero(present)[np.argsort(stations[present], kind='stable')]
+    station_ids, station_nums = np.unique(stations[rows], return_inverse=True)
+    if 'station_num' in segments:
+        # restricted segments keep the numbers of the stations of the full product
+        station_nums = segments['station_num'].values[rows]
+    if len(station_ids) < 2:
+        return pd.DataFrame(), pd.DataFrame()
+
+    # segments (which will be nodes as a result) which go from the i'th station to the next one
+    if len(rows) < len(segments) or np.any(rows[1:] < rows[:-1]):
+        segments = segments.iloc[rows]
+    nodes = get_supernodes_df(segments, **spec_kwargs, station=station_nums.astype(np.int64),
+                              STATION_COUNT=3, pi_fix=True)
+    if restrictions_func:
+        # if restriction function is defined, apply it to edges (supernodes)
+        nodes = restrictions_func(nodes, restrictions_0, restrictions_1)
+
+    # construct superedges (superedge is an edge which in fact
+    # represents 2 consecutive edges (and these edges have the one common hit being the ending of the 1-st edge and
+    # the beginning of the 2-nd edge), so it also captures information of the 3 consecutive hits).
+    # the common hit of the segments is on the next station, so they are always from the consecutive stations
+    edges = get_edges_from_supernodes(nodes, nodes)
     return nodes, edges
 
 
@@ -150,20 +219,65 @@ def to_pandas_graph_from_df(
         single_event_df: pd.DataFrame,
         suffixes=None,
         compute_is_true_track: bool = True,
-        save_index: bool = True
+        save_index: bool = True,
+        restrictions_0=None,
+        restrictions_1=None,
+        axes=None
 ) -> pd.DataFrame:
+    """Segments of the event: all the pairs of hits on the consecutive stations, as the merge of the stations
+    on the event. Rows are ordered by the station, by the first hit and then by the second one.
+
+    If the restrictions are given, only the pairs which pass `apply_nodes_restrictions` with them are made,
+    without the full product (see get_window_pairs). The rows keep their index of the full product
+    and `station_num`, the number of the pair of stations in it, as some pairs may be left without segments.
+    # Args:
+        restrictions_0, restrictions_1: windows of the difference of the second axis (with the wrap of the angle)
+            and of the third one, as for get_pd_line_graph
+        axes: coordinates of the hits, as for get_supernodes_df, ['r', 'phi', 'z'] by default
+    """
     if suffixes is None:
         suffixes = ['_prev', '_current']
     assert single_event_df.event.nunique() == 1
     my_df = single_event_df.copy()
     if save_index:
         my_df['index_old'] = my_df.index
-    by_stations = [df for (ind, df) in my_df.groupby('station')]
-    cartesian_product = pd.DataFrame()
-    for i in range(1, len(by_stations)):
-        cartesian_product = cartesian_product.append(
-            pd.merge(by_stations[i - 1], by_stations[i], on='event', suffixes=suffixes),
-            ignore_index=True, sort=False)
+
+    stations = my_df['station'].values
+    present = ~pd.isna(stations)
+    # rows of the stations in the order of the stations, the order of the hits of each station is kept
+    rows = np.flatnonzero(present)[np.argsort(stations[present], kind='stable')]
+    _, starts, counts = np.unique(stations[rows], return_index=True, return_counts=True)
+    first, second = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    restricted = restrictions_0 is not None and restrictions_1 is not None
+    if restricted:
+        axes = ['r', 'phi', 'z'] if axes is None else axes
+        phi, z = my_df[axes[1]].values, my_df[axes[2]].values
+        index, station_num, offset = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], 0
+    for i in range(1, len(starts)):
+        rows_p = rows[starts[i - 1]:starts[i - 1] + counts[i - 1]]
+        rows_c = rows[starts[i]:starts[i] + counts[i]]
+        if restricted:
+            pairs_p, pairs_c = get_window_pairs(phi[rows_p], z[rows_p], phi[rows_c], z[rows_c],
+                                                restrictions_0, restrictions_1)
+            first.append(rows_p[pairs_p])
+            second.append(rows_c[pairs_c])
+            index.append(offset + pairs_p * len(rows_c) + pairs_c)
+            station_num.append(np.full(len(pairs_p), i - 1, dtype=np.int64))
+            offset += len(rows_p) * len(rows_c)
+        else:
+            first.append(np.repeat(rows_p, len(rows_c)))
+            second.append(np.tile(rows_c, len(rows_p)))
+    first, second = np.concatenate(first), np.concatenate(second)
+
+    columns = {}
+    for col in my_df.columns:
+        columns[col if col == 'event' else col + suffixes[0]] = my_df[col].values[first]
+    for col in my_df.columns:
+        if col != 'event':
+            columns[col + suffixes[1]] = my_df[col].values[second]
+    if restricted:
+        columns['station_num'] = np.concatenate(station_num)
+    cartesian_product = pd.DataFrame(columns, index=np.concatenate(index) if restricted else None)
     if compute_is_true_track:
         pid1 = cartesian_product["track" + suffixes[0]].values
         pid2 = cartesian_product["track" + suffixes[1]].values
@@ -180,13 +294,14 @@ def construct_output_graph(hits,
                            feature_names,
                            feature_scale,
                            index_label_prev='edge_index_p',
-                           index_label_current='edge_index_c'):
+                           index_label_current='edge_index_c',
+                           sparse=False):
+    """Graph of the hits (nodes of the line graph) and the edges between them.
+    If `sparse`, returns the SparseGraph, the positions of the ones of Ri and Ro, without the dense matrices."""
     # Prepare the graph matrices
     n_hits = hits.shape[0]
     n_edges = edges.shape[0]
     X = (hits[feature_names].values / feature_scale).astype(np.float32)
-    Ri = np.zeros((n_hits, n_edges), dtype=np.float32)
-    Ro = np.zeros((n_hits, n_edges), dtype=np.float32)
     y = np.zeros(n_edges, dtype=np.float32)
 
     edges_indices_prev = edges[index_label_prev].astype(int)
@@ -198,13 +313,22 @@ def construct_output_graph(hits,
     hit_idx = pd.Series(np.arange(n_hits), index=hits.index)
     seg_start = hit_idx.loc[edges_indices_prev.values].values
     seg_end = hit_idx.loc[edges_indices_current].values
+    # Fill the segment labels
+    pid1 = hits.track.loc[edges_indices_prev].values
+    pid2 = hits.track.loc[edges_indices_current].values
+    y[:] = ((pid1 == pid2) & (pid1 != -1))
+    if sparse:
+        # every edge has one incoming and one outgoing hit, the positions are ordered
+        # by the hit and then by the edge, as by Ri.nonzero() in graph_to_sparse
+        Ri_cols = np.argsort(seg_end, kind='stable')
+        Ro_cols = np.argsort(seg_start, kind='stable')
+        return SparseGraph(X, seg_end[Ri_cols], Ri_cols, seg_start[Ro_cols], Ro_cols, y)
+
+    Ri = np.zeros((n_hits, n_edges), dtype=np.float32)
+    Ro = np.zeros((n_hits, n_edges), dtype=np.float32)
     # Now we can fill the association matrices.
     # Note that Ri maps hits onto their incoming edges,
     # which are actually segment endings.
     Ri[seg_end, np.arange(n_edges)] = 1
     Ro[seg_start, np.arange(n_edges)] = 1
-    # Fill the segment labels
-    pid1 = hits.track.loc[edges_indices_prev].values
-    pid2 = hits.track.loc[edges_indices_current].values
-    y[:] = ((pid1 == pid2) & (pid1 != -1))
     return Graph(X, Ri, Ro, y)
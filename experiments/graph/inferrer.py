@@ -41,10 +41,14 @@ class GraphPreprocessor(IPreprocessor):
             return None
 
         chunk_df = chunk_df[['event', 'r', 'phi', 'z', 'station', 'track']]
+        # only the segments which pass the restrictions of the nodes are made
         pd_graph_df = to_pandas_graph_from_df(
             single_event_df=chunk_df,
             suffixes=self._suffixes_df,
-            compute_is_true_track=True
+            compute_is_true_track=True,
+            restrictions_0=self.kwargs['get_pd_line_graph']['restrictions_0'],
+            restrictions_1=self.kwargs['get_pd_line_graph']['restrictions_1'],
+            axes=self.kwargs['get_supernodes_df']['axes']
         )
 
         nodes_t, edges_t = get_pd_line_graph(
@@ -62,6 +66,10 @@ class GraphPreprocessor(IPreprocessor):
         edges_filtered = apply_edge_restriction(edges_t, **self.kwargs['apply_edge_restriction'])
         return nodes_t, edges_filtered
 
+    def __repr__(self):
+        # part of the key of the resumable preprocessing runs, must not change between the runs
+        return f'{self.__class__.__name__} with suffixes: {self._suffixes_df}, kwargs: {self.kwargs}'
+
 
 class SaveGraphs(IPostprocessor):
 
@@ -73,6 +81,7 @@ class SaveGraphs(IPostprocessor):
             edges=out[1].as_df(),
             feature_names=['y_p', 'y_c', 'z_p', 'z_c', 'z'],
             feature_scale=[1., 1., 1., 1., 1.],
+            sparse=True
         )
         save_graph(ret, os.path.join(out_dir, idx))
         return True
@@ -87,7 +96,7 @@ class SaveGraphsHDF5(IPostprocessor):
             hits=out[0].as_df(),
             edges=out[1].as_df(),
             feature_names=['y_p', 'y_c', 'z_p', 'z_c', 'z'],
-            feature_scale=[1., 1., 1., 1., 1.],
+            feature_scale=[1., 1., 1., 1., 1.]
         )
 
         save_graph_hdf5(out_dir, ret, idx)
@@ -112,10 +121,18 @@ class GraphDataset(AriadneDataset):
     def connect(self, cacher: Cacher, dataset_path: str, drop_old: bool, mode: str = None):
         super().connect(cacher, dataset_path, drop_old, mode)
 
+    @staticmethod
+    def _event_keys(info_df: pd.DataFrame) -> pd.Series:
+        # names are '{part dataset}/data/{key}', the key does not depend on the part
+        return info_df['name'].str.rsplit('/', n=1).str[-1]
+
     def _submit_local_data(self):
         def update(df, cacher):
             df = df if df is not None else pd.DataFrame()
             new_df = pd.DataFrame.from_dict(self.infos)
+            if not df.empty:
+                # events of a part whose checkpoint was lost are processed again, their old rows are replaced
+                df = df[~self._event_keys(df).isin(self._event_keys(new_df))]
             return pd.concat([df, new_df], ignore_index=True)
 
         self.meta.update_df(self.INFO_DF_NAME, update)
@@ -151,6 +168,7 @@ class SaveGraphsToDataset(IPostprocessor):
             edges=out[1],
             feature_names=['y_p', 'y_c', 'z_p', 'z_c', 'z'],
             feature_scale=[1., 1., 1., 1., 1.],
+            sparse=True
         )
         # save_graph(ret, os.path.join(ds.temp_dir, idx))
         ds.add(idx, graph_to_sparse(ret))
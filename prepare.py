@@ -16,7 +16,10 @@ from absl import app
 from tqdm import tqdm
 from pytorch_lightning import seed_everything
 from ariadne.preprocessing import DataProcessor
-from ariadne.parsing import parse_df
+from ariadne.parsing import parse_df, parse_df_chunks
+from ariadne_v2.hit_format import HitFile, is_hit_file
+from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.prepare_manifest import PrepareManifest
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string(
@@ -71,7 +74,8 @@ def parse(input_file_mask,
           csv_params: Dict[str, object],
           events_quantity,
           filter_func=None,
-          input_file_list=None
+          input_file_list=None,
+          chunk_rows=None
           ):
     assert not (input_file_mask and input_file_list), 'specify only input_file_mask or input_file_list'
     if input_file_list:
@@ -88,7 +92,14 @@ def parse(input_file_mask,
     LOGGER.info(f"[Parse]: matched {len(files_list)} files:")
     for idx, elem in enumerate(files_list):
         LOGGER.info("[Parse]: started parsing CSV #%d (%s):" % (idx, elem))
-        parsed_df = parse_df(elem, **csv_params)
+        if is_hit_file(elem):
+            parsed_df = HitFile(elem).read(None if parse_all else event_idxs)
+        elif chunk_rows is not None:
+            # processors need the whole file, but only the selected events are kept while reading
+            chunks = list(parse_df_chunks(elem, chunk_rows, None if parse_all else event_idxs, **csv_params))
+            parsed_df = pd.concat(chunks) if chunks else pd.DataFrame(columns=csv_params.get('names'))
+        else:
+            parsed_df = parse_df(elem, **csv_params)
         if filter_func:
             parsed_df = filter_func(parsed_df)
         LOGGER.info("[Parse]: finished parsing CSV...")
@@ -109,6 +120,7 @@ def preprocess(
         output_dir: str,
         ignore_asserts: bool,
         random_seed=None,
+        resume: bool = True,
 ):
     os.makedirs(output_dir, exist_ok=True)
     setup_logger(output_dir, target_processor.__name__)
@@ -117,7 +129,15 @@ def preprocess(
     if random_seed is not None:
         LOGGER.info('Setting random seed to %d', random_seed)
         seed_everything(random_seed)
+    # chunks are postprocessed all together, so the progress is kept for the whole input files
+    manifest = PrepareManifest(os.path.join(output_dir, PrepareManifest.MANIFEST_FILE))
+    if not resume:
+        manifest.clear()
     for data_df, basename in parse():
+        run_key = Cacher.build_hash(basename, rows=len(data_df), config=gin.config_str())
+        if manifest.start(basename, run_key)['complete']:
+            LOGGER.info(f"[Preprocess]: '{basename}' is already processed, skipping")
+            continue
         LOGGER.info("[Preprocess]: started processing a df with %d rows:" % len(data_df))
         processor: DataProcessor = target_processor(data_df=data_df,
                                                     output_dir=output_dir)
@@ -125,6 +145,7 @@ def preprocess(
         generator = processor.generate_chunks_iterable()
 
         preprocessed_chunks = []
+        interrupted = False
         try:
             for (idx, df_chunk) in tqdm(generator):
                 try:
@@ -140,8 +161,11 @@ def preprocess(
                 )
         except KeyboardInterrupt as ex:
             LOGGER.warning("BREAKING by interrupt. got %d processed chunks" % len(preprocessed_chunks))
+            interrupted = True
         processed_data = processor.postprocess_chunks(preprocessed_chunks)
         processor.save_on_disk(processed_data)
+        if not interrupted:
+            manifest.mark_complete(basename)
 
 
 def main(argv):
@@ -3,6 +3,11 @@ import logging
 import multiprocessing
 import os
 import os.path
+import queue
+import re
+import signal
+import threading
+import time
 import traceback
 import _gin_bugfix
 
@@ -10,7 +15,10 @@ from ariadne_v2 import jit_cacher
 from ariadne_v2.dataset import AriadneDataset
 from ariadne_v2.inference import IPreprocessor, Transformer, IPostprocessor
 from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.data_chunk import SharedDFDataChunk
+from ariadne_v2.prepare_manifest import PrepareManifest
 from ariadne_v2.preprocessing import DFDataChunk
+from ariadne_v2.transform_profiler import PROFILER
 
 os.environ['FOR_DISABLE_CONSOLE_CTRL_HANDLER'] = '1'
 
@@ -53,23 +61,145 @@ def setup_logger(logger_dir, preprocessor_name):
 
     # add ch to logger
     logger.addHandler(fh)
+    return logger_dir
 
 
 LOGGER = logging.getLogger('ariadne.prepare')
 
 
+class EventScheduler:
+    """Hands out the events to the workers in small batches through the shared task queue,
+    so the workers which got the cheap events take more of them instead of waiting for the others.
+
+    The first batches have `initial_batch_size` events, next ones are sized from the measured
+    per-event cost to take about `target_batch_time` seconds. A batch never exceeds a half of the
+    remaining events per worker, so the tail of the work is split evenly.
+    Each batch is `(first_event, last_event, events_num)` with the events in [first_event, last_event).
+    """
+    def __init__(self,
+                 events,
+                 workers_num: int,
+                 task_queue: multiprocessing.Queue,
+                 initial_batch_size: int = 1,
+                 target_batch_time: float = 1.):
+        self.events = events
+        self.workers_num = workers_num
+        self.task_queue = task_queue
+        self.initial_batch_size = max(1, initial_batch_size)
+        self.target_batch_time = target_batch_time
+        self.position = 0
+        self.stopped = False
+        self.measured_events = 0
+        self.measured_time = 0.
+
+    @property
+    def event_cost(self):
+        return self.measured_time / self.measured_events if self.measured_events > 0 else None
+
+    def batch_size(self):
+        remaining = len(self.events) - self.position
+        if self.event_cost is None:
+            size = self.initial_batch_size
+        else:
+            size = int(self.target_batch_time / max(self.event_cost, 1e-6))
+        return max(1, min(size, -(-remaining // (2 * self.workers_num))))
+
+    def submit(self):
+        """Puts the next batch to the queue or stops the workers if there are no events left."""
+        if self.stopped:
+            return
+        if self.position >= len(self.events):
+            self.stop()
+            return
+        end = min(self.position + self.batch_size(), len(self.events))
+        last_event = self.events[end] if end < len(self.events) else 1e10
+        self.task_queue.put((self.events[self.position], last_event, end - self.position))
+        self.position = end
+
+    def on_batch_done(self, events_num: int, elapsed: float):
+        self.measured_events += events_num
+        self.measured_time += elapsed
+        self.submit()
+
+    def stop(self):
+        # one stop signal per worker, queued after the remaining batches
+        if not self.stopped:
+            self.stopped = True
+            for _ in range(self.workers_num):
+                self.task_queue.put(None)
+
+
+class DatasetWriter(threading.Thread):
+    """Passes the processed events of the worker to the postprocessor in the background thread,
+    so the processing of the next events overlaps with the writing of the previous ones.
+
+    Events are handed over in batches of `batch_size`; at most `max_pending` batches wait for the
+    write and `add` blocks when the writer falls behind, so a worker holds a few batches at most.
+    """
+    def __init__(self,
+                 main_dataset: AriadneDataset,
+                 cacher: Cacher,
+                 dataset_path: str,
+                 target_postprocessor: IPostprocessor,
+                 batch_size: int = 16,
+                 max_pending: int = 2):
+        super(DatasetWriter, self).__init__(daemon=True)
+        self.main_dataset = main_dataset
+        self.cacher = cacher
+        self.dataset_path = dataset_path
+        self.target_postprocessor = target_postprocessor
+        self.batch_size = max(1, batch_size)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.pending = []
+        self.dataset: AriadneDataset = None
+        self.error = None
+
+    def add(self, processed, idx):
+        self.pending.append((processed, idx))
+        if len(self.pending) >= self.batch_size:
+            self.queue.put(self.pending)
+            self.pending = []
+
+    def finish(self):
+        """Writes the rest of the events and waits for the writer."""
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = []
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        try:
+            with self.main_dataset.open_dataset(self.cacher, self.dataset_path) as dataset:
+                self.dataset = dataset
+                batch = self.queue.get()
+                while batch is not None:
+                    for (processed, idx) in batch:
+                        self.target_postprocessor(processed, dataset, idx)
+                    batch = self.queue.get()
+        except BaseException:
+            self.error = traceback.format_exc()
+            # nothing is written anymore, but the worker must not block on the full queue
+            while self.queue.get() is not None:
+                pass
+
+
 class EventProcessor(multiprocessing.Process):
     def __init__(self,
-                 df_hash,
+                 shared_data: SharedDFDataChunk,
                  basename,
                  target_processor,
                  target_postprocessor,
                  main_dataset,
-                 work_slice,
                  idx,
+                 dataset_prefix: str,
+                 write_batch_size: int,
+                 checkpoint_events: int,
+                 task_queue: multiprocessing.Queue,
                  result_queue: multiprocessing.Queue,
                  message_queue: multiprocessing.Queue,
                  global_lock: multiprocessing.Lock,
+                 profile: bool = False,
                  **kwargs):
         super(EventProcessor, self).__init__(**kwargs)
         self.idx = idx
@@ -77,81 +207,147 @@ class EventProcessor(multiprocessing.Process):
         self.target_processor = target_processor
         self.target_postprocessor = target_postprocessor
         self.main_dataset = main_dataset
-        self.df_hash = df_hash
-        self.work_slice = work_slice
+        self.shared_data = shared_data
+        self.dataset_prefix = dataset_prefix
+        self.write_batch_size = write_batch_size
+        self.checkpoint_events = checkpoint_events
+        self.task_queue = task_queue
         self.result_queue = result_queue
         self.message_queue = message_queue
         self.global_lock = global_lock
+        self.profile = profile
+        # ids of the events of the current part, these are completed when the part is submitted
+        self.part_events = []
+        self.interrupted = False
+
+    def on_interrupt(self, signum, frame):
+        # the worker stops between the batches, so the parts are never left half-written
+        self.interrupted = True
+
+    def part_path(self, part: int) -> str:
+        return f"{self.dataset_prefix}_p{self.idx}" + (f"_{part}" if part > 0 else "")
+
+    def start_part(self, cacher: Cacher, part: int) -> DatasetWriter:
+        # every part collects the local data of its own events only
+        writer = DatasetWriter(copy.deepcopy(self.main_dataset), cacher, self.part_path(part),
+                               self.target_postprocessor, batch_size=self.write_batch_size)
+        writer.start()
+        return writer
+
+    def submit_part(self, writer: DatasetWriter) -> bool:
+        try:
+            writer.finish()
+        except KeyboardInterrupt:
+            print(f"KeyboardInterrupt in process {os.getpid()}.")
+        if writer.error is not None:
+            print(f"Exception in process {os.getpid()} while writing! details below: {writer.error}")
+            self.result_queue.put([-2, writer.error])
+            return False
+        try:
+            print(f"Submitting data to the main storage for process {os.getpid()}...")
+            if writer.dataset is None:
+                return False
+
+            writer.dataset.dataset_name = self.main_dataset.dataset_name
+            writer.dataset.local_submit()
+        except KeyboardInterrupt:
+            print(f"KeyboardInterrupt while merging data in process {os.getpid()}. No result will be returned.")
+            return False
+
+        # checkpoint signal, the events of the part are completed
+        self.result_queue.put([-3, writer.dataset_path, PrepareManifest.to_ranges(self.part_events)])
+        self.part_events = []
+        return True
+
+    def process_batch(self, batch, writer: DatasetWriter) -> bool:
+        first_event, last_event, events_num = batch
+        started = time.time()
+        # zero-copy views of the events of this batch only
+        data_df = self.shared_data.attach(first_event, last_event).as_df()
+        for ev_id, event in data_df.groupby('event'):
+            try:
+                #chunk = DFDataChunk.from_df(event)
+                with PROFILER.measure(f'processor: {self.target_processor.__class__.__name__}', len(event)):
+                    processed = self.target_processor(event)
+                if processed is not None:
+                    idx = f"graph_{self.basename}_{ev_id}"
+                    writer.add(processed, idx)
+                self.part_events.append(int(ev_id))
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except:
+                stack = traceback.format_exc()
+                print(f"Exception in process {os.getpid()}! details below: {stack}")
+                self.result_queue.put([-2, stack])
+                return False
+        # progress signal, the scheduler sizes the next batches by it
+        self.result_queue.put([-1, events_num, time.time() - started])
+        return True
 
     def run(self):
+        signal.signal(signal.SIGINT, self.on_interrupt)
+        signal.signal(signal.SIGTERM, self.on_interrupt)
+        # the forked worker has a copy of the stats of the main process
+        PROFILER.reset()
+        if self.profile:
+            PROFILER.enable()
         try:
             jit_cacher.init_locks(self.global_lock)
 
             with jit_cacher.instance() as cacher:
                 cacher.init()
-            data_df = cacher.read_df(self.df_hash)
-            if data_df.empty:
-                self.result_queue.put([self.idx, ''])
-                return
-
-            old_path = self.main_dataset.dataset_name
-            new_path = old_path + f"_{self.basename}_p{self.idx}"
         except KeyboardInterrupt:
             print(f"KeyboardInterrupt in process {os.getpid()}. No result will be returned.")
             self.result_queue.put([self.idx, ''])
             jit_cacher.fini_locks()
             return
 
-        current_work = []
+        part = 0
+        writer = self.start_part(cacher, part)
         try:
-            data_df = data_df[(data_df.event >= self.work_slice[0]) & (data_df.event < self.work_slice[1])]
-            for ev_id, event in data_df.groupby('event'):
-                try:
-                    #chunk = DFDataChunk.from_df(event)
-                    processed = self.target_processor(event)
-                    if processed is None:
-                        continue
-                    idx = f"graph_{self.basename}_{ev_id}"
-                    current_work.append((processed, idx))
-                    #postprocessed = self.target_postprocessor(processed, process_dataset, idx)
-                    if ev_id % 10 == 0:
-                        self.result_queue.put([-1])
-                except KeyboardInterrupt:
-                    raise KeyboardInterrupt
-                except:
-                    stack = traceback.format_exc()
-                    print(f"Exception in process {os.getpid()}! details below: {stack}")
-                    self.result_queue.put([-2, stack])
-                    break
-                if not self.message_queue.empty:
+            while self.message_queue.empty() and not self.interrupted and writer.error is None:
+                batch = self.task_queue.get()
+                if batch is None or not self.process_batch(batch, writer):
                     break
+                if self.checkpoint_events is not None and len(self.part_events) >= self.checkpoint_events:
+                    if not self.submit_part(writer):
+                        writer = None
+                        break
+                    part += 1
+                    writer = self.start_part(cacher, part)
         except KeyboardInterrupt:
             print(f"KeyboardInterrupt in process {os.getpid()}.")
-        try:
-            process_dataset: AriadneDataset = None
-            with self.main_dataset.open_dataset(cacher, new_path) as process_dataset:
-                for (processed, idx) in current_work:
-                    self.target_postprocessor(processed, process_dataset, idx)
-        except KeyboardInterrupt:
-            print(f"KeyboardInterrupt in process {os.getpid()}.")
-        try:
-            print(f"Submitting data to the main storage for process {os.getpid()}...")
-            if process_dataset is None:
-                self.result_queue.put([self.idx, ''])
-                return
+        self.shared_data.close()
 
-            process_dataset.dataset_name = old_path
-            process_dataset.local_submit()
-        except KeyboardInterrupt:
-            print(f"KeyboardInterrupt while merging data in process {os.getpid()}. No result will be returned.")
-            new_path = ''
+        submitted = writer is not None and self.submit_part(writer)
+
+        # profile signal, stats are summed up in the main process
+        if self.profile:
+            self.result_queue.put([-4, PROFILER.stats])
 
         # finish signal
-        self.result_queue.put([self.idx, new_path])
+        self.result_queue.put([self.idx, self.part_path(part) if submitted else ''])
 
         jit_cacher.fini_locks()
 
 
+# parameters of preprocess_mp which do not change the output, so a run with the other ones is resumed
+RUN_ONLY_PARAMS = ['process_num', 'chunk_size', 'target_batch_time', 'write_batch_size',
+                   'checkpoint_events', 'resume', 'profile']
+
+
+def build_config_key(config_str: str) -> str:
+    """Key of the gin config of the run without the RUN_ONLY_PARAMS."""
+    run_only = re.compile(r"\s*preprocess_mp\.(%s)\s*=" % '|'.join(RUN_ONLY_PARAMS))
+    return Cacher.build_hash(config='\n'.join(line for line in config_str.splitlines() if not run_only.match(line)))
+
+
+def build_run_key(source_hash: str, config_key: str) -> str:
+    """Key of the processing of the input file: its data and the config of the transforms,
+    of the processor and of the postprocessor."""
+    return Cacher.build_hash(source_hash, config=config_key)
+
+
 @gin.configurable
 def preprocess_mp(
         transformer: Transformer,
@@ -159,10 +355,24 @@ def preprocess_mp(
         target_postprocessor: IPostprocessor,
         target_dataset: AriadneDataset,
         process_num: int = None,
-        chunk_size: int = 1
+        chunk_size: int = 1,
+        target_batch_time: float = 1.,
+        write_batch_size: int = 16,
+        checkpoint_events: int = None,
+        resume: bool = True,
+        profile: bool = False
 ):
+    """
+    # Args:
+        profile (boolean, False by default): If True, time, rows and memory of every transform and of the
+                    processor are measured (see `TransformProfiler`) in all the processes. The summary is logged
+                    and written to `profile_%processor%.txt` and `.json` next to the prepare log
+    """
     os.makedirs(f"output/{target_dataset.dataset_name}", exist_ok=True)
-    setup_logger(f"output/{target_dataset.dataset_name}", target_processor.__class__.__name__)
+    logger_dir = setup_logger(f"output/{target_dataset.dataset_name}", target_processor.__class__.__name__)
+    PROFILER.reset()
+    if profile:
+        PROFILER.enable()
 
     global_lock = multiprocessing.Lock()
     jit_cacher.init_locks(global_lock)
@@ -170,7 +380,21 @@ def preprocess_mp(
     with jit_cacher.instance() as cacher:
         cacher.init()
 
-    with target_dataset.open_dataset(cacher) as ds:
+    manifest = PrepareManifest(os.path.join(cacher.cache_path_dir, target_dataset.dataset_name,
+                                            PrepareManifest.MANIFEST_FILE))
+    config_key = build_config_key(gin.config_str())
+    if not resume:
+        manifest.clear()
+    elif not manifest.matches_config(config_key):
+        # outputs of the different configs are never mixed in one dataset
+        LOGGER.warning(f"'{target_dataset.dataset_name}' was processed with another config, starting it over")
+        manifest.clear()
+    # the dataset of the resumed run keeps the merged results of the previous runs
+    resumed = len(manifest) > 0
+    if resumed:
+        LOGGER.info(f"Resuming the previous run of '{target_dataset.dataset_name}' from {manifest.manifest_path}")
+
+    with target_dataset.open_dataset(cacher, drop_old=not resumed) as ds:
         target_dataset = ds
 
     target_dataset.meta["cfg"] = gin.config_str()
@@ -185,30 +409,45 @@ def preprocess_mp(
     for data_df, basename, df_hash in parse():
         LOGGER.info("[Preprocess]: started processing a df with %d rows:" % len(data_df))
 
-        data_df, hash = transformer(DFDataChunk.from_df(data_df, df_hash), return_hash=True)
+        data_df = transformer(DFDataChunk.from_df(data_df, df_hash))
+        progress = manifest.start(basename, build_run_key(df_hash, config_key), config_key)
+        if progress['complete']:
+            LOGGER.info(f"[Preprocess]: '{basename}' is already processed, skipping")
+            continue
+        completed = manifest.completed_mask(basename, data_df.event.values)
+        if completed.any():
+            LOGGER.info(f"[Preprocess]: skipping {data_df.event[completed].nunique()} already processed events")
+            data_df = data_df[~completed]
         event_count = data_df.event.nunique()
         events = sorted(list(data_df.event.unique()))
-        chunk_size = event_count // process_num
-        if event_count // process_num == 0:
-            process_num = 1
-            chunk_size = 1
+        # the frame is handed to the workers once, each of them maps only the rows of its events
+        shared_data = SharedDFDataChunk.publish(DFDataChunk.from_df(data_df))
+        del data_df
+        workers_num = max(1, min(process_num, event_count))
 
+        task_queue = multiprocessing.Queue()
         result_queue = multiprocessing.Queue()
         message_queue = multiprocessing.Queue()
-        workers = []
-        workers_result = [""] * process_num
-        for i in range(0, process_num):
+        scheduler = EventScheduler(events, workers_num, task_queue,
+                                   initial_batch_size=chunk_size,
+                                   target_batch_time=target_batch_time)
+        # two batches per worker are queued, so a worker never waits for the next one
+        for _ in range(2 * workers_num):
+            scheduler.submit()
 
-            if i == process_num - 1:
-                work_slice = (events[i * chunk_size], 1e10)
-            else:
-                work_slice = (events[i * chunk_size], events[(i + 1) * chunk_size])
+        # datasets of the previous attempts are kept, so every attempt writes to the new ones
+        dataset_prefix = f"{target_dataset.dataset_name}_{basename}" + \
+                         (f"_a{progress['attempt']}" if progress['attempt'] > 0 else "")
 
-            workers.append(EventProcessor(hash,
+        workers = []
+        workers_result = [""] * workers_num
+        for i in range(0, workers_num):
+            workers.append(EventProcessor(shared_data,
                                           basename,
                                           target_processor,
                                           target_postprocessor,
-                                          target_dataset, work_slice, i, result_queue, message_queue, global_lock))
+                                          target_dataset, i, dataset_prefix, write_batch_size, checkpoint_events,
+                                          task_queue, result_queue, message_queue, global_lock, profile))
             workers[-1].start()
         canceled = False
         try:
@@ -216,12 +455,20 @@ def preprocess_mp(
                 while any(workers):
                     obj = result_queue.get()
                     if obj[0] == -1:
-                        pbar.update(n=10)
+                        pbar.update(n=obj[1])
+                        scheduler.on_batch_done(obj[1], obj[2])
+                    elif obj[0] == -3:
+                        manifest.add_part(basename, obj[1], obj[2])
+                    elif obj[0] == -4:
+                        PROFILER.merge(obj[1])
                     elif obj[0] == -2:
-                        LOGGER.info(f"Process got exception: {obj[1]}.")
-                        return
+                        # the other workers stop after their batches, the finished parts are merged below
+                        LOGGER.info(f"Process got exception: {obj[1]}. Stopping the other processes....")
+                        if not canceled:
+                            message_queue.put(1)
+                            scheduler.stop()
+                        canceled = True
                     else:
-                        pbar.update()
                         LOGGER.debug(f"Process idx={obj} has finished processing. joining...")
                         workers[obj[0]].join()
                         workers[obj[0]].close()
@@ -230,6 +477,7 @@ def preprocess_mp(
         except KeyboardInterrupt:
             LOGGER.info("KeyboardInterrupt! terminating all processes....")
             message_queue.put(1)
+            scheduler.stop()
             try:
                 [worker.join() for worker in workers if worker]
             except KeyboardInterrupt:
@@ -244,17 +492,30 @@ def preprocess_mp(
             except EOFError:
                 LOGGER.info("Weird EOFError...")
                 break
-            if obj[0] >= 0:
+            if obj[0] == -3:
+                manifest.add_part(basename, obj[1], obj[2])
+            elif obj[0] == -4:
+                PROFILER.merge(obj[1])
+            elif obj[0] >= 0:
                 workers_result[obj[0]] = obj[1]
+        shared_data.unlink()
 
         for worker_id, worker_result in enumerate(workers_result):
             if worker_result == "":
                 LOGGER.info(f"Worker {worker_id} failed...")
 
-        workers_result = [worker_result for worker_result in workers_result if worker_result != '']
-
+        # parts of this and of the previous runs which are not merged yet
+        parts = manifest.unmerged_parts(basename)
         with target_dataset.open_dataset(cacher, target_dataset.dataset_name, drop_old=False) as ds:
-            ds.global_submit(workers_result)
+            ds.global_submit(parts)
+        manifest.mark_merged(basename, parts)
+        if not canceled and all(worker_result != '' for worker_result in workers_result):
+            manifest.mark_complete(basename)
+
+        with jit_cacher.instance() as cacher:
+            cacher.log_stats()
+        if profile:
+            PROFILER.dump(logger_dir, f"profile_{target_processor.__class__.__name__}")
 
         if canceled:
             break
@@ -266,6 +527,8 @@ def main(argv):
         raise SystemError("Expected valid path to the GIN-config file supplied as '--config %PATH%' parameter")
     gin.parse_config(open(FLAGS.config))
     LOGGER.setLevel(FLAGS.log)
+    # preempted jobs get SIGTERM: stop like on the Ctrl+C, so the finished parts are merged and resumed later
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     preprocess_mp()
     LOGGER.info("end processing")
 
@@ -46,13 +46,14 @@ def clean_jit_cache(str_to_clean):
         if val > clear_from.timestamp():
             removed.append(idx)
     if confirm():
-        with cacher.handle(cacher.cache_db_path, mode='a') as f:
-            for ind in removed:
-                row = df.iloc[ind]
-                path = row.key
-                if path in f:
-                    print(f"deleting path {path}")
-                    del f[path]
+        hashes = []
+        for ind in removed:
+            row = df.iloc[ind]
+            if row.data_path == cacher.cache_db_path:
+                print(f"deleting path {row.key}")
+                hashes.append(row.hash)
+        with jit_cacher.instance() as cacher:
+            cacher.evict(hashes)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+import argparse
+import glob
+import os
+import sys
+
+sys.path.append(os.path.abspath('./'))
+from ariadne_v2.hit_format import convert_csv, convert_root_tsv
+
+argparser = argparse.ArgumentParser(description='Converts the csv hit files to the binary hit files (*.hits)')
+argparser.add_argument('input_mask', type=str, help='glob mask of the files to convert')
+argparser.add_argument('--root-tsv', action='store_true', help='files are written by root_utils/main.py')
+argparser.add_argument('--sep', type=str, default=r'\s+', help='separator of the csv columns')
+argparser.add_argument('--names', type=str, default=None,
+                       help='comma-separated column names, if the csv has no header')
+argparser.add_argument('--chunk-rows', type=int, default=1000000, help='number of rows read at once')
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    files = glob.glob(args.input_mask)
+    assert len(files) > 0, f"no files found matching mask {args.input_mask}"
+    for path in files:
+        if args.root_tsv:
+            hits = convert_root_tsv(path, chunk_rows=args.chunk_rows)
+        else:
+            csv_params = {'sep': args.sep, 'encoding': 'utf-8'}
+            if args.names is not None:
+                csv_params['names'] = args.names.split(',')
+            hits = convert_csv(path, chunk_rows=args.chunk_rows, **csv_params)
+        print(f'{path} -> {hits.path}: {len(hits)} events, {hits.rows} hits')
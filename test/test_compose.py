@@ -0,0 +1,117 @@
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+
+import pandas as pd
+
+from ariadne_v2 import jit_cacher
+from ariadne_v2.data_chunk import DFDataChunk
+from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.transformations import (
+    Compose,
+    ConstraintsNormalize,
+    DropEmpty,
+    DropFakes,
+    DropShort,
+    DropSpinningTracks,
+    MinMaxScale,
+    ToCylindrical
+)
+
+CSV_PATH = 'resources/test_data/cgem_50_events.txt'
+CSV_PARAMS = {
+    "sep": r'\s+',
+    "encoding": 'utf-8',
+    "names": ['event', 'x', 'y', 'z', 'station', 'track']
+}
+CONSTRAINTS = {'r': (0., 1e3), 'phi': (-4., 4.), 'z': (-1e3, 1e3)}
+
+
+def make_chains():
+    return [
+        [DropSpinningTracks(), DropShort(), DropEmpty(), ToCylindrical(drop_old=True),
+         ConstraintsNormalize(columns=('r', 'phi', 'z'), constraints=CONSTRAINTS)],
+        [DropShort(keep_filtered=False), MinMaxScale(drop_old=False), ToCylindrical(), DropFakes()],
+        [ToCylindrical(drop_old=True), ConstraintsNormalize(columns=('r', 'phi', 'z'), use_global_constraints=False),
+         DropShort(num_stations=3), DropEmpty(), MinMaxScale(columns=('r', 'phi', 'z'))],
+    ]
+
+
+class ComposeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+
+    def test_plan(self):
+        chain = make_chains()[0]
+        compose = Compose(chain)
+        self.assertEqual(compose.plan(), [(True, chain)])
+
+    def test_fused_is_sequential(self):
+        for sequential, fused in zip(make_chains(), make_chains()):
+            expected = self.df.copy()
+            for transform in sequential:
+                expected = transform(expected)
+            result, last = Compose(fused).apply(self.df.copy())
+            self.assertIs(last, fused[-1])
+            pd.testing.assert_frame_equal(result, expected, check_exact=True)
+            for transform_seq, transform_fused in zip(sequential, fused):
+                self.assertEqual(repr(transform_fused), repr(transform_seq))
+
+
+class CountingDropShort(DropShort):
+    calls = 0
+
+    def good_hits(self, data, tracks):
+        CountingDropShort.calls += 1
+        return super().good_hits(data, tracks)
+
+
+class StageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+        self.cache_dir = tempfile.mkdtemp()
+        self.cacher = Cacher(cache_path=self.cache_dir)
+        self.cacher.init()
+        CountingDropShort.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def run_chain(self, transforms, **kwargs):
+        with mock.patch.object(jit_cacher, 'instance', partial(jit_cacher.instance, self.cacher)):
+            return Compose(transforms, **kwargs)(DFDataChunk.from_df(self.df.copy(), 'cgem_50_events'),
+                                                 return_hash=True)
+
+    def test_cache_points(self):
+        compose = Compose([DropShort(), ToCylindrical(), DropEmpty(), MinMaxScale()])
+        self.assertEqual(compose.cache_points(), [1, 3, 4])
+        compose = Compose([DropShort(), ToCylindrical(), DropEmpty(), MinMaxScale()], cache_stages=False)
+        self.assertEqual(compose.cache_points(), [4])
+
+    def test_resume_from_prefix(self):
+        self.run_chain([CountingDropShort(), DropEmpty(), DropFakes()])
+        self.assertEqual(CountingDropShort.calls, 1)
+
+        def make_tail():
+            return [ToCylindrical(drop_old=True),
+                    ConstraintsNormalize(columns=('r', 'phi', 'z'), constraints=CONSTRAINTS)]
+        chain_hash = Compose([CountingDropShort(), DropEmpty()] + make_tail()).prefix_hash(4, True, 'cgem_50_events')
+        result, hash = self.run_chain([CountingDropShort(), DropEmpty()] + make_tail())
+        self.assertEqual(CountingDropShort.calls, 1)
+
+        expected = self.df.copy()
+        expected['index'] = expected.index
+        for transform in [DropShort(), DropEmpty()] + make_tail():
+            expected = transform(expected)
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+        self.assertEqual(hash, chain_hash)
+
+        # the intermediate outputs are neither read nor stored
+        self.run_chain([CountingDropShort(), DropEmpty(), DropSpinningTracks()], cache_stages=False)
+        self.assertEqual(CountingDropShort.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from experiments.graph.graph_utils.graph import (
+    Graph,
+    SparseGraph,
+    graph_to_sparse,
+    load_graph,
+    read_graph_hdf5_custom,
+    save_graph,
+    save_graph_hdf5_custom
+)
+from experiments.graph.graph_utils.graph_prepare_utils import (
+    apply_nodes_restrictions,
+    construct_output_graph,
+    csr_join,
+    get_pd_line_graph,
+    get_supernodes_df,
+    to_pandas_graph_from_df
+)
+
+CSV_PATH = 'resources/test_data/cgem_50_events.txt'
+CSV_PARAMS = {
+    "sep": r'\s+',
+    "encoding": 'utf-8',
+    "names": ['event', 'x', 'y', 'z', 'station', 'track', 'px', 'py', 'pz', 'X0', 'Y0', 'Z0']
+}
+
+
+class LineGraphTestCase(unittest.TestCase):
+    def test_csr_join_is_merge(self):
+        rng = np.random.default_rng(0)
+        left = pd.DataFrame({'key': rng.integers(0, 20, 300).astype(np.uint32), 'i': np.arange(300)})
+        right = pd.DataFrame({'key': rng.integers(0, 20, 200).astype(np.uint32), 'j': np.arange(200)})
+        merged = pd.merge(left, right, on='key')
+        left_rows, counts, right_rows = csr_join(left.key.values, right.key.values)
+        # the row order of merge differs between the pandas versions, so the pairs are compared as sets
+        pairs = np.stack([np.repeat(left_rows, counts), right_rows], axis=1)
+        expected = merged[['i', 'j']].values
+        np.testing.assert_array_equal(pairs[np.lexsort(pairs.T[::-1])], expected[np.lexsort(expected.T[::-1])])
+
+    def test_line_graph(self):
+        df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+        df = df.assign(r=np.sqrt(df.x ** 2 + df.y ** 2), phi=np.arctan2(df.x, df.y))
+        event = df[df.event == df.event.iloc[0]][['event', 'r', 'phi', 'z', 'station', 'track']]
+        segments = to_pandas_graph_from_df(event, suffixes=('_p', '_c'))
+        sizes = event.groupby('station').size().values
+        self.assertEqual(len(segments), (sizes[:-1] * sizes[1:]).sum())
+
+        nodes, edges = get_pd_line_graph(segments, apply_nodes_restrictions,
+                                         restrictions_0=(-0.5, 0.5), restrictions_1=(-100., 100.),
+                                         suffix_p='_p', suffix_c='_c',
+                                         spec_kwargs={'suffix_p': '_p', 'suffix_c': '_c', 'axes': ['r', 'phi', 'z']})
+        self.assertFalse(edges.empty)
+        # every superedge joins the consecutive segments by the common hit
+        prev, cur = nodes.loc[edges.edge_index_p], nodes.loc[edges.edge_index_c]
+        np.testing.assert_array_equal(prev.to_ind.values, cur.from_ind.values)
+        np.testing.assert_array_equal(prev.station.values + 1, cur.station.values)
+        true_edges = (prev.track.values == cur.track.values) & (prev.track.values != -1)
+        np.testing.assert_array_equal(edges.true_superedge.values, np.where(true_edges, prev.track.values, -1))
+        expected = np.linalg.norm(prev[['dx', 'dy', 'dz']].values - cur[['dx', 'dy', 'dz']].values, axis=1)
+        np.testing.assert_array_equal(edges.weight.values, expected)
+        # all the pairs of the kept segments with the common hit are the superedges
+        pairs = pd.merge(nodes.reset_index(), nodes.reset_index(), left_on='to_ind', right_on='from_ind')
+        self.assertEqual(len(pairs), len(edges))
+
+    def test_pruned_segments(self):
+        rng = np.random.default_rng(1)
+        event = pd.DataFrame({'event': 0, 'r': rng.random(400), 'phi': rng.uniform(-np.pi, np.pi, 400),
+                              'z': rng.normal(0., 1., 400), 'station': rng.integers(0, 4, 400),
+                              'track': rng.integers(-1, 50, 400)})
+        spec_kwargs = {'suffix_p': '_p', 'suffix_c': '_c', 'axes': ['r', 'phi', 'z']}
+        # the windows of phi near the wrap, wider than the whole circle and without the limit
+        for restrictions_0, restrictions_1 in [((-0.3, 0.3), (-0.5, 0.5)), ((2.9, 3.3), (-0.5, 0.5)),
+                                               ((-7., 7.), (-0.2, 0.1)), ((-0.2, 0.2), (-np.inf, np.inf))]:
+            segments = to_pandas_graph_from_df(event, suffixes=('_p', '_c'))
+            nodes = apply_nodes_restrictions(get_supernodes_df(segments, **spec_kwargs, STATION_COUNT=3, pi_fix=True),
+                                             restrictions_0, restrictions_1)
+            pruned = to_pandas_graph_from_df(event, suffixes=('_p', '_c'), restrictions_0=restrictions_0,
+                                             restrictions_1=restrictions_1, axes=spec_kwargs['axes'])
+            pd.testing.assert_frame_equal(pruned.drop(columns='station_num'), segments.loc[nodes.index],
+                                          check_exact=True, check_index_type=False)
+
+            expected = get_pd_line_graph(segments, apply_nodes_restrictions, restrictions_0, restrictions_1,
+                                         '_p', '_c', spec_kwargs)
+            result = get_pd_line_graph(pruned, apply_nodes_restrictions, restrictions_0, restrictions_1,
+                                       '_p', '_c', spec_kwargs)
+            for frame, expected_frame in zip(result, expected):
+                pd.testing.assert_frame_equal(frame, expected_frame, check_exact=True)
+
+    def test_sparse_output_graph(self):
+        df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+        df = df.assign(r=np.sqrt(df.x ** 2 + df.y ** 2), phi=np.arctan2(df.x, df.y))
+        event = df[df.event == df.event.iloc[0]][['event', 'r', 'phi', 'z', 'station', 'track']]
+        nodes, edges = get_pd_line_graph(to_pandas_graph_from_df(event, suffixes=('_p', '_c')),
+                                         apply_nodes_restrictions, (-0.5, 0.5), (-100., 100.), '_p', '_c',
+                                         {'suffix_p': '_p', 'suffix_c': '_c', 'axes': ['r', 'phi', 'z']})
+        kwargs = dict(hits=nodes, edges=edges, feature_names=['y_p', 'y_c', 'z_p', 'z_c', 'z'],
+                      feature_scale=[1., 1., 1., 1., 1.])
+        sparse = construct_output_graph(**kwargs, sparse=True)
+        self.assertIsInstance(sparse, SparseGraph)
+        expected = graph_to_sparse(construct_output_graph(**kwargs))
+        for name, value in graph_to_sparse(sparse).items():
+            np.testing.assert_array_equal(value, expected[name])
+            self.assertEqual(value.dtype, expected[name].dtype)
+
+        dense = construct_output_graph(**kwargs)
+        out_dir = tempfile.mkdtemp()
+        try:
+            save_graph(sparse, os.path.join(out_dir, 'graph'))
+            loaded = load_graph(os.path.join(out_dir, 'graph.npz'), sparse=True)
+            # hdf5 readers get the dense Graph from either layout by default
+            with h5py.File(os.path.join(out_dir, 'graphs.h5'), 'w') as db:
+                save_graph_hdf5_custom(db, 'sparse', sparse)
+                save_graph_hdf5_custom(db, 'dense', dense)
+                from_hdf5 = [read_graph_hdf5_custom(db, 'sparse', None),
+                             read_graph_hdf5_custom(db, 'dense', None)]
+                self.assertIsInstance(read_graph_hdf5_custom(db, 'sparse', None, sparse=True), SparseGraph)
+        finally:
+            shutil.rmtree(out_dir)
+        for value, expected_value in zip(loaded, sparse):
+            np.testing.assert_array_equal(value, expected_value)
+        for graph in from_hdf5:
+            self.assertIsInstance(graph, Graph)
+            for value, expected_value in zip(graph, dense):
+                np.testing.assert_array_equal(value, expected_value)
+
+
+if __name__ == '__main__':
+    unittest.main()
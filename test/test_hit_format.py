@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from ariadne_v2.event_filter import EventFilter
+from ariadne_v2.hit_format import HitFile, convert_csv, is_hit_file
+
+CSV_PATH = 'resources/test_data/cgem_50_events.txt'
+CSV_PARAMS = {
+    "sep": r'\s+',
+    "encoding": 'utf-8',
+    "names": ['event', 'x', 'y', 'z', 'station', 'track']
+}
+
+
+class HitFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.hits_dir = tempfile.mkdtemp()
+        self.hits_path = os.path.join(self.hits_dir, 'cgem_50_events' + HitFile.SUFFIX)
+        self.df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+
+    def tearDown(self):
+        shutil.rmtree(self.hits_dir, ignore_errors=True)
+
+    def test_convert_csv(self):
+        hits = convert_csv(CSV_PATH, self.hits_path, chunk_rows=500, **CSV_PARAMS)
+        self.assertTrue(is_hit_file(self.hits_path))
+        self.assertEqual(len(hits), self.df.event.nunique())
+        self.assertTrue(self.df.equals(hits.read()))
+        self.assertEqual(list(self.df.dtypes), list(hits.read().dtypes))
+
+    def test_event_access(self):
+        hits = convert_csv(CSV_PATH, self.hits_path, **CSV_PARAMS)
+        self.assertTrue(self.df[self.df.event == 7].equals(hits.event(7)))
+        self.assertTrue(self.df[self.df.event.isin([3, 9, 40])].equals(hits.read([40, 3, 9])))
+
+        chunks = list(hits.read_chunks(500))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(self.df.equals(pd.concat(chunks)))
+
+    def test_event_filter(self):
+        hits = convert_csv(CSV_PATH, self.hits_path, **CSV_PARAMS)
+        event_filter = EventFilter(events=[[5, 30]], predicates=[('station', 'in', [2]), ('track', '>=', 0)])
+        df = self.df
+        expected = df[df.event.between(5, 30) & (df.station == 2) & (df.track >= 0)]
+        self.assertTrue(expected.equals(hits.read(row_filter=event_filter)))
+        self.assertTrue(expected[expected.event.isin([7, 40])].equals(hits.read([7, 40], event_filter)))
+        self.assertTrue(expected.equals(pd.concat(hits.read_chunks(100, row_filter=event_filter))))
+
+
+if __name__ == '__main__':
+    unittest.main()
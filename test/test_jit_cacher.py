@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ariadne_v2.data_chunk import DFDataChunk
+from ariadne_v2.jit_cacher import Cacher
+
+
+class CacherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.df = pd.DataFrame({'event': np.arange(10),
+                                'x': np.linspace(0., 1., 10),
+                                'station': np.arange(10) % 3})
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _init_cacher(self, **kwargs):
+        cacher = Cacher(cache_path=self.cache_dir, **kwargs)
+        cacher.init()
+        return cacher
+
+    def test_store_read_df(self):
+        cacher = self._init_cacher()
+        cacher.store_df('hash_df', self.df)
+        self.assertTrue(self.df.equals(cacher.read_df('hash_df')))
+        self.assertEqual(cacher.catalog.get('hash_df')['key'], Cacher.DF_KEY('hash_df'))
+
+    def test_datachunk_native_dtypes(self):
+        df = self.df.assign(track=np.arange(10, dtype=np.int32), det=['gem'] * 10)
+        dc = DFDataChunk.from_df(df)
+        self.assertEqual(dc.dtypes, [dt.str for dt in df.dtypes])
+        self.assertTrue(np.shares_memory(dc.as_df()['x'].values, dc.np_columns['x']))
+
+        cacher = self._init_cacher()
+        cacher.store_datachunk('hash_dc', dc)
+        restored = cacher.read_datachunk('hash_dc').as_df()
+        self.assertTrue(df.equals(restored))
+        self.assertEqual(list(restored.dtypes), list(df.dtypes))
+
+    def test_mixed_codecs(self):
+        cacher = self._init_cacher(codec='none')
+        cacher.store_df('hash_raw', self.df)
+        cacher.configure(codec='gzip')
+        cacher.store_df('hash_gzip', self.df)
+
+        raw_dc = cacher.read_datachunk('hash_raw')
+        self.assertIsInstance(raw_dc.np_columns['x'], np.memmap)
+        self.assertTrue(self.df.equals(raw_dc.as_df()))
+        self.assertTrue(self.df.equals(cacher.read_df('hash_gzip')))
+
+    def test_configure_keeps_other_settings(self):
+        cacher = self._init_cacher(max_cache_size=10 ** 6, eviction_policy='lfu', memory_cache_size=10 ** 5)
+        cacher.configure(codec='none')
+        self.assertEqual((cacher.max_cache_size, cacher.eviction_policy), (10 ** 6, 'lfu'))
+        self.assertEqual(cacher.memory_tier.max_size, 10 ** 5)
+        cacher.configure(max_cache_size=None)
+        self.assertIsNone(cacher.max_cache_size)
+        self.assertEqual(cacher.eviction_policy, 'lfu')
+
+    def test_mapped_entry_survives_overwrite(self):
+        df = pd.DataFrame({'x': np.arange(1000.)})
+        cacher = self._init_cacher(codec='none', memory_cache_size=10 ** 6)
+        cacher.store_df('hash_df', df)
+        cacher.read_datachunk('hash_df')
+        mapped = cacher.memory_tier.get('hash_df')
+        self.assertIsInstance(mapped.np_columns['x'], np.memmap)
+        # the space of the replaced entry is not reused under the maps
+        cacher.store_df('hash_df', df + 1)
+        self.assertTrue(df.equals(mapped.as_df()))
+        self.assertTrue((df + 1).equals(cacher.read_df('hash_df')))
+
+        cacher.evict(['hash_df'])
+        self.assertTrue(df.equals(mapped.as_df()))
+        self.assertTrue(cacher.read_df('hash_df').empty)
+
+    def test_released_space_is_bounded(self):
+        df = pd.DataFrame({'x': np.arange(10000.)})
+        for db in [None, os.path.join(self.cache_dir, 'custom.h5')]:
+            cacher = self._init_cacher(codec='none')
+            db_path = cacher.cache_db_path if db is None else cacher.to_db_path(db)
+            cacher.store_df('hash_df', df, db=db)
+            entry_size = cacher.catalog.get('hash_df')['size']
+            for idx in range(50):
+                cacher.store_df('hash_df', df + idx, db=db)
+                self.assertLessEqual(os.path.getsize(db_path), entry_size * 4)
+            self.assertTrue((df + 49).equals(cacher.read_df('hash_df', db=db)))
+
+    def test_released_space_counts_in_budget(self):
+        df = pd.DataFrame({'x': np.arange(10000.)})
+        cacher = self._init_cacher(codec='none')
+        cacher.store_df('hash_df', df)
+        entry_size = cacher.catalog.get('hash_df')['size']
+        cacher.configure(max_cache_size=int(entry_size * 1.5))
+        # the live entry is in the budget, the released one is not
+        cacher.store_df('hash_df', df + 1)
+        self.assertIn('hash_df', cacher.catalog)
+        self.assertLessEqual(os.path.getsize(cacher.cache_db_path), entry_size * 1.5)
+        self.assertTrue((df + 1).equals(cacher.read_df('hash_df')))
+
+    def test_store_overrides_entry(self):
+        cacher = self._init_cacher()
+        cacher.store_df('hash_df', self.df)
+        cacher.store_df('hash_df', self.df.iloc[:5])
+        self.assertEqual(len(cacher.catalog), 1)
+        self.assertEqual(len(cacher.read_df('hash_df')), 5)
+
+    def test_migrate_legacy_catalog(self):
+        legacy = pd.DataFrame([{'hash': 'old_hash',
+                                'date': '2021-01-01 00:00:00.000000',
+                                'key': Cacher.DF_KEY('old_hash'),
+                                'data_path': 'ariadne_cache_db.h5',
+                                'type': 'Dataframe',
+                                'commit': 'no revision'}])
+        legacy.to_csv(os.path.join(self.cache_dir, Cacher.CACHE_INFO_FILE),
+                      sep='\t', encoding='utf-8', mode='w', header=False)
+        cacher = self._init_cacher()
+        self.assertEqual(cacher.catalog.get('old_hash')['key'], Cacher.DF_KEY('old_hash'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, Cacher.CACHE_INFO_FILE)))
+        # second init does not import anything again
+        self._init_cacher()
+        self.assertEqual(len(cacher.catalog), 1)
+
+    def test_migrate_legacy_sizes(self):
+        cacher = self._init_cacher()
+        cacher.store_df('old_hash', self.df)
+        entry = cacher.catalog.get('old_hash')
+        cacher.catalog.remove(['old_hash'])
+        legacy = pd.DataFrame([{col: entry[col] for col in Cacher.COLUMNS[:6]}])
+        legacy.to_csv(os.path.join(self.cache_dir, Cacher.CACHE_INFO_FILE),
+                      sep='\t', encoding='utf-8', mode='w', header=False, index=False)
+        cacher = self._init_cacher()
+        self.assertEqual(cacher.catalog.get('old_hash')['size'], entry['size'])
+        self.assertGreater(entry['size'], 0)
+
+    def test_eviction_lru(self):
+        big_df = pd.DataFrame(np.random.RandomState(42).rand(50000, 3), columns=['x', 'y', 'z'])
+        cacher = self._init_cacher()
+        cacher.store_df('hash_0', big_df)
+        entry_size = cacher.catalog.get('hash_0')['size']
+        self.assertGreater(entry_size, 0)
+
+        cacher.configure(max_cache_size=int(entry_size * 2.5), eviction_watermark=1.)
+        cacher.store_df('hash_1', big_df)
+        cacher.read_df('hash_0')
+        cacher.store_df('hash_2', big_df)
+
+        # hash_1 is the least recently used one
+        self.assertNotIn('hash_1', cacher.catalog)
+        self.assertTrue(cacher.read_df('hash_1').empty)
+        self.assertTrue(big_df.equals(cacher.read_df('hash_0')))
+        self.assertLessEqual(os.path.getsize(cacher.cache_db_path), entry_size * 2.5)
+
+    def test_eviction_lfu(self):
+        cacher = self._init_cacher(eviction_policy='lfu')
+        for idx in range(3):
+            cacher.store_df(f'hash_{idx}', self.df)
+        for _ in range(2):
+            cacher.read_df('hash_0')
+            cacher.read_df('hash_2')
+        order = [entry['hash'] for entry in cacher.catalog.eviction_candidates(cacher.cache_db_path, 'lfu')]
+        self.assertEqual(order[0], 'hash_1')
+
+    def test_memory_tier(self):
+        cacher = self._init_cacher(memory_cache_size=10 ** 6)
+        cacher.store_df('hash_df', self.df)
+        first = cacher.read_df('hash_df')
+        self.assertEqual((cacher.stats['memory_miss'], cacher.stats['disk_hit']), (1, 1))
+
+        # returned frames are copies, modifying them does not touch the cached chunk
+        first.loc[:, 'x'] = -1.
+        second = cacher.read_df('hash_df')
+        self.assertEqual(cacher.stats['memory_hit'], 1)
+        self.assertTrue(self.df.equals(second))
+
+        cacher.store_df('hash_df', self.df.iloc[:5])
+        self.assertEqual(len(cacher.read_df('hash_df')), 5)
+        self.assertEqual(cacher.stats['disk_hit'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
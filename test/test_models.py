@@ -1,7 +1,11 @@
+import numpy as np
 import torch
 import unittest
 
 from unittest import TestCase
+from ariadne.graph_net.dataset import GraphEdgeBudgetSampler, collate_fn, packed_collate_fn, sparse_collate_fn
+from ariadne.graph_net.graph_utils.graph import SparseGraph, graph_to_sparse, sparse_to_graph
+from ariadne.graph_net.model import GraphNet_v1, SparseGraphNet_v1
 from ariadne.tracknet_v2.model import TrackNETv2
 
 
@@ -41,5 +45,74 @@ class TrackNETv2Test(TestCase):
         self.assertGreater(torch.min(out[:, :, 2:]).item(), 0)
 
 
+class SparseGraphNetTest(TestCase):
+    _batch_size = 4
+    _input_dim = 5
+
+    def _create_graphs(self):
+        rng = np.random.default_rng(0)
+        graphs = []
+        for _ in range(self._batch_size):
+            n_nodes, n_edges = rng.integers(5, 30), rng.integers(5, 60)
+            ends, starts = rng.integers(0, n_nodes, n_edges), rng.integers(0, n_nodes, n_edges)
+            Ri_cols, Ro_cols = np.argsort(ends, kind='stable'), np.argsort(starts, kind='stable')
+            graphs.append(SparseGraph(rng.random((n_nodes, self._input_dim), dtype=np.float32),
+                                      ends[Ri_cols], Ri_cols, starts[Ro_cols], Ro_cols,
+                                      rng.integers(0, 2, n_edges).astype(np.float32)))
+        return graphs
+
+    def test_same_as_dense(self):
+        dense_model = GraphNet_v1(input_dim=self._input_dim, hidden_dim=16, n_iters=2)
+        sparse_model = SparseGraphNet_v1(input_dim=self._input_dim, hidden_dim=16, n_iters=2)
+        sparse_model.load_state_dict(dense_model.state_dict())
+
+        graphs = self._create_graphs()
+        dense_graphs = [sparse_to_graph(**graph_to_sparse(graph)) for graph in graphs]
+        for size in [1, self._batch_size]:
+            dense_inputs, dense_target = collate_fn(dense_graphs[:size])
+            sparse_inputs, sparse_target = sparse_collate_fn(graphs[:size])
+            self.assertTrue(torch.equal(dense_target, sparse_target))
+            with torch.no_grad():
+                dense_out = dense_model(**dense_inputs)
+                sparse_out = sparse_model(**sparse_inputs)
+            self.assertTrue(torch.allclose(dense_out, sparse_out, rtol=0, atol=1e-6))
+
+    def test_packed_is_padded(self):
+        model = SparseGraphNet_v1(input_dim=self._input_dim, hidden_dim=16, n_iters=2)
+        graphs = self._create_graphs()
+        padded_inputs, _ = sparse_collate_fn(graphs)
+        packed_inputs, packed_target = packed_collate_fn(graphs)
+        self.assertEqual(packed_inputs['batch'].tolist(),
+                         sum([[i] * len(graph.X) for i, graph in enumerate(graphs)], []))
+        with torch.no_grad():
+            padded_out = model(**padded_inputs)
+            packed_out = model(**packed_inputs)
+        # edges of the padding are dropped, the others are the same
+        expected = torch.cat([padded_out[i, :len(graph.y)] for i, graph in enumerate(graphs)])
+        self.assertTrue(torch.allclose(packed_out, expected, rtol=0, atol=1e-6))
+        self.assertTrue(torch.equal(packed_target, torch.from_numpy(np.concatenate([graph.y for graph in graphs]))))
+
+    def test_edge_budget_sampler(self):
+        edges = [5, 40, 12, 7, 90, 30, 1, 22]
+
+        class EdgesSource(list):
+            def get_item_edges(self, item_index):
+                return self[item_index]
+
+        torch.manual_seed(0)
+        sampler = GraphEdgeBudgetSampler(EdgesSource(edges), max_edges=50, shuffle=True)
+        compositions = set()
+        for _ in range(5):
+            batches_num = len(sampler)
+            batches = list(sampler)
+            self.assertEqual(len(batches), batches_num)
+            compositions.add(tuple(sorted(tuple(sorted(batch)) for batch in batches)))
+            self.assertEqual(sorted(sum(batches, [])), list(range(len(edges))))
+            for batch in batches:
+                self.assertTrue(len(batch) == 1 or sum(edges[i] for i in batch) <= 50)
+        # the graphs are packed again every epoch
+        self.assertGreater(len(compositions), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ariadne_v2.mpd_format import DTYPE, MPDHitFile, is_mpd_file
+
+
+class MPDHitFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.data_dir, 'hits' + MPDHitFile.SUFFIX)
+        self.data = np.zeros(60, dtype=DTYPE)
+        # events are stored contiguously, not in the order of the ids
+        self.data['event'] = np.repeat([5, 2, 9, 3], [10, 20, 25, 5])
+        self.data['x'] = np.arange(60)
+        self.data['track'] = np.arange(60) % 7
+        self.data.tofile(self.data_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_event_access(self):
+        hits = MPDHitFile(self.data_path)
+        self.assertTrue(os.path.exists(self.data_path + MPDHitFile.INDEX_SUFFIX))
+        self.assertEqual(len(hits), 4)
+        event = hits.event(9)
+        self.assertEqual(event.x.tolist(), list(range(30, 55)))
+        self.assertEqual(event.index.tolist(), list(range(30, 55)))
+        self.assertEqual(hits.read([3, 5]).x.tolist(), list(range(0, 10)) + list(range(55, 60)))
+        self.assertEqual(list(hits.read().columns), list(DTYPE.names))
+
+        # the saved index is reused, a changed file is indexed again
+        self.assertTrue(np.array_equal(MPDHitFile(self.data_path).event_ids, [2, 3, 5, 9]))
+        self.data['event'] = np.repeat([1, 2], 30)
+        self.data.tofile(self.data_path)
+        os.utime(self.data_path, ns=(0, 0))
+        self.assertTrue(np.array_equal(MPDHitFile(self.data_path).event_sizes, [30, 30]))
+
+
+    def test_text_dat_file(self):
+        self.assertTrue(is_mpd_file(self.data_path))
+        text_path = os.path.join(self.data_dir, 'text' + MPDHitFile.SUFFIX)
+        # the text table of the size of whole records is not taken as the mpd file either
+        row = '0 0.5 -1.25 3.0 1 7\n'
+        with open(text_path, 'w') as f:
+            f.write(row * DTYPE.itemsize)
+        self.assertFalse(is_mpd_file(text_path))
+        with open(text_path, 'w') as f:
+            f.write(row * 3)
+        self.assertFalse(is_mpd_file(text_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+
+import pandas as pd
+
+from ariadne_v2 import jit_cacher
+from ariadne_v2.event_filter import EventFilter
+from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.parsing import parse_df_chunks, parse_df_filtered
+
+CSV_PATH = 'resources/test_data/cgem_50_events.txt'
+CSV_PARAMS = {
+    "sep": r'\s+',
+    "encoding": 'utf-8',
+    "names": ['event', 'x', 'y', 'z', 'station', 'track']
+}
+
+
+class ParseDfChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+
+    def test_event_aligned_chunks(self):
+        chunks = list(parse_df_chunks(CSV_PATH, chunk_rows=500, **CSV_PARAMS))
+        self.assertGreater(len(chunks), 1)
+        for first, second in zip(chunks[:-1], chunks[1:]):
+            self.assertLess(first.event.max(), second.event.min())
+        self.assertTrue(self.df.equals(pd.concat(chunks)))
+
+    def test_selected_events(self):
+        chunks = list(parse_df_chunks(CSV_PATH, chunk_rows=500, event_idxs=[3, 4, 10], **CSV_PARAMS))
+        expected = self.df[self.df.event.isin([3, 4, 10])]
+        self.assertTrue(expected.equals(pd.concat(chunks)))
+
+    def test_event_filter(self):
+        event_filter = EventFilter(events=[[10, 20], [0, 2]], stations=[0, 1], predicates=[('z', '<', 0.)])
+        # the repr is canonical, so equal filters have equal hashes
+        self.assertEqual(repr(event_filter), repr(EventFilter(events=[[0, 2], [10, 20]], stations=[1, 0],
+                                                              predicates=[('z', '<', 0.)])))
+        chunks = list(parse_df_chunks(CSV_PATH, chunk_rows=500, row_filter=event_filter, **CSV_PARAMS))
+        df = self.df
+        expected = df[(df.event.between(0, 2) | df.event.between(10, 20)) & df.station.isin([0, 1]) & (df.z < 0.)]
+        self.assertGreater(len(expected), 0)
+        self.assertTrue(expected.equals(pd.concat(chunks)))
+
+
+class ParseDfFilteredTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cacher = Cacher(cache_path=self.cache_dir)
+        self.cacher.init()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_chunk_rows_not_in_hash(self):
+        event_filter = EventFilter(stations=[0, 1])
+        with mock.patch.object(jit_cacher, 'instance', partial(jit_cacher.instance, self.cacher)):
+            df, hash = parse_df_filtered(CSV_PATH, event_filter, chunk_rows=500, **CSV_PARAMS)
+            other_df, other_hash = parse_df_filtered(CSV_PATH, event_filter, chunk_rows=2000, **CSV_PARAMS)
+        self.assertEqual(hash, other_hash)
+        self.assertTrue(df.equals(other_df))
+        self.assertEqual(len(self.cacher.catalog), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
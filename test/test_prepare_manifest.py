@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import gin
+import numpy as np
+
+from ariadne_v2 import jit_cacher
+from ariadne_v2.inference import IPostprocessor
+from ariadne_v2.jit_cacher import Cacher
+from ariadne_v2.prepare_manifest import PrepareManifest
+from experiments.graph.inferrer import GraphDataset
+from prepare_mp import build_config_key, build_run_key, EventProcessor
+
+CONFIG = """
+parse.input_file_mask = 'resources/test_data/cgem_50_events.txt'
+preprocess_mp.process_num = %d
+preprocess_mp.chunk_size = 4
+DropShort.num_stations = %d
+"""
+
+
+class PrepareManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manifest_dir = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.manifest_dir, PrepareManifest.MANIFEST_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.manifest_dir, ignore_errors=True)
+
+    def test_ranges(self):
+        self.assertEqual(PrepareManifest.to_ranges([5, 1, 2, 3, 7, 8]), [[1, 3], [5, 5], [7, 8]])
+        self.assertEqual(PrepareManifest.merge_ranges([[1, 3], [7, 8]], [[4, 5], [10, 12]]),
+                         [[1, 5], [7, 8], [10, 12]])
+
+    def test_resume(self):
+        manifest = PrepareManifest(self.manifest_path)
+        manifest.start('file.txt', 'key')
+        manifest.add_part('file.txt', 'ds_p0', PrepareManifest.to_ranges([0, 1, 2, 5]))
+
+        # the progress survives the restart of the run
+        manifest = PrepareManifest(self.manifest_path)
+        entry = manifest.start('file.txt', 'key')
+        self.assertEqual(entry['attempt'], 1)
+        self.assertEqual(manifest.unmerged_parts('file.txt'), ['ds_p0'])
+        mask = manifest.completed_mask('file.txt', np.arange(7))
+        self.assertEqual(mask.tolist(), [True, True, True, False, False, True, False])
+
+        manifest.mark_merged('file.txt', ['ds_p0'])
+        manifest.mark_complete('file.txt')
+        self.assertTrue(manifest.is_complete('file.txt'))
+        self.assertEqual(manifest.unmerged_parts('file.txt'), [])
+
+    def test_key_change_starts_over(self):
+        manifest = PrepareManifest(self.manifest_path)
+        manifest.start('file.txt', 'key')
+        manifest.add_part('file.txt', 'ds_p0', [[0, 10]])
+        entry = manifest.start('file.txt', 'other_key')
+        self.assertEqual(entry['events'], [])
+        self.assertFalse(manifest.completed_mask('file.txt', np.arange(3)).any())
+
+    def test_merged_key_change_is_refused(self):
+        manifest = PrepareManifest(self.manifest_path)
+        manifest.start('file.txt', 'key', 'config')
+        manifest.add_part('file.txt', 'ds_p0', [[0, 10]])
+        manifest.mark_merged('file.txt', ['ds_p0'])
+        self.assertTrue(manifest.matches_config('config'))
+        self.assertFalse(manifest.matches_config('other_config'))
+        with self.assertRaises(RuntimeError):
+            manifest.start('file.txt', 'other_key', 'config')
+
+
+class RunKeyTestCase(unittest.TestCase):
+    def tearDown(self):
+        gin.clear_config()
+
+    def run_key(self, process_num, num_stations):
+        gin.clear_config()
+        gin.parse_config(CONFIG % (process_num, num_stations))
+        return build_run_key('source_hash', build_config_key(gin.config_str()))
+
+    def test_same_config_same_key(self):
+        key = self.run_key(2, 3)
+        self.assertEqual(self.run_key(2, 3), key)
+        # the number of the processes does not change the output
+        self.assertEqual(self.run_key(8, 3), key)
+        self.assertNotEqual(self.run_key(2, 4), key)
+
+
+class AddGraphs(IPostprocessor):
+    def __call__(self, data, ds, idx):
+        ds.add(idx, {col: np.zeros((data, 2)) for col in GraphDataset.DATA_COLUMNS})
+        return True
+
+
+class ResubmitTestCase(unittest.TestCase):
+    class Killed(BaseException):
+        pass
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cacher = Cacher(cache_path=self.cache_dir)
+        self.cacher.init()
+        self.manifest = PrepareManifest(os.path.join(self.cache_dir, PrepareManifest.MANIFEST_FILE))
+        self.dataset = GraphDataset('graphs')
+        with self.dataset.open_dataset(self.cacher, 'graphs'):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def run_worker(self, prefix, events, killed=False):
+        result_queue = mock.Mock()
+        if killed:
+            # the worker dies after the merge of its local data, but before the checkpoint
+            result_queue.put.side_effect = self.Killed()
+        worker = EventProcessor(None, 'file.txt', None, AddGraphs(), self.dataset, 0, prefix,
+                                4, None, None, result_queue, None, None)
+        writer = worker.start_part(self.cacher, 0)
+        for ev_id in events:
+            writer.add(ev_id + 1, f'graph_file.txt_{ev_id}')
+            worker.part_events.append(ev_id)
+        if killed:
+            with self.assertRaises(self.Killed):
+                worker.submit_part(writer)
+            return
+        self.assertTrue(worker.submit_part(writer))
+        code, part, ranges = result_queue.put.call_args[0][0]
+        self.assertEqual(code, -3)
+        self.manifest.add_part('file.txt', part, ranges)
+
+    def merge(self):
+        parts = self.manifest.unmerged_parts('file.txt')
+        with self.dataset.open_dataset(self.cacher, 'graphs', drop_old=False) as ds:
+            ds.global_submit(parts)
+            info_df = ds.meta.get_df(GraphDataset.INFO_DF_NAME)
+            # every row points to the merged data
+            for name, rows in zip(info_df['name'], info_df['X']):
+                self.assertEqual(ds.get(name)['X'].shape[0], rows)
+            return info_df, ds.meta[GraphDataset.LEN_KEY], list(ds.meta[GraphDataset.REFS_KEY])
+
+    def test_killed_before_checkpoint(self):
+        instance = jit_cacher.instance
+        with mock.patch.object(jit_cacher, 'instance', lambda existing=None: instance(existing or self.cacher)):
+            self.manifest.start('file.txt', 'key')
+            self.run_worker('graphs_file.txt', [0, 1, 2], killed=True)
+
+            # the resumed run processes the events again
+            entry = self.manifest.start('file.txt', 'key')
+            self.assertFalse(self.manifest.completed_mask('file.txt', np.arange(3)).any())
+            self.run_worker(f"graphs_file.txt_a{entry['attempt']}", [0, 1, 2])
+            info_df, length, refs = self.merge()
+            self.assertEqual(sorted(info_df['X']), [1, 2, 3])
+            self.assertEqual(length, 3)
+
+            # the run stopped after the merge, but before recording it, merges the same parts again
+            info_df, length, refs_again = self.merge()
+            self.assertEqual(len(info_df), 3)
+            self.assertEqual(length, 3)
+            self.assertEqual(refs_again, refs)
+
+
+if __name__ == '__main__':
+    unittest.main()
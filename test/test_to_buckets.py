@@ -0,0 +1,56 @@
+import contextlib
+import hashlib
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ariadne_v2.transformations import ToBuckets
+
+CSV_PATH = 'resources/test_data/cgem_50_events.txt'
+CSV_PARAMS = {
+    "sep": r'\s+',
+    "encoding": 'utf-8',
+    "names": ['event', 'x', 'y', 'z', 'station', 'track']
+}
+
+# md5 of the bucket indices and of the bucket column made by the per-length groupby implementation
+EXPECTED = [
+    ({}, 'bbb40f9813f6c6250b7410dd3192da82', '3d6873e2b5cbdd841c5ba57ce9d0e242'),
+    ({'shuffle': True, 'max_bucket_size': 30}, '27b29da195edcdaf187254c1f6d50297', 'c0d48c31539ba01679fbe1de0a329850'),
+    ({'max_stations': 5, 'shuffle': True}, 'c9e283fe857d74ab174843f35161f664', 'a05705b0a53f2727b1886ef384c96de7'),
+]
+
+
+class ToBucketsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.read_csv(CSV_PATH, **CSV_PARAMS)
+
+    def test_same_buckets(self):
+        for params, index_hash, bucket_hash in EXPECTED:
+            transformer = ToBuckets(**params)
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                result = transformer(self.df.copy())
+            self.assertEqual(stdout.getvalue(), '')
+
+            index = hashlib.md5()
+            for _, bucket in sorted(transformer.get_bucket_index().items()):
+                index.update(np.asarray(bucket, dtype=np.int64).tobytes())
+            self.assertEqual(index.hexdigest(), index_hash, params)
+            buckets = hashlib.md5(result['bucket'].values.astype(np.int64).tobytes())
+            self.assertEqual(buckets.hexdigest(), bucket_hash, params)
+
+    def test_split(self):
+        transformer = ToBuckets(flat=False, shuffle=True)
+        result = transformer(self.df.copy())
+        # every hit is in one bucket at most and every bucket takes the same number of hits of each track
+        index = np.concatenate([bucket.index.values for bucket in result.values()])
+        self.assertEqual(len(index), len(np.unique(index)))
+        for n_points, bucket in result.items():
+            self.assertTrue((bucket.groupby(['event', 'track']).size() == n_points).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
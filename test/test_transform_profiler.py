@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ariadne_v2.transform_profiler import TransformProfiler, PROFILER
+from ariadne_v2.transformations import Compose, DropFakes, DropShort
+
+
+class TransformProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+        PROFILER.disable()
+        PROFILER.reset()
+
+    def test_disabled(self):
+        profiler = TransformProfiler()
+        with profiler.measure('label', 10) as record:
+            record.rows_out = 5
+        self.assertEqual(profiler.stats, {})
+
+    def test_nested_and_merge(self):
+        profiler = TransformProfiler()
+        profiler.enable()
+        with profiler.measure('outer', 10) as outer:
+            with profiler.measure('inner', 10) as inner:
+                inner.rows_out = 3
+                inner.cache = 'miss'
+                arr = np.ones(2 ** 20)
+            del arr
+            outer.rows_out = 3
+        self.assertEqual(profiler.stats['inner']['rows_out'], 3)
+        self.assertEqual(profiler.stats['inner']['cache_misses'], 1)
+        # the memory of the inner call is in the peak of the outer one
+        self.assertGreaterEqual(profiler.stats['outer']['max_memory'], profiler.stats['inner']['max_memory'])
+
+        worker = TransformProfiler()
+        worker.merge(json.loads(json.dumps(profiler.stats)))
+        worker.merge(profiler.stats)
+        self.assertEqual(worker.stats['outer']['calls'], 2)
+        self.assertEqual(worker.stats['outer']['max_time'], profiler.stats['outer']['max_time'])
+
+        profiler.dump(self.out_dir, 'profile')
+        with open(os.path.join(self.out_dir, 'profile.json')) as f:
+            self.assertEqual(json.load(f), profiler.stats)
+        self.assertTrue(os.path.exists(os.path.join(self.out_dir, 'profile.txt')))
+
+    def test_compose(self):
+        df = pd.DataFrame({'event': [0] * 6, 'x': np.arange(6.), 'y': np.arange(6.), 'z': np.arange(6.),
+                           'station': [0, 1, 2, 0, 1, 0], 'track': [0, 0, 0, 1, 1, -1]})
+        PROFILER.enable()
+        Compose([DropShort(num_stations=3, keep_filtered=False), DropFakes()]).apply(df)
+        self.assertEqual(PROFILER.stats['Compose[0]: DropShort']['rows_in'], 6)
+        self.assertEqual(PROFILER.stats['Compose[0]: DropShort']['rows_out'], 4)
+        self.assertEqual(PROFILER.stats['Compose[1]: DropFakes']['rows_out'], 3)
+
+        # the same instance twice in the chain is labeled by its positions
+        drop_fakes = DropFakes()
+        Compose([drop_fakes, DropShort(num_stations=3, keep_filtered=False), drop_fakes]).apply(df)
+        self.assertEqual(PROFILER.stats['Compose[0]: DropFakes']['rows_out'], 5)
+        self.assertEqual(PROFILER.stats['Compose[2]: DropFakes']['rows_in'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,9 @@ import pandas as pd
 import numpy as np
 import itertools
 
+import ariadne.transformations
+import ariadne_v2.transformations
+
 from ariadne.transformations import (
     StandardScale,
     MinMaxScale,
@@ -16,7 +19,8 @@ from ariadne.transformations import (
     ToBuckets, 
     ConstraintsNormalize,
 BakeStationValues,
-DropTracksWithHoles
+DropTracksWithHoles,
+BaseFilter
 )
 
 path = '../data/200.csv'
@@ -330,6 +334,95 @@ class DropHolesTestCase(unittest.TestCase):
         self.assertEqual(self.transformer.get_num_broken(), 1)
 
 
+class VectorizedFiltersTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        size = 20000
+        self.data = pd.DataFrame({'x': rng.rand(size),
+                                  'y': rng.rand(size),
+                                  'z': rng.rand(size),
+                                  'track': rng.randint(-1, 200, size),
+                                  'station': rng.randint(0, 5, size),
+                                  'event': np.sort(rng.randint(0, 10, size))})
+
+    def test_same_as_filter_rule(self):
+        for transforms in [ariadne.transformations, ariadne_v2.transformations]:
+            for make_transformer in [lambda: transforms.DropShort(num_stations=3),
+                                     lambda: transforms.DropShort(keep_filtered=False),
+                                     lambda: transforms.DropSpinningTracks(),
+                                     lambda: transforms.DropTracksWithHoles(min_station_num=1, keep_filtered=False),
+                                     lambda: transforms.DropTracksWithHoles(min_station_num=1.5, keep_filtered=False),
+                                     lambda: transforms.DropTracksWithHoles()]:
+                vectorized, by_rule = make_transformer(), make_transformer()
+                with self.subTest(module=transforms.__name__, transformer=type(vectorized).__name__):
+                    # the base implementation calls filter_rule for every track
+                    by_rule.good_hits = lambda data, tracks: transforms.BaseFilter.good_hits(by_rule, data, tracks)
+                    expected = by_rule(self.data.copy())
+                    self.assertTrue(vectorized(self.data.copy()).equals(expected))
+                    self.assertEqual(vectorized.get_num_broken(), by_rule.get_num_broken())
+                    self.assertGreater(vectorized.get_num_broken(), 0)
+
+    def test_columns_same_as_filter_rule(self):
+        # the filters fused by the v2 Compose run on the columns of the frame
+        transforms = ariadne_v2.transformations
+        for make_transformer in [lambda: transforms.DropShort(num_stations=3),
+                                 lambda: transforms.DropShort(keep_filtered=False),
+                                 lambda: transforms.DropSpinningTracks(),
+                                 lambda: transforms.DropTracksWithHoles(min_station_num=1, keep_filtered=False),
+                                 lambda: transforms.DropTracksWithHoles(min_station_num=1.5, keep_filtered=False),
+                                 lambda: transforms.DropTracksWithHoles()]:
+            vectorized, by_rule = make_transformer(), make_transformer()
+            with self.subTest(transformer=type(vectorized).__name__):
+                by_rule.good_hits = lambda data, tracks: transforms.BaseFilter.good_hits(by_rule, data, tracks)
+                expected = by_rule(self.data.copy()).reset_index(drop=True)
+                frame = transforms.ColumnFrame(self.data.copy())
+                self.assertTrue(vectorized.transform_columns(frame))
+                self.assertTrue(frame.to_df().equals(expected))
+                self.assertEqual(vectorized.get_num_broken(), by_rule.get_num_broken())
+
+    def test_float_min_station_num(self):
+        # the non-integer start keeps the same tracks as the range of the stations from it
+        for transforms in [ariadne.transformations, ariadne_v2.transformations]:
+            for min_station_num in [1.5, -0.5]:
+                with self.subTest(module=transforms.__name__, min_station_num=min_station_num):
+                    vectorized = transforms.DropTracksWithHoles(min_station_num=min_station_num, keep_filtered=False)
+                    by_rule = transforms.DropTracksWithHoles(keep_filtered=False)
+                    by_rule.filter_rule = lambda x: len(x) == len(np.arange(min_station_num, int(x.station.max()))) + 1
+                    by_rule.good_hits = lambda data, tracks: transforms.BaseFilter.good_hits(by_rule, data, tracks)
+                    self.assertTrue(vectorized(self.data.copy()).equals(by_rule(self.data.copy())))
+
+
+class StationConstraintsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = pd.DataFrame({'x': [1., 2., 3., 10., 30.],
+                                  'y': [0., 1., 2., 0., 4.],
+                                  'z': [-1., 1., 0., 5., 7.],
+                                  'track': [1, 1, 2, 2, -1],
+                                  'station': [0, 0, 0, 1, 1],
+                                  'event': [0, 0, 0, 0, 0]})
+
+    def test_computed_constraints(self):
+        transformer = ConstraintsNormalize(use_global_constraints=False, margin=1.)
+        result = transformer(self.data.copy())
+        self.assertEqual(list(transformer.constraints.keys()), [0, 1])
+        self.assertEqual(transformer.constraints[1]['x'], (9., 31.))
+        self.assertEqual(repr(transformer.constraints[1]['x']), '(9.0, 31.0)')
+        # x of station 0 is in [0, 4], of station 1 in [9, 31]
+        np.testing.assert_allclose(result['x'].values, [-0.5, 0., 0.5, -10 / 11, 10 / 11])
+
+    def test_nan_values(self):
+        transformer = ConstraintsNormalize(use_global_constraints=False)
+        with self.assertRaises(AssertionError):
+            transformer(self.data.assign(x=[1., np.nan, 3., 10., 30.]))
+
+    def test_out_of_range(self):
+        constraints = {0: {'x': (0., 4.), 'y': (-1., 3.), 'z': (-2., 2.)},
+                       1: {'x': (9., 31.), 'y': (-1., 1.), 'z': (4., 8.)}}
+        transformer = ConstraintsNormalize(use_global_constraints=False, constraints=constraints)
+        with self.assertRaises(AssertionError):
+            transformer(self.data.copy())
+
+
 class BakeColumnTestCase(unittest.TestCase):
     def _init_transformer(self, keep_filtered=True):
         self.transformer = BakeStationValues(values={0: 0.1, 1:0.3, 2: 0.5, 3:0.7})